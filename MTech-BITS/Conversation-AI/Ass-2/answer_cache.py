@@ -0,0 +1,152 @@
+"""Cache of final answers for paraphrased questions.
+
+QueryCache only helps when the same question is typed again. Here an entry
+is (query embedding, retrieved chunk ids, answer), and a new question is
+served the stored answer when its embedding is within `threshold` cosine
+similarity of the entry's *and* retrieval picked the same chunks, so the
+model would have been shown the same context. A question that is similar
+but retrieved other chunks counts as a near miss and goes to the model.
+
+Entries belong to one version (index version and model); a lookup or store
+under another version drops every entry. Memory is bounded up front: the
+embeddings live in one preallocated `max_entries` x dim float32 matrix, and
+answers longer than `max_answer_chars` are not stored. Entries are evicted
+LRU and expire after `ttl_seconds`.
+"""
+import time
+import threading
+from collections import OrderedDict, namedtuple
+from typing import Callable, Iterable, Optional, Sequence
+
+import numpy as np
+
+# Stands in for an LLM chunk: consumers read `.content`
+CachedChunk = namedtuple("CachedChunk", ["content"])
+
+_Entry = namedtuple("_Entry", ["doc_ids", "answer", "stored_at"])
+
+
+class SemanticAnswerCache:
+    """Answers looked up by query-embedding similarity and retrieval set."""
+
+    def __init__(self, max_entries: int = 512, threshold: float = 0.85, ttl_seconds: Optional[float] = 86400,
+                 max_answer_chars: int = 8000):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_answer_chars = max_answer_chars
+        self.version = None
+        self._matrix = None  # allocated on the first store, once dim is known
+        self._used = np.zeros(max_entries, dtype=bool)
+        self._entries = OrderedDict()  # slot -> _Entry, LRU first
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "near_misses": 0, "misses": 0, "stored": 0, "invalidations": 0}
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, version: str):
+        if version != self.version:
+            if self._entries:
+                self._counts["invalidations"] += 1
+            self._entries.clear()
+            self._used[:] = False
+            self.version = version
+
+    def _drop(self, slot: int):
+        del self._entries[slot]
+        self._used[slot] = False
+
+    def get(self, query_embedding, doc_ids: Sequence[int], version: str) -> Optional[str]:
+        """The cached answer for a close enough query with the same chunks, or None."""
+        wanted = frozenset(int(doc_id) for doc_id in doc_ids)
+        with self._lock:
+            self._check_version(version)
+            if self._matrix is None or not self._entries:
+                self._counts["misses"] += 1
+                return None
+            similarities = self._matrix @ self._unit(query_embedding)
+            similarities[~self._used] = -np.inf
+            near = False
+            for slot in np.argsort(-similarities):
+                if similarities[slot] < self.threshold:
+                    break
+                slot = int(slot)
+                entry = self._entries[slot]
+                if self.ttl_seconds is not None and time.time() - entry.stored_at > self.ttl_seconds:
+                    self._drop(slot)
+                    continue
+                if entry.doc_ids != wanted:
+                    near = True
+                    continue
+                self._entries.move_to_end(slot)
+                self._counts["hits"] += 1
+                return entry.answer
+            self._counts["near_misses" if near else "misses"] += 1
+            return None
+
+    def put(self, query_embedding, doc_ids: Sequence[int], answer: str, version: str):
+        if not answer or len(answer) > self.max_answer_chars:
+            return
+        vector = self._unit(query_embedding)
+        with self._lock:
+            self._check_version(version)
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            if len(self._entries) >= self.max_entries:
+                self._drop(next(iter(self._entries)))
+            slot = int(np.flatnonzero(~self._used)[0])
+            self._matrix[slot] = vector
+            self._used[slot] = True
+            self._entries[slot] = _Entry(frozenset(int(doc_id) for doc_id in doc_ids), answer, time.time())
+            self._counts["stored"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._used[:] = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counts["hits"] + self._counts["near_misses"] + self._counts["misses"]
+            return dict(
+                self._counts,
+                size=len(self._entries),
+                hit_ratio=self._counts["hits"] / lookups if lookups else 0.0,
+                nbytes=(self._matrix.nbytes if self._matrix is not None else 0)
+                + sum(len(entry.answer.encode("utf-8")) for entry in self._entries.values()),
+            )
+
+
+class RecordingStream:
+    """Passes an LLM chunk stream through and hands the full answer to
+    `on_complete` once it has been drained to the end."""
+
+    def __init__(self, stream: Iterable, on_complete: Callable[[str], None]):
+        self._iterator = iter(stream)
+        self._on_complete = on_complete
+        self._parts = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            if self._on_complete is not None:
+                self._on_complete("".join(self._parts))
+                self._on_complete = None
+            raise
+        self._parts.append(getattr(chunk, "content", "") or "")
+        return chunk
+
+    def close(self):
+        """Closes the underlying stream; a partial answer is not stored."""
+        self._on_complete = None
+        close = getattr(self._iterator, "close", None)
+        if close is not None:
+            close()
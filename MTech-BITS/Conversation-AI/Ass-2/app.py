@@ -1,209 +1,233 @@
 import os
-import glob
-import nltk
-import numpy as np
-from typing import List
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
 import streamlit as st
-from tqdm import tqdm
-from rank_bm25 import BM25Okapi
-from langchain_ollama import ChatOllama
+from retrieval_service import RetrievalService
+from model_registry import ModelRegistry, build_default_registry
+from vector_store import get_vector_store
+from query_cache import QueryCache
+from llm_metrics import LLMMetricsRecorder
+from guardrail import BatchedClassifier, GuardrailCascade
+from pipeline import StageTimings
+from chat_pipeline import ChatPipeline, get_ollama_llm
+from generation_scheduler import GenerationScheduler
+from context_packing import ContextPacker, context_budget
+from answer_cache import SemanticAnswerCache
+from llm_client import backend_stats
 # from langchain_deepseek import ChatDeepSeek
 # from langchain_openai import ChatOpenAI
 
-def get_ollama_llm(
-        model_name: str = None,
-        temperature: float = 0.8,
-    ):
-    llm = ChatOllama(
-        model=model_name,
-        temperature=temperature,
-        base_url=os.getenv('OLLAMA_URL'),
-    )
-    # llm = ChatOpenAI(
-    #     model="deepseek/deepseek-r1:free",
-    #     temperature=0,
-    #     max_tokens=None,
-    #     timeout=None,
-    #     max_retries=2,
-    #     api_key=os.getenv('OPENROUTER_DEEPSEEK_API_KEY'),
-    #     base_url='https://openrouter.ai/api/v1',
-    # )
-    return llm
-
-
-def ask_llm(llm, query):
-    response = llm.stream(f'{query}')
-    return response
-
-
-def read_markdown_chunks(files):
-    """Reads markdown files and returns a list of chunks."""
-    chunks = []
-    for file in tqdm(files, desc="Reading Markdown Files"):
-        with open(file, "r", encoding="utf-8") as f:
-            chunks.append(f.read())  # Assumes each file is a chunk
-    return chunks
-
-
-def hybrid_search(query: str, top_k=2, alpha=0.5) -> List[str]:
-    """Performs hybrid search using BM25 and embeddings, then combines results."""
-    from qdrant_client import QdrantClient
-    from langchain.embeddings import HuggingFaceEmbeddings
-    
-    nltk.download("punkt_tab")
-    
-    # Define embedding model
-    if 'embedding_model' not in st.session_state:
-        st.session_state.embedding_model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-    # Initialize Qdrant client
-    qdrant = QdrantClient(os.getenv('QDRANT_HOST'), api_key=os.getenv('QDRANT_API_KEY'))
-
-    # BM25 search (retrieve top-k results)
-    query_tokens = nltk.word_tokenize(query.lower())
-    bm25_scores = st.session_state.bm25.get_scores(query_tokens)
-
-    # Get top-k indices from BM25
-    bm25_top_k_idx = np.argsort(bm25_scores)[::-1][:top_k]
-    bm25_top_k_scores = [bm25_scores[i] for i in bm25_top_k_idx]
-    
-    # Embedding search in Qdrant
-    query_embedding = st.session_state.embedding_model.embed_query(query)
-    qdrant_results = qdrant.search(
-        collection_name='apl-fin-500',
-        query_vector=query_embedding,
-        limit=top_k
+
+SELECTED_MODEL = "phi4:latest"
+
+
+@st.cache_resource
+def get_model_registry() -> ModelRegistry:
+    """Models stay warm across requests, within MODEL_MEMORY_BUDGET_MB."""
+    return build_default_registry()
+
+
+@st.cache_resource
+def get_retrieval_service() -> RetrievalService:
+    """One read-only retrieval service per process, shared by all sessions."""
+    return RetrievalService(
+        # A chunk directory, or a packed corpus built by chunk_corpus.py
+        os.getenv('CHUNK_CORPUS', './financial-docs-md/chunks-500'),
+        os.getenv('BM25_INDEX_DIR', './index/bm25'),
+        get_model_registry(),
+        # VECTOR_STORE=qdrant (default) or local
+        get_vector_store(),
+        # Built by chunk_embeddings.py
+        embeddings_dir=os.getenv('CHUNK_EMBEDDINGS_DIR', './index/embeddings'),
+        # More segments than this are merged in the background
+        max_segments=int(os.getenv('MAX_INDEX_SEGMENTS', 4)),
     )
 
-    # Extract Qdrant indices and scores
-    qdrant_top_k_texts = [res.payload["text"] for res in qdrant_results]
-    qdrant_top_k_scores = np.array([res.score for res in qdrant_results])
 
-    # Normalize BM25 and Qdrant scores
-    bm25_top_k_scores = np.array(bm25_top_k_scores) / max(bm25_top_k_scores) if max(bm25_top_k_scores) > 0 else np.zeros_like(bm25_top_k_scores)
-    qdrant_top_k_scores = qdrant_top_k_scores / max(qdrant_top_k_scores)
+@st.cache_resource
+def get_query_cache() -> QueryCache:
+    """Retrieval results for repeated questions, shared by all sessions."""
+    return QueryCache(
+        max_entries=int(os.getenv('QUERY_CACHE_SIZE', '256')),
+        ttl_seconds=float(os.getenv('QUERY_CACHE_TTL', '3600')),
+        # Set QUERY_CACHE_PATH= (empty) to keep the cache in memory only
+        disk_path=os.getenv('QUERY_CACHE_PATH', './index/query_cache.sqlite') or None,
+    )
 
-    # Merge results (Hybrid score)
-    hybrid_scores = alpha * bm25_top_k_scores + (1 - alpha) * qdrant_top_k_scores
 
-    # Sort by final score
-    sorted_indices = np.argsort(hybrid_scores)[::-1]
+@st.cache_resource
+def get_guardrail() -> GuardrailCascade:
+    """Cheap lexical checks first; only ambiguous input reaches RoBERTa."""
+    models = get_model_registry()
+    return GuardrailCascade(
+        BatchedClassifier(lambda: models.get("toxicity")),
+        # Words from the filings themselves are taken as clearly benign
+        vocabulary=get_retrieval_service().bm25.vocab,
+    )
 
-    # Return final ranked documents
-    return [qdrant_top_k_texts[i] for i in sorted_indices]
 
+@st.cache_resource
+def get_pipeline_executor():
+    """Thread pool for RETRIEVAL_MODE=concurrent (the default), else None."""
+    if os.getenv('RETRIEVAL_MODE', 'concurrent') != 'concurrent':
+        return None
+    return ThreadPoolExecutor(
+        max_workers=int(os.getenv('RETRIEVAL_WORKERS', '8')),
+        thread_name_prefix='retrieval',
+    )
 
-def rerank_results(query: str, retrieved_docs: List[str]) -> List[str]:
-    """Re-ranks retrieved documents based on query relevance."""
-    from sentence_transformers import CrossEncoder
 
-    # Load a re-ranking model
-    reranker = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
-    
-    pairs = [(query, doc) for doc in retrieved_docs]
-    scores = reranker.predict(pairs)
-    
-    # Sort docs by re-ranking score
-    ranked_docs = [doc for _, doc in sorted(zip(scores, retrieved_docs), reverse=True)]
-    
-    return ranked_docs
+@st.cache_resource
+def get_llm_metrics() -> LLMMetricsRecorder:
+    """Per-message streaming latency, logged to a rotating file."""
+    return LLMMetricsRecorder(os.getenv('LLM_METRICS_PATH', './logs/llm_metrics.jsonl'))
 
 
-def fetch_ranked_relevant_docs(query) -> List[str]:
-    return rerank_results(query, hybrid_search(query))
+@st.cache_resource
+def get_shared_llm(model_name: str):
+    num_ctx = os.getenv('OLLAMA_NUM_CTX')
+    return get_ollama_llm(model_name, num_ctx=int(num_ctx) if num_ctx else None)
 
-def bm25_confidence(query, doc):
-    """Returns BM25 score as confidence for a document."""
-    query_tokens = query.split()
-    return st.session_state.bm25.get_scores(query_tokens)[st.session_state.chunks.index(doc)]
 
-def dense_confidence(query, doc):
-    """Computes cosine similarity between query & document embeddings."""
-    from sklearn.metrics.pairwise import cosine_similarity
-    query_vector = np.array(st.session_state.embedding_model.embed_query(query)).reshape(1, -1)
-    doc_vector = np.array(st.session_state.embedding_model.embed_query(doc)).reshape(1, -1)  # Use embed_query for single doc
+@st.cache_resource
+def get_context_packer(model_name: str) -> ContextPacker:
+    """Prompt context within the model's window (OLLAMA_NUM_CTX), or
+    CONTEXT_TOKEN_BUDGET if that is smaller."""
+    num_ctx = os.getenv('OLLAMA_NUM_CTX')
+    budget = context_budget(model_name, num_ctx=int(num_ctx) if num_ctx else None)
+    if os.getenv('CONTEXT_TOKEN_BUDGET'):
+        budget = min(budget, int(os.getenv('CONTEXT_TOKEN_BUDGET')))
+    return ContextPacker(budget)
 
-    return cosine_similarity(query_vector, doc_vector)[0][0]  # Single similarity value
 
+@st.cache_resource
+def get_generation_scheduler() -> GenerationScheduler:
+    """At most GENERATION_WORKERS answers stream from Ollama at once; the
+    rest queue fairly per session, up to the queue limits."""
+    return GenerationScheduler(
+        workers=int(os.getenv('GENERATION_WORKERS', '1')),
+        max_queue=int(os.getenv('GENERATION_QUEUE_LIMIT', '16')),
+        max_queue_per_user=int(os.getenv('GENERATION_QUEUE_PER_USER', '2')),
+    )
 
-def hybrid_confidence(query, doc, alpha=0.5):
-    """Combines BM25 and cosine similarity scores."""
-    bm25_score = bm25_confidence(query, doc)
-    dense_score = dense_confidence(query, doc)
 
-    # Normalize BM25 to 0-1 range (min-max scaling)
-    all_bm25_scores = [
-        st.session_state.bm25.get_scores(
-            query.split())[i] for i in range(len(st.session_state.chunks))]
+@st.cache_resource
+def get_answer_cache() -> SemanticAnswerCache:
+    """Answers reused for paraphrased questions that retrieve the same chunks."""
+    return SemanticAnswerCache(
+        max_entries=int(os.getenv('ANSWER_CACHE_SIZE', '512')),
+        threshold=float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.85')),
+        ttl_seconds=float(os.getenv('ANSWER_CACHE_TTL', '86400')),
+    )
 
-    # Get min and max BM25 scores
-    min_bm25 = min(all_bm25_scores)
-    max_bm25 = max(all_bm25_scores)
-    bm25_norm = (bm25_score - min_bm25) / (max_bm25 - min_bm25) if max_bm25 > min_bm25 else 0
 
-    return alpha * bm25_norm + (1 - alpha) * dense_score
+@st.cache_resource
+def get_chat_pipeline() -> ChatPipeline:
+    """Guardrail -> retrieve -> rerank -> generate, shared by all sessions."""
+    return ChatPipeline(
+        get_retrieval_service(),
+        get_guardrail(),
+        get_shared_llm(SELECTED_MODEL),
+        query_cache=get_query_cache(),
+        executor=get_pipeline_executor(),
+        metrics=get_llm_metrics(),
+        scheduler=get_generation_scheduler(),
+        packer=get_context_packer(SELECTED_MODEL),
+        answer_cache=get_answer_cache(),
+        fusion=os.getenv('FUSION_METHOD', 'rrf'),
+        # Candidates each retriever contributes before fusion
+        bm25_depth=int(os.getenv('BM25_DEPTH', '10')),
+        dense_depth=int(os.getenv('DENSE_DEPTH', '10')),
+    )
 
-# Input Guardrail
-def is_valid_input(user_query):
-    """Check if input is non-toxic and relevant."""
-    from transformers import pipeline
-    toxicity_filter = pipeline("text-classification", model="unitary/unbiased-toxic-roberta")
-    toxicity_score = toxicity_filter(user_query)[0]["score"]
-    logger.info(f"Toxicity score: {toxicity_score}")
-    if toxicity_score > 0.5:
-        return False, "Your input violates community guidelines."
-    # from better_profanity import profanity
-    # if profanity.contains_profanity(user_query):
-    #     return False, "Your input violates community guidelines."
-    return True, None
 
 def main():
-    # Read chunks and create BM25 index
-    data_dir = "./financial-docs-md/chunks-500"
-    md_files = glob.glob(f"{data_dir}/*.md")
-    # print(md_files)
-    if 'chunks' not in st.session_state:
-        st.session_state.chunks = read_markdown_chunks(md_files)
-    if 'bm25' not in st.session_state:
-        st.session_state.bm25 = BM25Okapi([nltk.word_tokenize(chunk.lower()) for chunk in st.session_state.chunks])
-    
     st.set_page_config(page_title='AAPL Financials Chatbot', page_icon='📈')
+    # Chunks, BM25 index and embedder are shared process-wide;
+    # session state only holds the chat history
+    service = get_retrieval_service()
     st.title(" Think different")
     st.markdown('## Assignment 2 - RAG Chatbot')
     st.markdown('#### Develop a Retrieval-Augmented Generation (RAG) model to answer financial questions based on company financial statements (last two years).')
     def chat_callback():
         if 'messages' not in st.session_state:
             st.session_state.messages = []
+        if 'user_id' not in st.session_state:
+            # Fairness key for the generation queue
+            st.session_state.user_id = uuid.uuid4().hex
         user_input = st.session_state.user_input
-        valid, message = is_valid_input(user_input)
+        # Guardrail, BM25 and dense search overlap; a rejection cancels the rest
+        timings = StageTimings()
+        guardrail = get_guardrail()
+        turn = get_chat_pipeline().run(user_input, timings=timings, user=st.session_state.user_id)
         logger.info(f'user_input: {user_input}')
         _message = {
             "role": "user",
             "content": user_input,
         }
         st.session_state.messages.append(_message)
-        if not valid:
+        if not turn.valid:
             response_msg = {
                 "role": "assistant",
-                "content": message,
+                "content": turn.message,
             }
             st.session_state.messages.append(response_msg)
             return
         
-        retrieved_docs = fetch_ranked_relevant_docs(user_input)
+        retrieved_docs, confidences = turn.docs, turn.confidences
         st.sidebar.markdown(f'User query: ```{user_input}```')
         st.sidebar.markdown(f'Retrieved doc chunks:')
-        for r_d in retrieved_docs:
+        for r_d, confidence in zip(retrieved_docs, confidences):
             st.sidebar.markdown(f'- {r_d}')
-            st.sidebar.markdown(f'Confidence: ```{round(hybrid_confidence(user_input, r_d),2)}```')
+            st.sidebar.markdown(f'Confidence: ```{round(float(confidence),2)}```')
+        memory = service.memory_report()
+        st.sidebar.markdown(f'Process memory: ```{memory["process_rss_mb"]:.0f} MB``` (models: ```{memory["models_mb"]:.0f} MB```)')
+        for name, stats in service.models.stats().items():
+            st.sidebar.markdown(
+                f'Model `{name}`: hits ```{stats["hits"]}```, misses ```{stats["misses"]}```, '
+                f'load time ```{stats["load_seconds"]:.1f}s```'
+            )
+        guardrail_stats = guardrail.stats()
+        st.sidebar.markdown(
+            f'Guardrail: cache ```{guardrail_stats["cache"]}```, '
+            f'lexical ```{guardrail_stats["lexical_accept"] + guardrail_stats["lexical_reject"]}```, '
+            f'model ```{guardrail_stats["model"]}``` '
+            f'(avg batch ```{guardrail_stats["avg_batch_size"]:.1f}```)'
+        )
+        cache_stats = get_query_cache().stats()
+        st.sidebar.markdown(
+            f'Query cache hit rate: ```{cache_stats["hit_rate"]:.0%}``` '
+            f'({cache_stats["hits"] + cache_stats["disk_hits"]} hits, {cache_stats["misses"]} misses)'
+        )
+        answer_stats = get_answer_cache().stats()
+        st.sidebar.markdown(
+            f'Answer cache hit ratio: ```{answer_stats["hit_ratio"]:.0%}``` '
+            f'({answer_stats["hits"]} hits, {answer_stats["near_misses"]} near misses, '
+            f'{answer_stats["misses"]} misses)'
+            + (' - this answer is cached' if turn.cached else '')
+        )
+        st.sidebar.markdown(f'Retrieval stages (total ```{timings.total_ms():.0f} ms```):')
+        for stage, timing in timings.as_dict().items():
+            st.sidebar.markdown(
+                f'- {stage}: ```{timing["duration_ms"]:.0f} ms``` (from {timing["start_ms"]:.0f} ms)'
+            )
+        scheduler_stats = get_generation_scheduler().stats()
+        st.sidebar.markdown(
+            f'Generation queue: ```{scheduler_stats["queued"]}``` waiting, '
+            f'```{scheduler_stats["active"]}```/{scheduler_stats["workers"]} generating, '
+            f'```{scheduler_stats["rejected"]}``` turned away'
+        )
+        if "queue_wait_ms" in scheduler_stats:
+            st.sidebar.markdown(
+                f'Generation queue wait: p50 ```{scheduler_stats["queue_wait_ms"]["p50"]:.0f} ms```, '
+                f'p95 ```{scheduler_stats["queue_wait_ms"]["p95"]:.0f} ms```'
+            )
         st.sidebar.markdown('---')
         response_msg = {
             "role": "assistant",
-            "content": ask_llm(
-                st.session_state.llm,
-                f'{retrieved_docs}\nQuestion: {user_input}',
-            ),
+            # The busy message when the generation queue is full
+            "content": turn.response if turn.response is not None else turn.message,
         }
         st.session_state.messages.append(response_msg)
 
@@ -219,15 +243,27 @@ def main():
     # selected_model = st.selectbox("Select AI Model", available_models, index=0)
     # if 'selected_model' not in st.session_state:
     #     st.session_state.selected_model = selected_model
-    st.session_state.selected_model = "phi4:latest"
-    
-    if 'llm' not in st.session_state:
-        st.session_state.llm = get_ollama_llm(
-            st.session_state.selected_model,
-        )
 
 
 
+    llm_metrics = get_llm_metrics()
+    with st.sidebar.expander('LLM latency (debug)'):
+        summary = llm_metrics.percentiles()
+        if not summary:
+            st.markdown('No answers streamed yet.')
+        for name, values in summary.items():
+            st.markdown(
+                f'{name}: p50 ```{values["p50"]:.1f}```, '
+                f'p95 ```{values["p95"]:.1f}```, p99 ```{values["p99"]:.1f}```'
+            )
+        st.markdown(f'Window: ```{len(llm_metrics)}``` messages')
+        for url, stats in backend_stats().items():
+            st.markdown(
+                f'{url}: circuit ```{stats["circuit"]}```, '
+                f'in flight ```{stats["in_flight"]}```/{stats["max_concurrency"]}, '
+                f'retries ```{stats["retries"]}```, failures ```{stats["failures"]}```'
+            )
+
     st.chat_input(
         "Search AAPL financials",
         on_submit=chat_callback,
@@ -247,9 +283,14 @@ def main():
             else:
                 ai_res_plchldr = st.empty()
                 ai_response = ""
-                for chunk in msg:
-                    ai_response += chunk.content  # Append each chunk to the response text
-                    ai_res_plchldr.write(ai_response)
+                try:
+                    for chunk in msg:
+                        ai_response += chunk.content  # Append each chunk to the response text
+                        ai_res_plchldr.write(ai_response)
+                finally:
+                    # A rerun or stop interrupts the loop; free the generation slot
+                    if hasattr(msg, 'close'):
+                        msg.close()
                 st.session_state.messages[idx]["content"] = ai_response
 
 
@@ -0,0 +1,136 @@
+"""Benchmark: rank_bm25.BM25Okapi vs the project's inverted-index BM25.
+
+Times top-k retrieval for a set of queries with four scorers and checks
+that all of them return the same ranking:
+
+- okapi:      BM25Okapi.get_scores + argsort (what the app used to run)
+- full:       BM25Index.get_scores + argsort
+- maxscore:   BM25Index.top_k with MaxScore pruning forced on
+- top_k:      BM25Index.top_k in its default mode (prunes long queries only)
+
+`--replicate N` repeats the corpus N times to see how each scorer grows with
+corpus size.
+
+    python bench_bm25.py --replicate 4 --k 10
+"""
+import json
+import time
+import argparse
+
+import nltk
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+from bm25_index import BM25Index, tokenize
+from chunk_corpus import read_corpus
+
+DEFAULT_QUERIES = [
+    "iPhone revenue 2024",
+    "research and development expense",
+    "What was the total net sales of the company in 2023?",
+    "Services gross margin",
+    "How much did Apple spend on share repurchases?",
+    "risk factors related to the supply chain and manufacturing",
+    "Greater China net sales",
+    "effective tax rate",
+    "Mac iPad Wearables Home and Accessories",
+    "operating income and operating expenses for the fiscal year",
+]
+
+
+def reference_top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positive-score docs by descending score, ties by doc id."""
+    positive = np.flatnonzero(scores > 0)
+    return positive[np.lexsort((positive, -scores[positive]))[:k]]
+
+
+def time_queries(fn, queries, repeat):
+    times = []
+    results = []
+    for tokens in queries:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = fn(tokens)
+        times.append((time.perf_counter() - start) / repeat * 1000)
+        results.append(result)
+    return np.array(times), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default="./financial-docs-md/chunks-500",
+                        help="Chunk directory or packed corpus file")
+    parser.add_argument("--queries", help="File with one query per line")
+    parser.add_argument("--replicate", type=int, default=1)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per query")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    nltk.download("punkt_tab", quiet=True)
+    _, chunks, _ = read_corpus(args.data_dir)
+    tokenized = [tokenize(chunk) for chunk in chunks] * args.replicate
+
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = DEFAULT_QUERIES
+    query_tokens = [tokenize(q) for q in queries]
+
+    start = time.perf_counter()
+    okapi = BM25Okapi(tokenized)
+    okapi_build = time.perf_counter() - start
+    start = time.perf_counter()
+    index = BM25Index.build(tokenized)
+    index_build = time.perf_counter() - start
+
+    k = args.k
+    scorers = {
+        "okapi": lambda q: reference_top_k(okapi.get_scores(q), k),
+        "full": lambda q: reference_top_k(index.get_scores(q), k),
+        "maxscore": lambda q: index.top_k(q, k, prune=True)[0],
+        "top_k": lambda q: index.top_k(q, k)[0],
+    }
+    report = {
+        "docs": len(tokenized),
+        "terms": len(index.vocab),
+        "postings": int(len(index.doc_ids)),
+        "queries": len(queries),
+        "k": k,
+        "build_s": {"okapi": okapi_build, "index": index_build},
+        "latency_ms": {},
+    }
+    rankings = {}
+    for name, fn in scorers.items():
+        times, rankings[name] = time_queries(fn, query_tokens, args.repeat)
+        report["latency_ms"][name] = {
+            "mean": float(times.mean()),
+            "p50": float(np.percentile(times, 50)),
+            "p95": float(np.percentile(times, 95)),
+        }
+    report["identical_rankings"] = all(
+        np.array_equal(ref, other)
+        for name in ("full", "maxscore", "top_k")
+        for ref, other in zip(rankings["okapi"], rankings[name])
+    )
+    okapi_mean = report["latency_ms"]["okapi"]["mean"]
+    report["speedup"] = {
+        name: okapi_mean / report["latency_ms"][name]["mean"] for name in ("full", "maxscore", "top_k")
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['docs']} docs, {report['terms']} terms, {report['postings']} postings, "
+          f"{len(queries)} queries, k={k}")
+    print(f"build: okapi {okapi_build:.2f}s, index {index_build:.2f}s")
+    print(f"{'scorer':<10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'speedup':>10}")
+    for name, latency in report["latency_ms"].items():
+        speedup = report["speedup"].get(name, 1.0)
+        print(f"{name:<10}{latency['mean']:>10.3f}{latency['p50']:>10.3f}{latency['p95']:>10.3f}{speedup:>9.1f}x")
+    print(f"identical rankings: {report['identical_rankings']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Offline retrieval evaluation: recall@k, MRR and per-stage latency.
+
+Runs a labeled query set (JSON lines of {"query", "relevant": [chunk file
+names]}) through each retrieval mode, at every `--top-k` and, for the
+hybrid modes, every `--alpha`:
+
+- bm25:           BM25 top-k
+- dense:          query embedding + vector store search
+- hybrid:         both, fused by chunk id as in the app
+- hybrid_rerank:  hybrid, then the reranker reorders the fused list
+                  (`ChatPipeline.retrieve` without the query cache)
+
+The stages are the ones the app runs (pipeline.py), timed with the same
+StageTimings. `--backend stub` (the default) swaps in stub_models.py and an
+in-memory local vector store built over the corpus, so the benchmark needs no
+network access; its relevance numbers only compare code paths. `--backend
+models` loads the real embedder and reranker and uses VECTOR_STORE.
+
+    python bench_retrieval.py --top-k 2 5 10 --alpha 0.3 0.5 0.7 --out retrieval_report.json
+"""
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+from loguru import logger
+
+from pipeline import StageTimings, bm25_candidates, dense_candidates, hybrid_candidates, rerank_candidates, timed
+from retrieval_service import build_service
+
+MODES = ["bm25", "dense", "hybrid", "hybrid_rerank"]
+
+
+def load_queries(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def retrieve(service, mode: str, query: str, top_k: int, alpha: float, args,
+             timings: StageTimings, executor=None) -> List[int]:
+    """Ranked chunk ids for one query in one mode."""
+    if mode == "bm25":
+        with timed(timings, "bm25"):
+            return [doc_id for doc_id, _ in bm25_candidates(service, query, top_k)]
+    if mode == "dense":
+        _, candidates, _ = dense_candidates(service, query, top_k, timings=timings)
+        return [doc_id for doc_id, _ in candidates]
+
+    # The app reranks only the fused top_k; --rerank-depth fuses more first
+    fused_k = max(top_k, args.rerank_depth or 0) if mode == "hybrid_rerank" else top_k
+    depth = max(args.depth, fused_k)
+    ranked, _, _ = hybrid_candidates(service, query, top_k=fused_k, alpha=alpha, bm25_depth=depth,
+                                     dense_depth=depth, fusion=args.fusion, executor=executor, timings=timings)
+    if mode == "hybrid_rerank":
+        with timed(timings, "rerank"):
+            ranked = rerank_candidates(service, query, ranked)
+    return ranked[:top_k]
+
+
+def recall_at_k(retrieved: List[str], relevant: set, k: int) -> float:
+    return len(relevant.intersection(retrieved[:k])) / len(relevant) if relevant else 0.0
+
+
+def reciprocal_rank(retrieved: List[str], relevant: set) -> float:
+    for rank, name in enumerate(retrieved, 1):
+        if name in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    values = np.asarray(values)
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+    }
+
+
+def evaluate(service, queries: List[dict], mode: str, top_k: int, alpha, args, executor=None) -> dict:
+    """Recall@k, MRR and per-stage latency of one configuration."""
+    recalls, reciprocal_ranks = [], []
+    stage_ms: Dict[str, List[float]] = {}
+    total_ms = []
+    for item in queries:
+        relevant = set(item["relevant"])
+        for _ in range(args.repeat):
+            timings = StageTimings()
+            start = time.perf_counter()
+            ranked = retrieve(service, mode, item["query"], top_k, alpha, args, timings, executor)
+            total_ms.append((time.perf_counter() - start) * 1000)
+            for stage, timing in timings.as_dict().items():
+                stage_ms.setdefault(stage, []).append(timing["duration_ms"])
+        names = [service.store.filename(doc_id) for doc_id in ranked]
+        recalls.append(recall_at_k(names, relevant, top_k))
+        reciprocal_ranks.append(reciprocal_rank(names, relevant))
+    return {
+        "mode": mode,
+        "top_k": top_k,
+        "alpha": alpha,
+        "recall": float(np.mean(recalls)),
+        "mrr": float(np.mean(reciprocal_ranks)),
+        "latency_ms": {"total": latency_summary(total_ms),
+                       **{stage: latency_summary(values) for stage, values in stage_ms.items()}},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default=os.getenv("CHUNK_CORPUS", "./financial-docs-md/chunks-500"),
+                        help="Chunk directory or packed corpus file")
+    parser.add_argument("--index-dir", default=os.getenv("BM25_INDEX_DIR", "./index/bm25"))
+    parser.add_argument("--queries", default="./eval_queries.jsonl", help="Labeled queries (JSON lines)")
+    parser.add_argument("--backend", choices=["stub", "models"], default="stub")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--top-k", type=int, nargs="+", default=[2, 5, 10])
+    parser.add_argument("--alpha", type=float, nargs="+", default=[0.5], help="BM25 weight in fusion")
+    parser.add_argument("--depth", type=int, default=10, help="Candidates per retriever before fusion")
+    parser.add_argument("--rerank-depth", type=int, help="Fused candidates to rerank (default: top_k, as in the app)")
+    parser.add_argument("--fusion", default=os.getenv("FUSION_METHOD", "rrf"))
+    parser.add_argument("--concurrent", action="store_true", help="Overlap BM25 and dense search as in the app")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per query")
+    parser.add_argument("--out", help="Write the JSON report here")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    service = build_service(args.data_dir, args.index_dir, args.backend,
+                            embeddings_dir=os.getenv("CHUNK_EMBEDDINGS_DIR", "./index/embeddings"))
+    unknown = {name for item in queries for name in item["relevant"]
+               if service.store.id_for_filename(name) is None}
+    if unknown:
+        logger.warning(f"{len(unknown)} labeled chunks are not in the corpus and count as misses: {sorted(unknown)[:5]}")
+
+    executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval") if args.concurrent else None
+    # Load models and warm caches before anything is timed
+    for mode in args.modes:
+        retrieve(service, mode, queries[0]["query"], max(args.top_k), args.alpha[0], args, StageTimings(), executor)
+
+    results = []
+    for mode in args.modes:
+        for top_k in args.top_k:
+            for alpha in (args.alpha if mode.startswith("hybrid") else [None]):
+                results.append(evaluate(service, queries, mode, top_k, alpha, args, executor))
+    if executor is not None:
+        executor.shutdown()
+
+    report = {
+        "backend": args.backend,
+        "corpus": args.data_dir,
+        "chunks": len(service.store),
+        "queries": len(queries),
+        "fusion": args.fusion,
+        "concurrent": args.concurrent,
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['chunks']} chunks, {len(queries)} queries, {args.backend} backend")
+    print(f"{'mode':<15}{'k':>4}{'alpha':>7}{'recall':>9}{'mrr':>7}{'p50 ms':>9}{'p95 ms':>9}")
+    for result in results:
+        alpha = "" if result["alpha"] is None else f"{result['alpha']:.2f}"
+        total = result["latency_ms"]["total"]
+        print(f"{result['mode']:<15}{result['top_k']:>4}{alpha:>7}{result['recall']:>9.3f}"
+              f"{result['mrr']:>7.3f}{total['p50']:>9.2f}{total['p95']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
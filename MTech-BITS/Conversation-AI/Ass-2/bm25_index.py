@@ -0,0 +1,264 @@
+"""Persistent BM25 index over the markdown chunk corpus.
+
+An index is written to a directory of numpy arrays (postings, document
+lengths, IDF table) plus a small JSON header, and memory-mapped at startup
+instead of re-tokenizing the corpus. segments.py keeps the corpus as a list of
+these indexes so new chunks can be appended without a rebuild.
+
+Scores are identical to `rank_bm25.BM25Okapi` built over the same tokens.
+`top_k` returns the same ranking as sorting `get_scores`, but uses per-term
+score upper bounds (MaxScore) to skip most postings of common terms.
+"""
+import os
+import json
+import math
+from collections import Counter
+from typing import List, Optional, Tuple
+
+import nltk
+import numpy as np
+
+# Bump whenever the on-disk layout or the tokenization changes.
+INDEX_FORMAT_VERSION = 2
+
+_META_FILE = "meta.json"
+_VOCAB_FILE = "vocab.json"
+_ARRAYS = ("idf", "doc_len", "indptr", "doc_ids", "tfs", "max_impact")
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokenizer used for both indexing and querying."""
+    return nltk.word_tokenize(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 over term-major posting lists (CSR layout).
+
+    For term id `t`, `doc_ids[indptr[t]:indptr[t + 1]]` are the documents that
+    contain it (ascending) and `tfs[...]` the matching term frequencies.
+    `max_impact[t]` is the largest score the term adds to any document.
+    """
+
+    # Below this many postings for a query, one vectorised pass is cheaper
+    # than MaxScore's bookkeeping.
+    prune_min_postings = 250_000
+
+    def __init__(self, vocab, idf, doc_len, indptr, doc_ids, tfs, max_impact=None,
+                 k1=1.5, b=0.75, epsilon=0.25, content_hash=None):
+        self.vocab = vocab
+        self.term_ids = {term: i for i, term in enumerate(vocab)}
+        self.idf = idf
+        self.doc_len = doc_len
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.content_hash = content_hash
+        self.corpus_size = len(doc_len)
+        self.avgdl = int(np.sum(doc_len)) / self.corpus_size
+        # Per-document length normalisation, same expression as BM25Okapi.
+        self.doc_norm = self.k1 * (1 - self.b + self.b * np.asarray(doc_len, dtype=np.float64) / self.avgdl)
+        self.max_impact = max_impact if max_impact is not None else self._max_impacts()
+
+    def nbytes(self) -> int:
+        """Size of the index arrays."""
+        return sum(a.nbytes for a in (self.idf, self.doc_len, self.indptr, self.doc_ids, self.tfs, self.max_impact))
+
+    def _impacts(self, term_id: int, docs: np.ndarray, tf: np.ndarray) -> np.ndarray:
+        """Score contribution of one term to `docs`, same expression as BM25Okapi."""
+        return self.idf[term_id] * (tf * (self.k1 + 1) / (tf + self.doc_norm[docs]))
+
+    def _max_impacts(self) -> np.ndarray:
+        if len(self.doc_ids) == 0:
+            return np.zeros(len(self.vocab))
+        term_of_posting = np.repeat(np.arange(len(self.vocab)), np.diff(self.indptr))
+        tf = self.tfs.astype(np.float64)
+        impacts = self.idf[term_of_posting] * (tf * (self.k1 + 1) / (tf + self.doc_norm[self.doc_ids]))
+        return np.maximum.reduceat(impacts, self.indptr[:-1])
+
+    @classmethod
+    def build(cls, tokenized_corpus: List[List[str]], k1=1.5, b=0.75, epsilon=0.25, content_hash=None):
+        """Builds the index from already tokenized documents."""
+        doc_len = np.array([len(doc) for doc in tokenized_corpus], dtype=np.int32)
+        postings = {}
+        for doc_id, doc in enumerate(tokenized_corpus):
+            for term, tf in Counter(doc).items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        vocab = list(postings)
+        corpus_size = len(tokenized_corpus)
+        # IDF with the epsilon floor for negative values, as in BM25Okapi.
+        idf = np.empty(len(vocab), dtype=np.float64)
+        idf_sum = 0.0
+        for i, term in enumerate(vocab):
+            freq = len(postings[term])
+            idf[i] = math.log(corpus_size - freq + 0.5) - math.log(freq + 0.5)
+            idf_sum += idf[i]
+        average_idf = idf_sum / len(vocab) if vocab else 0.0
+        idf[idf < 0] = epsilon * average_idf
+
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(postings[term]) for term in vocab])
+        doc_ids = np.empty(indptr[-1], dtype=np.int32)
+        tfs = np.empty(indptr[-1], dtype=np.int32)
+        for i, term in enumerate(vocab):
+            plist = np.array(postings[term], dtype=np.int32).reshape(-1, 2)
+            doc_ids[indptr[i]:indptr[i + 1]] = plist[:, 0]
+            tfs[indptr[i]:indptr[i + 1]] = plist[:, 1]
+
+        return cls(vocab, idf, doc_len, indptr, doc_ids, tfs,
+                   k1=k1, b=b, epsilon=epsilon, content_hash=content_hash)
+
+    def get_scores(self, query_tokens: List[str]) -> np.ndarray:
+        """BM25 score of every document for the query."""
+        scores = np.zeros(self.corpus_size)
+        for token in query_tokens:
+            term_id = self.term_ids.get(token)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float64)
+            scores[docs] += self._impacts(term_id, docs, tf)
+        return scores
+
+    def _exact_scores(self, term_ids: List[int], candidates: np.ndarray) -> np.ndarray:
+        """`get_scores` restricted to `candidates`, summed in the same order."""
+        scores = np.zeros(len(candidates))
+        for term_id in term_ids:
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            postings = self.doc_ids[start:end]
+            pos = np.searchsorted(postings, candidates)
+            found = pos < len(postings)
+            found[found] = postings[pos[found]] == candidates[found]
+            docs = candidates[found]
+            tf = self.tfs[start + pos[found]].astype(np.float64)
+            scores[found] += self._impacts(term_id, docs, tf)
+        return scores
+
+    def top_k(self, query_tokens: List[str], k: int, prune: Optional[bool] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """The `k` best documents with a positive score, best first.
+
+        With pruning, terms are scored in decreasing order of their upper
+        bound. Once the bounds of the remaining terms add up to less than the
+        current k-th best partial score, no untouched document can reach the
+        top k, so the remaining (usually long, low-IDF) posting lists are only
+        probed for surviving candidates. `prune=None` prunes only when the
+        query's posting lists hold at least `prune_min_postings` entries.
+        Either way the ranking equals sorting `get_scores`, with ties broken
+        by ascending doc id.
+        """
+        term_ids = [self.term_ids[t] for t in query_tokens if t in self.term_ids]
+        if not term_ids or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        if prune is None:
+            postings = sum(int(self.indptr[t + 1] - self.indptr[t]) for t in set(term_ids))
+            prune = postings >= self.prune_min_postings
+        if not prune or np.any(self.idf[term_ids] < 0):
+            # Negative contributions would also break the upper-bound argument
+            scores = self.get_scores(query_tokens)
+            candidates = np.flatnonzero(scores > 0)
+            return self._rank(candidates, scores[candidates], k)
+
+        counts = Counter(term_ids)
+        bounds = {t: counts[t] * float(self.max_impact[t]) for t in counts}
+        remaining = sum(bounds.values())
+        processed = 0.0
+        partial = np.zeros(self.corpus_size)
+        for term_id in sorted(counts, key=bounds.get, reverse=True):
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.doc_ids[start:end]
+            partial[docs] += counts[term_id] * self._impacts(term_id, docs, self.tfs[start:end].astype(np.float64))
+            remaining -= bounds[term_id]
+            processed += bounds[term_id]
+            # The k-th best partial score can't exceed the processed bounds,
+            # so only look for it once pruning is possible at all
+            if remaining <= 0 or remaining >= processed:
+                continue
+            threshold = np.partition(partial, self.corpus_size - k)[self.corpus_size - k] if k < self.corpus_size else 0.0
+            # Slack so rounding in the partial sums never prunes a tie
+            threshold -= 1e-9 * max(1.0, threshold)
+            if 0 < threshold and remaining < threshold:
+                # Untouched docs (partial 0) are excluded here as well
+                candidates = np.flatnonzero(partial + remaining >= threshold)
+                return self._rescore(term_ids, candidates, partial[candidates] + remaining, k)
+
+        # No pruning possible: score exactly in query order
+        scores = self.get_scores(query_tokens)
+        candidates = np.flatnonzero(scores > 0)
+        return self._rank(candidates, scores[candidates], k)
+
+    def _rescore(self, term_ids: List[int], candidates: np.ndarray, upper: np.ndarray, k: int):
+        """Exact top k of `candidates`, rescoring in blocks of decreasing upper bound.
+
+        Stops as soon as the next candidate's bound is below the k-th exact
+        score found so far.
+        """
+        order = np.argsort(-upper, kind="stable")
+        best_ids, best_scores = np.empty(0, dtype=np.int64), np.empty(0)
+        pos, block = 0, max(4 * k, 64)
+        while pos < len(order):
+            ids = candidates[order[pos:pos + block]]
+            scores = self._exact_scores(term_ids, ids)
+            keep = scores > 0
+            best_ids, best_scores = self._rank(
+                np.concatenate([best_ids, ids[keep]]), np.concatenate([best_scores, scores[keep]]), k)
+            pos += block
+            block *= 2
+            if (len(best_ids) == k and pos < len(order)
+                    and upper[order[pos]] < best_scores[-1] - 1e-9 * max(1.0, best_scores[-1])):
+                break
+        return best_ids, best_scores
+
+    @staticmethod
+    def _rank(candidates: np.ndarray, scores: np.ndarray, k: int):
+        order = np.lexsort((candidates, -scores))[:k]
+        return candidates[order], scores[order]
+
+    def save(self, index_dir: str):
+        """Writes the index to `index_dir`; the header is written last."""
+        os.makedirs(index_dir, exist_ok=True)
+        meta_path = os.path.join(index_dir, _META_FILE)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        for name in _ARRAYS:
+            np.save(os.path.join(index_dir, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(index_dir, _VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        meta = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "content_hash": self.content_hash,
+            "corpus_size": self.corpus_size,
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+        }
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    @staticmethod
+    def read_meta(index_dir: str) -> Optional[dict]:
+        """Returns the index header, or None if there is no complete index."""
+        try:
+            with open(os.path.join(index_dir, _META_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True):
+        """Loads a saved index, memory-mapping the arrays by default."""
+        meta = cls.read_meta(index_dir)
+        if meta is None:
+            raise FileNotFoundError(f"No BM25 index in {index_dir}")
+        with open(os.path.join(index_dir, _VOCAB_FILE), encoding="utf-8") as f:
+            vocab = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in _ARRAYS
+        }
+        return cls(vocab, k1=meta["k1"], b=meta["b"], epsilon=meta["epsilon"],
+                   content_hash=meta["content_hash"], **arrays)
@@ -0,0 +1,203 @@
+"""The chatbot's guardrail -> retrieve -> rerank -> generate path, without Streamlit.
+
+`ChatPipeline` holds the process-wide pieces the app builds once (retrieval
+service, guardrail, query cache, LLM client, executor, generation scheduler,
+context packer, answer cache) and runs one chat turn. app.py renders its
+result; load_test.py drives it headlessly.
+"""
+import os
+from collections import namedtuple
+from typing import Optional
+
+from answer_cache import CachedChunk, RecordingStream, SemanticAnswerCache
+from context_packing import ContextPacker, build_prompt
+from generation_scheduler import BUSY_MESSAGE, GenerationScheduler, SchedulerBusy
+from llm_metrics import InstrumentedStream, LLMMetricsRecorder
+from pipeline import check_cancelled, hybrid_candidates, rerank_candidates, run_guarded, timed
+from query_cache import QueryCache
+
+# `response` is the LLM chunk stream, not yet drained. It is None when the
+# guardrail rejected the input or the generation queue is full; `message`
+# then holds the reply to show instead. `cached` marks an answer served from
+# the answer cache.
+ChatTurn = namedtuple("ChatTurn", ["valid", "message", "doc_ids", "docs", "confidences", "response", "cached"],
+                      defaults=(False,))
+
+
+def get_ollama_llm(
+        model_name: str = None,
+        temperature: float = 0.8,
+        base_url: str = None,
+        num_ctx: int = None,
+    ):
+    from langchain_ollama import ChatOllama
+    from llm_client import get_backend
+    # Pooled connections, per-URL concurrency limit, retries and circuit breaker
+    backend = get_backend(base_url or os.getenv('OLLAMA_URL'))
+    llm = ChatOllama(
+        model=model_name,
+        temperature=temperature,
+        base_url=backend.url,
+        # Ollama's own default when None
+        num_ctx=num_ctx,
+        client_kwargs=backend.client_kwargs(),
+    )
+    # from langchain_openai import ChatOpenAI
+    # llm = ChatOpenAI(
+    #     model="deepseek/deepseek-r1:free",
+    #     temperature=0,
+    #     max_tokens=None,
+    #     timeout=None,
+    #     max_retries=2,
+    #     api_key=os.getenv('OPENROUTER_DEEPSEEK_API_KEY'),
+    #     base_url='https://openrouter.ai/api/v1',
+    # )
+    return llm
+
+
+def ask_llm(llm, query, metrics=None, scheduler=None, user=None, priority=0):
+    """Streams the answer; through `scheduler` when given, which may raise
+    SchedulerBusy."""
+    if scheduler is not None:
+        response = scheduler.submit(lambda: llm.stream(f'{query}'), user=user, priority=priority)
+    else:
+        response = llm.stream(f'{query}')
+    if metrics is not None:
+        # Timed as the caller drains it
+        response = InstrumentedStream(response, metrics, model=getattr(llm, 'model', None))
+    return response
+
+
+class ChatPipeline:
+    """One chat turn: guardrail alongside retrieval, then confidences and the
+    LLM stream. Safe to share between sessions and threads."""
+
+    def __init__(self, service, guardrail, llm, query_cache: Optional[QueryCache] = None,
+                 executor=None, metrics: Optional[LLMMetricsRecorder] = None,
+                 scheduler: Optional[GenerationScheduler] = None,
+                 packer: Optional[ContextPacker] = None,
+                 answer_cache: Optional[SemanticAnswerCache] = None,
+                 top_k: int = 2, alpha: float = 0.5, fusion: str = "rrf",
+                 bm25_depth: int = 10, dense_depth: int = 10):
+        self.service = service
+        self.guardrail = guardrail
+        self.llm = llm
+        self.query_cache = query_cache
+        self.executor = executor
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self.packer = packer
+        self.answer_cache = answer_cache
+        self.top_k = top_k
+        self.alpha = alpha
+        self.fusion = fusion
+        self.bm25_depth = bm25_depth
+        self.dense_depth = dense_depth
+
+    def retrieve(self, query: str, return_embeddings: bool = False, top_k: int = None,
+                 alpha: float = None, timings=None, cancelled=None):
+        """Hybrid search + rerank, served from the query cache when possible.
+
+        Returns chunk ids, plus the query embedding and {doc_id: vector} with
+        `return_embeddings`.
+        """
+        key, cached, fresh = self._search(query, top_k, alpha, timings, cancelled)
+        if fresh:
+            self.query_cache.put(key, cached)
+        return self._unpack(cached, return_embeddings)
+
+    def _search(self, query: str, top_k: int = None, alpha: float = None, timings=None, cancelled=None):
+        """(cache key, result, fresh): `fresh` results are not cached yet."""
+        top_k = self.top_k if top_k is None else top_k
+        alpha = self.alpha if alpha is None else alpha
+        key = cached = None
+        if self.query_cache is not None:
+            key = self.query_cache.make_key(
+                query, top_k=top_k, alpha=alpha, fusion=self.fusion,
+                bm25_depth=self.bm25_depth, dense_depth=self.dense_depth,
+                index_version=self.service.index_version,
+            )
+            with timed(timings, 'cache_lookup'):
+                cached = self.query_cache.get(key)
+        if cached is None:
+            doc_ids, query_embedding, doc_embeddings = hybrid_candidates(
+                self.service, query, top_k=top_k, alpha=alpha,
+                bm25_depth=self.bm25_depth, dense_depth=self.dense_depth,
+                fusion=self.fusion,
+                # Hit vectors are only needed when there is no precomputed chunk matrix
+                want_vectors=self.service.chunk_embeddings is None,
+                executor=self.executor, timings=timings, cancelled=cancelled,
+            )
+            check_cancelled(cancelled)
+            with timed(timings, 'rerank'):
+                doc_ids = rerank_candidates(self.service, query, doc_ids)
+            cached = {
+                "doc_ids": [int(doc_id) for doc_id in doc_ids],
+                "query_embedding": [float(x) for x in query_embedding],
+                "doc_embeddings": [
+                    [float(x) for x in doc_embeddings[doc_id]] if doc_id in doc_embeddings else None
+                    for doc_id in doc_ids
+                ],
+            }
+            return key, cached, self.query_cache is not None
+        return key, cached, False
+
+    @staticmethod
+    def _unpack(cached: dict, return_embeddings: bool):
+        doc_ids = cached["doc_ids"]
+        if not return_embeddings:
+            return doc_ids
+        doc_embeddings = {
+            doc_id: vector for doc_id, vector in zip(doc_ids, cached["doc_embeddings"]) if vector is not None
+        }
+        return doc_ids, cached["query_embedding"], doc_embeddings
+
+    def run(self, query: str, timings=None, user: Optional[str] = None, priority: int = 0) -> ChatTurn:
+        """Guardrail and retrieval (overlapped), confidences, then the LLM stream.
+
+        `user` and `priority` place the generation in the scheduler's queue.
+        """
+        valid, message, retrieval = run_guarded(
+            query,
+            self.guardrail.check,
+            lambda cancelled: self._search(query, timings=timings, cancelled=cancelled),
+            executor=self.executor,
+            timings=timings,
+        )
+        if not valid:
+            return ChatTurn(False, message, [], [], [], None)
+
+        key, cached, fresh = retrieval
+        if fresh:
+            # Only once the guardrail passed, so rejected input never fills the cache
+            self.query_cache.put(key, cached)
+        doc_ids, query_embedding, doc_embeddings = self._unpack(cached, return_embeddings=True)
+        with timed(timings, 'confidence'):
+            # One corpus pass for all docs, reusing the retrieval embeddings
+            confidences = self.service.hybrid_confidences(
+                query, doc_ids, query_embedding=query_embedding, doc_embeddings=doc_embeddings,
+            )
+        docs = self.service.store.texts(doc_ids)
+        # Answers are only reused for the same index and model
+        version = f"{self.service.index_version}/{getattr(self.llm, 'model', None)}"
+        if self.answer_cache is not None:
+            with timed(timings, 'answer_cache'):
+                answer = self.answer_cache.get(query_embedding, doc_ids, version)
+            if answer is not None:
+                return ChatTurn(True, None, doc_ids, docs, confidences, iter([CachedChunk(answer)]), True)
+        with timed(timings, 'context'):
+            if self.packer is not None:
+                chunks = [(self.service.store.filename(doc_id), doc) for doc_id, doc in zip(doc_ids, docs)]
+                prompt = self.packer.pack(query, chunks).prompt
+            else:
+                prompt = build_prompt(query, docs)
+        try:
+            response = ask_llm(self.llm, prompt, metrics=self.metrics,
+                               scheduler=self.scheduler, user=user, priority=priority)
+        except SchedulerBusy:
+            return ChatTurn(True, BUSY_MESSAGE, doc_ids, docs, confidences, None)
+        if self.answer_cache is not None:
+            response = RecordingStream(
+                response, lambda answer: self.answer_cache.put(query_embedding, doc_ids, answer, version),
+            )
+        return ChatTurn(True, None, doc_ids, docs, confidences, response)
@@ -0,0 +1,271 @@
+"""Packed chunk corpus: every chunk in one file instead of one file per chunk.
+
+Layout (little-endian):
+
+    header    magic, format version, chunk count, index offset, metadata offset
+    blob      per chunk: uint32 byte length + UTF-8 text
+    index     int64 offset of each chunk's length prefix in the blob
+    metadata  JSON list: name, source filing, chunk number, char span, sha256,
+              and `sources` for chunks that near-duplicates were merged into
+
+The file is memory-mapped; the offset index is a numpy view over the mapping
+and a chunk's text is decoded straight from the mapped bytes when it is
+asked for, so opening the corpus reads only the header, index and metadata.
+
+    python chunk_corpus.py pack --from-dir financial-docs-md/chunks-500 --out financial-docs-md/chunks-500.chunks
+    python chunk_corpus.py chunk --markdown-dir financial-docs-md --out financial-docs-md/chunks-1000.chunks
+
+With `--dedup-threshold`, near-duplicate chunks (shared boilerplate across
+filings) are collapsed before packing; see dedup.py.
+
+`read_corpus` accepts either a packed file or a directory of `.md` chunks,
+so everything that takes `--data-dir` works with both.
+"""
+import os
+import re
+import glob
+import json
+import mmap
+import struct
+import argparse
+from collections import namedtuple
+from collections.abc import Sequence
+from typing import Iterable, List, Optional
+
+import numpy as np
+from loguru import logger
+from tqdm import tqdm
+
+from segments import chunk_digest
+
+MAGIC = b"CHNKPACK"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<8sIQQQ")
+_LENGTH = struct.Struct("<I")
+_CHUNK_NAME = re.compile(r"^(?P<source>.*)_chunk_(?P<number>\d+)\.md$")
+
+# `sources` lists the references of near-duplicates merged into the record (see dedup.py)
+ChunkRecord = namedtuple("ChunkRecord", ["name", "text", "source", "chunk_number", "char_span", "sources"],
+                         defaults=(None,))
+
+
+def read_markdown_chunks(files):
+    """Reads markdown files and returns a list of chunks."""
+    chunks = []
+    for file in tqdm(files, desc="Reading Markdown Files"):
+        with open(file, "r", encoding="utf-8") as f:
+            chunks.append(f.read())  # Assumes each file is a chunk
+    return chunks
+
+
+def write_corpus(path: str, records: Iterable[ChunkRecord]):
+    """Writes the records as a packed corpus, replacing `path` atomically."""
+    offsets, metadata = [], []
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * _HEADER.size)
+        for record in records:
+            data = record.text.encode("utf-8")
+            offsets.append(f.tell())
+            f.write(_LENGTH.pack(len(data)))
+            f.write(data)
+            metadata.append({
+                "name": record.name,
+                "source": record.source,
+                "chunk_number": record.chunk_number,
+                "char_span": list(record.char_span) if record.char_span else None,
+                "sha256": chunk_digest(record.text),
+            })
+            if record.sources and len(record.sources) > 1:
+                metadata[-1]["sources"] = record.sources
+        f.write(b"\0" * (-f.tell() % 8))  # align the index for the numpy view
+        index_offset = f.tell()
+        f.write(np.asarray(offsets, dtype="<i8").tobytes())
+        meta_offset = f.tell()
+        f.write(json.dumps(metadata, ensure_ascii=False).encode("utf-8"))
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(offsets), index_offset, meta_offset))
+    os.replace(tmp_path, path)
+    logger.info(f"Packed {len(offsets)} chunks into {path}")
+
+
+class PackedCorpus:
+    """Read-only, memory-mapped view of a packed corpus file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, index_offset, meta_offset = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a packed chunk corpus (version {FORMAT_VERSION})")
+        self._buffer = memoryview(self._mmap)
+        self.offsets = np.frombuffer(self._mmap, dtype="<i8", count=count, offset=index_offset)
+        self.metadata = json.loads(str(self._buffer[meta_offset:], "utf-8"))
+        self.names = [meta["name"] for meta in self.metadata]
+        self.digests = [meta["sha256"] for meta in self.metadata]
+        self.blob_bytes = index_offset - _HEADER.size
+
+    def __len__(self):
+        return len(self.names)
+
+    def text(self, i: int) -> str:
+        offset = int(self.offsets[i])
+        (length,) = _LENGTH.unpack_from(self._mmap, offset)
+        start = offset + _LENGTH.size
+        return str(self._buffer[start:start + length], "utf-8")
+
+    def texts(self) -> "PackedTexts":
+        return PackedTexts(self, range(len(self)))
+
+
+class PackedTexts(Sequence):
+    """Chunk texts of a `PackedCorpus` in a given order, decoded on access."""
+
+    def __init__(self, corpus: PackedCorpus, order):
+        self.corpus = corpus
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.take(range(len(self))[i])
+        return self.corpus.text(self.order[i])
+
+    def take(self, positions) -> "PackedTexts":
+        """A view of the texts at `positions`, without decoding them."""
+        return PackedTexts(self.corpus, [self.order[p] for p in positions])
+
+    def nbytes(self) -> int:
+        """Size of the mapped text blob."""
+        return self.corpus.blob_bytes
+
+
+def is_packed_corpus(path: str) -> bool:
+    return os.path.isfile(path)
+
+
+def read_corpus(path: str):
+    """(names, texts, digests) of a packed corpus file or a chunk directory.
+
+    Digests are None for a directory; they are stored in packed files.
+    """
+    if is_packed_corpus(path):
+        corpus = PackedCorpus(path)
+        logger.info(f"Opened packed corpus {path} with {len(corpus)} chunks")
+        return list(corpus.names), corpus.texts(), corpus.digests
+    files = sorted(glob.glob(f"{path}/*.md"))
+    return files, read_markdown_chunks(files), None
+
+
+def parse_chunk_name(name: str):
+    """(source filing, chunk number) from `<source>_chunk_<n>.md`."""
+    match = _CHUNK_NAME.match(os.path.basename(name))
+    if match is None:
+        return None, None
+    return match.group("source"), int(match.group("number"))
+
+
+def find_spans(source_text: str, chunks: List[str]) -> List[Optional[tuple]]:
+    """Character span of each chunk in its source, searching forward so
+    overlapping chunks are located in order."""
+    spans, position = [], 0
+    for chunk in chunks:
+        start = source_text.find(chunk, position)
+        if start < 0:
+            start = source_text.find(chunk)
+        if start < 0:
+            spans.append(None)
+            continue
+        spans.append((start, start + len(chunk)))
+        position = start + 1
+    return spans
+
+
+def records_from_dir(chunk_dir: str, source_dir: Optional[str] = None) -> List[ChunkRecord]:
+    """Records for an existing chunk directory, in source and chunk order.
+
+    With `source_dir` (the unsplit markdown), character spans are recovered
+    by locating each chunk in its source file.
+    """
+    files = glob.glob(f"{chunk_dir}/*.md")
+    parsed = {file: parse_chunk_name(file) for file in files}
+    files.sort(key=lambda file: (parsed[file][0] or "", parsed[file][1] or 0, os.path.basename(file)))
+    texts = read_markdown_chunks(files)
+
+    spans = [None] * len(files)
+    if source_dir:
+        by_source = {}
+        for i, file in enumerate(files):
+            by_source.setdefault(parsed[file][0], []).append(i)
+        for source, positions in by_source.items():
+            source_path = os.path.join(source_dir, f"{source}.md")
+            if source is None or not os.path.exists(source_path):
+                continue
+            with open(source_path, "r", encoding="utf-8") as f:
+                source_text = f.read()
+            for i, span in zip(positions, find_spans(source_text, [texts[i] for i in positions])):
+                spans[i] = span
+
+    return [
+        ChunkRecord(os.path.basename(file), text, parsed[file][0], parsed[file][1], span)
+        for file, text, span in zip(files, texts, spans)
+    ]
+
+
+def records_from_markdown(markdown_dir: str, chunk_size: int = 1000, chunk_overlap: int = 100) -> List[ChunkRecord]:
+    """Splits each full markdown filing like main.ipynb does, keeping spans."""
+    from langchain.text_splitter import MarkdownTextSplitter
+    splitter = MarkdownTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    records = []
+    for md_file in sorted(glob.glob(f"{markdown_dir}/*.md")):
+        with open(md_file, "r", encoding="utf-8") as f:
+            markdown_content = f.read()
+        source = os.path.basename(md_file).replace(".md", "")
+        chunks = splitter.split_text(markdown_content)
+        for i, (chunk, span) in enumerate(zip(chunks, find_spans(markdown_content, chunks))):
+            records.append(ChunkRecord(f"{source}_chunk_{i}.md", chunk, source, i, span))
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = subparsers.add_parser("pack", help="Convert a directory of chunk files")
+    pack_parser.add_argument("--from-dir", default="./financial-docs-md/chunks-500")
+    pack_parser.add_argument("--source-dir", help="Unsplit markdown, to record character spans")
+    pack_parser.add_argument("--out", required=True)
+
+    chunk_parser = subparsers.add_parser("chunk", help="Split full markdown filings into a packed corpus")
+    chunk_parser.add_argument("--markdown-dir", required=True)
+    chunk_parser.add_argument("--chunk-size", type=int, default=1000)
+    chunk_parser.add_argument("--chunk-overlap", type=int, default=100)
+    chunk_parser.add_argument("--out", required=True)
+
+    for subparser in (pack_parser, chunk_parser):
+        subparser.add_argument("--dedup-threshold", type=float,
+                               help="Collapse chunks with estimated Jaccard similarity at or above this")
+        subparser.add_argument("--num-perm", type=int, default=128, help="MinHash signature length")
+        subparser.add_argument("--shingle-size", type=int, default=5, help="Words per shingle")
+        subparser.add_argument("--dedup-report", help="Write the size reduction report as JSON here")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        records = records_from_dir(args.from_dir, args.source_dir)
+    else:
+        records = records_from_markdown(args.markdown_dir, args.chunk_size, args.chunk_overlap)
+    if args.dedup_threshold is not None:
+        from dedup import dedup_records
+        records, report = dedup_records(records, args.dedup_threshold, args.num_perm, args.shingle_size)
+        if args.dedup_report:
+            with open(args.dedup_report, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+    write_corpus(args.out, records)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Precomputed embedding matrix for the chunk corpus.
+
+Row `i` is the L2-normalised embedding of chunk id `i` (the same order as
+`RetrievalService.store`, i.e. BM25 segment order). The matrix is saved as a
+`.npy` file next to a JSON header recording the corpus hash, model and the
+file name and digest of every row, and is memory-mapped at startup so
+confidence scoring never re-encodes a chunk. When chunks are added, rows of
+unchanged files are reused and only the new chunks are encoded.
+"""
+import os
+import json
+import time
+import argparse
+from typing import List, Optional
+
+import numpy as np
+from loguru import logger
+from tqdm import tqdm
+
+from chunk_corpus import read_corpus
+from segments import chunk_digest, load_or_update_index
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+_MATRIX_FILE = "embeddings.npy"
+_META_FILE = "meta.json"
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+
+def encode_batches(chunks, model_name: str = EMBEDDING_MODEL, batch_size: int = 64,
+                   stream_batch_size: int = 512, processes: int = 0):
+    """Yields (start, normalised rows) for consecutive slices of `chunks`.
+
+    Slices of `stream_batch_size` chunks go through the encoder in forward
+    passes of `batch_size`. With `processes` > 1 each slice is split across
+    a SentenceTransformer multi-process pool.
+    """
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(model_name)
+    pool = model.start_multi_process_pool(["cpu"] * processes) if processes > 1 else None
+    try:
+        for start in range(0, len(chunks), stream_batch_size):
+            batch = [chunks[i] for i in range(start, min(start + stream_batch_size, len(chunks)))]
+            if pool is not None:
+                vectors = model.encode_multi_process(batch, pool, batch_size=batch_size)
+            else:
+                vectors = model.encode(batch, batch_size=batch_size)
+            yield start, normalize_rows(vectors)
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+
+
+def encode_chunks(chunks, model_name: str = EMBEDDING_MODEL, batch_size: int = 64,
+                  stream_batch_size: int = 512, processes: int = 0, on_batch=None) -> np.ndarray:
+    """Encodes the chunks in batches and returns normalised float32 rows.
+
+    `on_batch(start, rows)` is called as each slice is encoded, so callers
+    can write it out while the next slice is encoding.
+    """
+    rows = []
+    started = time.perf_counter()
+    with tqdm(total=len(chunks), desc="Encoding chunks", unit="chunk") as progress:
+        for start, batch in encode_batches(chunks, model_name, batch_size, stream_batch_size, processes):
+            rows.append(batch)
+            if on_batch is not None:
+                on_batch(start, batch)
+            progress.update(len(batch))
+    elapsed = time.perf_counter() - started
+    logger.info(f"Encoded {len(chunks)} chunks in {elapsed:.1f}s ({len(chunks) / max(elapsed, 1e-9):.1f} chunks/s)")
+    return np.concatenate(rows) if rows else np.empty((0, 0), dtype=np.float32)
+
+
+def embedding_dim(model_name: str = EMBEDDING_MODEL, meta: Optional[dict] = None) -> int:
+    """Row width for `model_name`: from a saved header of the same model, else
+    from the model itself."""
+    if meta and meta.get("model_name") == model_name and meta.get("dim"):
+        return int(meta["dim"])
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name).get_sentence_embedding_dimension()
+
+
+def row_keys(files: List[str], chunks: List[str]) -> List[List[str]]:
+    """[file name, chunk digest] of each row."""
+    return [[os.path.basename(file), chunk_digest(chunk)] for file, chunk in zip(files, chunks)]
+
+
+def _read_meta(store_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(store_dir, _META_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_embeddings(store_dir: str, matrix: np.ndarray, content_hash: str,
+                    model_name: str = EMBEDDING_MODEL, files: List[List[str]] = None):
+    os.makedirs(store_dir, exist_ok=True)
+    # Replace rather than overwrite: a running app may have the old files open
+    matrix_path = os.path.join(store_dir, _MATRIX_FILE)
+    with open(matrix_path + ".tmp", "wb") as f:
+        np.save(f, normalize_rows(matrix))
+    os.replace(matrix_path + ".tmp", matrix_path)
+    meta_path = os.path.join(store_dir, _META_FILE)
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({
+            "content_hash": content_hash,
+            "model_name": model_name,
+            "rows": int(len(matrix)),
+            "dim": int(matrix.shape[1]),
+            "files": files,
+        }, f, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+def load_embeddings(store_dir: str, content_hash: str,
+                    model_name: str = EMBEDDING_MODEL) -> Optional[np.ndarray]:
+    """Memory-maps the matrix, or returns None if it is missing or stale."""
+    meta = _read_meta(store_dir)
+    if meta is None:
+        logger.warning(f"No chunk embeddings in {store_dir}; chunks will be encoded on demand")
+        return None
+    if meta.get("content_hash") != content_hash or meta.get("model_name") != model_name:
+        logger.warning(f"Chunk embeddings in {store_dir} are stale; update them with `ingest.py add` or chunk_embeddings.py")
+        return None
+    matrix = np.load(os.path.join(store_dir, _MATRIX_FILE), mmap_mode="r")
+    if matrix.shape != (meta.get("rows"), meta.get("dim")):
+        # Caught between the matrix and meta replacements of a save
+        logger.warning(f"Chunk embeddings in {store_dir} do not match their meta.json; chunks will be encoded on demand")
+        return None
+    return matrix
+
+
+def reuse_or_encode(store_dir: Optional[str], files: List[str], chunks: List[str],
+                    model_name: str = EMBEDDING_MODEL, batch_size: int = 64,
+                    stream_batch_size: int = 512, processes: int = 0, on_encoded=None) -> np.ndarray:
+    """Embedding rows for `chunks`, in order.
+
+    Rows already saved in `store_dir` for the same file name and content are
+    copied; only the remaining chunks are encoded, and `on_encoded(positions,
+    rows)` is called for each encoded slice.
+    """
+    keys = row_keys(files, chunks)
+    meta = _read_meta(store_dir) if store_dir else None
+    saved_rows, saved = {}, None
+    if meta and meta.get("model_name") == model_name and meta.get("files"):
+        saved = np.load(os.path.join(store_dir, _MATRIX_FILE), mmap_mode="r")
+        if len(saved) == len(meta["files"]):
+            saved_rows = {tuple(key): i for i, key in enumerate(meta["files"])}
+        else:
+            saved = None
+
+    missing = [i for i, key in enumerate(keys) if tuple(key) not in saved_rows]
+    logger.info(f"Reusing {len(keys) - len(missing)} chunk embeddings, encoding {len(missing)}")
+    encoded = None
+    if missing:
+        on_batch = None
+        if on_encoded is not None:
+            def on_batch(start, rows):
+                on_encoded(missing[start:start + len(rows)], rows)
+        encoded = encode_chunks([chunks[i] for i in missing], model_name, batch_size,
+                                stream_batch_size, processes, on_batch)
+    if saved is not None:
+        dim = saved.shape[1]
+    elif encoded is not None:
+        dim = encoded.shape[1]
+    else:
+        # Empty corpus and nothing saved: still a (0, dim) matrix
+        dim = embedding_dim(model_name, meta)
+    matrix = np.empty((len(keys), dim), dtype=np.float32)
+    reused = [i for i, key in enumerate(keys) if tuple(key) in saved_rows]
+    if reused:
+        matrix[reused] = saved[[saved_rows[tuple(keys[i])] for i in reused]]
+    if missing:
+        matrix[missing] = encoded
+    return matrix
+
+
+def update_embeddings(store_dir: str, files: List[str], chunks: List[str], content_hash: str,
+                      model_name: str = EMBEDDING_MODEL, batch_size: int = 64,
+                      stream_batch_size: int = 512, processes: int = 0, on_encoded=None,
+                      reuse: bool = True) -> np.ndarray:
+    """Brings the saved matrix in line with `chunks`, encoding only new chunks
+    (or all of them without `reuse`)."""
+    matrix = reuse_or_encode(store_dir if reuse else None, files, chunks, model_name, batch_size,
+                             stream_batch_size, processes, on_encoded)
+    save_embeddings(store_dir, matrix, content_hash, model_name, files=row_keys(files, chunks))
+    return matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed every chunk and save the aligned matrix.")
+    parser.add_argument("--data-dir", default=os.getenv("CHUNK_CORPUS", "./financial-docs-md/chunks-500"),
+                        help="Chunk directory or packed corpus file")
+    parser.add_argument("--index-dir", default=os.getenv("BM25_INDEX_DIR", "./index/bm25"),
+                        help="BM25 index that fixes the chunk order")
+    parser.add_argument("--out", default=os.getenv("CHUNK_EMBEDDINGS_DIR", "./index/embeddings"))
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--stream-batch-size", type=int, default=512)
+    parser.add_argument("--processes", type=int, default=0, help="Encoder processes (0 or 1: in process)")
+    args = parser.parse_args()
+
+    index, files, chunks, _ = load_or_update_index(args.index_dir, *read_corpus(args.data_dir))
+    matrix = update_embeddings(args.out, files, chunks, index.content_hash, batch_size=args.batch_size,
+                               stream_batch_size=args.stream_batch_size, processes=args.processes)
+    logger.info(f"Saved {matrix.shape[0]}x{matrix.shape[1]} chunk embeddings to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Chunk texts addressed by stable integer ids.
+
+A chunk's id is its position in index order (see segments.py): chunks of a
+newly added filing get the next free ids, and merging segments keeps every
+id, so the BM25 index, the embedding matrix, vector store payloads and
+cached results can all refer to chunks by id. Ids are only reassigned by a
+full rebuild, which also changes the corpus content hash (and with it the
+retrieval service's `index_version`).
+"""
+import os
+from typing import Iterable, List, Optional
+
+from chunk_corpus import PackedTexts
+
+
+class ChunkStore:
+    """Read-only chunk texts with id -> text and filename -> id lookups."""
+
+    def __init__(self, files: List[str], texts: List[str], content_hash: str = None):
+        if len(files) != len(texts):
+            raise ValueError("files and texts must have the same length")
+        self.paths = tuple(files)
+        self.filenames = tuple(os.path.basename(file) for file in files)
+        self.content_hash = content_hash
+        # Chunk ids index straight into the texts. A packed corpus is kept as
+        # its lazy view, so texts are decoded from the mapping on access.
+        self._texts = texts if isinstance(texts, PackedTexts) else tuple(texts)
+        self._ids_by_filename = {name: i for i, name in enumerate(self.filenames)}
+        self._ids_by_text = None
+        if isinstance(texts, PackedTexts):
+            self._nbytes = texts.nbytes()
+        else:
+            self._nbytes = sum(len(text.encode("utf-8")) for text in self._texts)
+
+    def __len__(self):
+        return len(self._texts)
+
+    def text(self, chunk_id: int) -> str:
+        return self._texts[chunk_id]
+
+    def texts(self, chunk_ids: Iterable[int]) -> List[str]:
+        return [self._texts[i] for i in chunk_ids]
+
+    def metadata(self, chunk_id: int) -> Optional[dict]:
+        """Source filing, chunk number and char span, for packed corpora."""
+        if isinstance(self._texts, PackedTexts):
+            return self._texts.corpus.metadata[self._texts.order[chunk_id]]
+        return None
+
+    def filename(self, chunk_id: int) -> str:
+        return self.filenames[chunk_id]
+
+    def id_for_filename(self, filename: str) -> Optional[int]:
+        return self._ids_by_filename.get(filename)
+
+    def id_for_text(self, text: str) -> Optional[int]:
+        """First chunk with exactly this text; built on first use."""
+        if self._ids_by_text is None:
+            ids_by_text = {}
+            for i, chunk in enumerate(self._texts):
+                ids_by_text.setdefault(chunk, i)
+            self._ids_by_text = ids_by_text
+        return self._ids_by_text.get(text)
+
+    def id_for_payload(self, payload: Optional[dict]) -> Optional[int]:
+        """Chunk id of a vector store payload.
+
+        Trusts `chunk_id` only while it still names the same file, then falls
+        back to the filename and, for old points, the text.
+        """
+        payload = payload or {}
+        chunk_id = payload.get("chunk_id")
+        filename = payload.get("filename")
+        if chunk_id is not None and 0 <= chunk_id < len(self) and self.filenames[chunk_id] == filename:
+            return chunk_id
+        if filename is not None and filename in self._ids_by_filename:
+            return self._ids_by_filename[filename]
+        return self.id_for_text(payload.get("text"))
+
+    def nbytes(self) -> int:
+        """UTF-8 size of all chunk texts (the mapped blob for packed corpora)."""
+        return self._nbytes
@@ -0,0 +1,186 @@
+"""Token-budgeted context for the LLM prompt.
+
+The retrieved chunks used to go to the model as the repr of a Python list:
+escaped newlines, quotes, the filings' column padding, and the text two
+overlapping chunks share, all prefilled before the first token. The packer
+builds the context instead:
+
+- chunks of the same filing with consecutive chunk numbers are merged into
+  one passage, dropping the text the splitter repeated at the seam;
+- runs of spaces are collapsed and blank lines removed;
+- a sentence already in the context is not repeated (short ones such as
+  table rules and labels are always kept);
+- passages are added best-ranked first until the token budget for the
+  model is spent; the one that does not fit is cut at a line boundary.
+
+Tokens are estimated (see `estimate_tokens`) since the Ollama model's own
+tokenizer is not available locally; pass `count_tokens` for an exact count.
+"""
+import math
+import re
+from collections import namedtuple
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from chunk_corpus import parse_chunk_name
+
+# Native context windows of the models we run, by Ollama model name
+MODEL_CONTEXT_TOKENS = {
+    "phi4": 16384,
+    "phi3": 4096,
+    "llama3": 8192,
+    "llama3.1": 131072,
+    "llama3.2": 131072,
+    "mistral": 32768,
+    "qwen2.5": 32768,
+    "gemma2": 8192,
+    "deepseek-r1": 131072,
+}
+# What Ollama allocates when the client does not set num_ctx
+OLLAMA_DEFAULT_NUM_CTX = 2048
+
+_TOKEN = re.compile(r"[^\W\d_]+|\d{1,3}|[^\w\s]|_|\s*\n\s*|\s{2,}")
+_SPACES = re.compile(r"[ \t ]+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\"'])")
+_WORD = re.compile(r"\w+")
+
+# `chunk_numbers` is empty for chunks whose name does not give a position
+ContextPiece = namedtuple("ContextPiece", ["source", "chunk_numbers", "text"])
+PackedContext = namedtuple("PackedContext", ["prompt", "tokens", "raw_tokens", "pieces"])
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough BPE token count: a token per 6 letters of a word, per group of
+    up to 3 digits, per punctuation mark and per line break or run of
+    spaces (a single space rides along with the next word)."""
+    return sum(math.ceil(len(piece) / 6) if piece[0].isalpha() else 1 for piece in _TOKEN.findall(text))
+
+
+def context_budget(model_name: str, num_ctx: Optional[int] = None, answer_tokens: int = 512) -> int:
+    """Prompt tokens available for `model_name`, leaving `answer_tokens` to generate.
+
+    `num_ctx` is the context Ollama is asked to allocate (its default when
+    None), capped at the model's own window.
+    """
+    window = num_ctx or OLLAMA_DEFAULT_NUM_CTX
+    family = (model_name or "").split(":")[0]
+    if family in MODEL_CONTEXT_TOKENS:
+        window = min(window, MODEL_CONTEXT_TOKENS[family])
+    return max(window - answer_tokens, 0)
+
+
+def _seam_overlap(left: str, right: str, max_chars: int = 400) -> int:
+    """Length of the longest suffix of `left` that `right` starts with."""
+    for size in range(min(len(left), len(right), max_chars), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def merge_chunks(chunks: Sequence[Tuple[str, str]]) -> List[ContextPiece]:
+    """Passages from (filename, text) chunks in rank order.
+
+    Consecutive chunks of a filing become one passage; passages are ordered
+    by their best-ranked chunk.
+    """
+    ranked = {}
+    for rank, (filename, text) in enumerate(chunks):
+        source, number = parse_chunk_name(filename)
+        if source is None:
+            ranked[(filename, None)] = (rank, text)
+        else:
+            ranked.setdefault((source, number), (rank, text))
+
+    runs = []  # [best rank, source, chunk numbers, text]
+    for (source, number), (rank, text) in sorted(ranked.items(), key=lambda item: (item[0][0], item[0][1] or 0)):
+        previous = runs[-1] if runs else None
+        if number is not None and previous and previous[1] == source and previous[2] \
+                and previous[2][-1] == number - 1:
+            overlap = _seam_overlap(previous[3], text)
+            previous[3] += text[overlap:] if overlap else f"\n{text}"
+            previous[2].append(number)
+            previous[0] = min(previous[0], rank)
+        else:
+            runs.append([rank, source, [number] if number is not None else [], text])
+    runs.sort(key=lambda run: run[0])
+    return [ContextPiece(source, tuple(numbers), text) for _, source, numbers, text in runs]
+
+
+def build_prompt(query: str, docs: List[str]) -> str:
+    """The unpacked prompt: the chunk list as is, then the question."""
+    return f'{docs}\nQuestion: {query}'
+
+
+class ContextPacker:
+    """Compacts ranked chunks into a prompt that fits `budget_tokens`."""
+
+    def __init__(self, budget_tokens: int, count_tokens: Callable[[str], int] = estimate_tokens,
+                 min_sentence_words: int = 4):
+        self.budget_tokens = budget_tokens
+        self.count_tokens = count_tokens
+        self.min_sentence_words = min_sentence_words
+
+    def _compact(self, text: str, seen: set) -> List[Tuple[str, List[str]]]:
+        """Lines of `text` with spaces collapsed and repeated sentences dropped.
+
+        Returns (line, sentence keys) pairs. `seen` is only read: the caller
+        adds a line's keys once the line is written to the context, so a
+        sentence cut by the budget can still come from a later passage.
+        """
+        lines, passage_keys = [], set()
+        for line in text.splitlines():
+            kept, keys = [], []
+            for sentence in _SENTENCE_END.split(_SPACES.sub(" ", line).strip()):
+                words = _WORD.findall(sentence.lower())
+                if len(words) >= self.min_sentence_words:
+                    key = " ".join(words)
+                    if key in seen or key in passage_keys:
+                        continue
+                    passage_keys.add(key)
+                    keys.append(key)
+                if sentence:
+                    kept.append(sentence)
+            if kept:
+                lines.append((" ".join(kept), keys))
+        return lines
+
+    @staticmethod
+    def _header(number: int, piece: ContextPiece) -> str:
+        if not piece.chunk_numbers:
+            return f"[{number}] {piece.source}"
+        first, last = piece.chunk_numbers[0], piece.chunk_numbers[-1]
+        span = f"chunk {first}" if first == last else f"chunks {first}-{last}"
+        return f"[{number}] {piece.source}, {span}"
+
+    def pack(self, query: str, chunks: Sequence[Tuple[str, str]]) -> PackedContext:
+        """Prompt for `query` from (filename, text) chunks in rank order."""
+        question = f"Question: {query}"
+        remaining = self.budget_tokens - self.count_tokens(f"Context:\n\n{question}")
+        seen, blocks, pieces = set(), [], []
+        for piece in merge_chunks(chunks):
+            lines = self._compact(piece.text, seen)
+            if not lines:
+                continue
+            header = self._header(len(blocks) + 1, piece)
+            cost = self.count_tokens(header) + 2
+            kept = []
+            for line, keys in lines:
+                line_cost = self.count_tokens(line) + 1
+                if cost + line_cost > remaining:
+                    break
+                kept.append(line)
+                seen.update(keys)
+                cost += line_cost
+            if not kept:
+                continue
+            blocks.append("\n".join([header] + kept))
+            pieces.append(piece._replace(text="\n".join(kept)))
+            remaining -= cost
+
+        prompt = "Context:\n" + "\n\n".join(blocks) + f"\n\n{question}" if blocks else question
+        tokens = self.count_tokens(prompt)
+        raw_tokens = self.count_tokens(build_prompt(query, [text for _, text in chunks]))
+        logger.info(f"Packed {len(chunks)} chunks into {len(pieces)} passages: {tokens} prompt tokens "
+                    f"({raw_tokens - tokens} saved of {raw_tokens})")
+        return PackedContext(prompt, tokens, raw_tokens, pieces)
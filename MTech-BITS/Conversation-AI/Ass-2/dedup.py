@@ -0,0 +1,133 @@
+"""Near-duplicate chunk removal with MinHash signatures and LSH banding.
+
+Each chunk is reduced to its set of word shingles, and a MinHash signature
+of `num_perm` values estimates the Jaccard similarity of two sets as the
+fraction of equal values. Signatures are cut into bands; chunks that agree
+on a whole band land in the same bucket and become candidate pairs, which
+are kept if their estimated similarity reaches the threshold. Chunks are
+grouped in corpus order under the first chunk of each group, which is kept
+and records every member's source reference; every member reaches the
+threshold against that kept chunk itself, not merely through a chain of
+neighbours.
+
+    python chunk_corpus.py chunk --markdown-dir financial-docs-md --out chunks.chunks --dedup-threshold 0.85
+"""
+import re
+import zlib
+from typing import Dict, List
+
+import numpy as np
+from loguru import logger
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = 5) -> set:
+    """Hashed, lowercased word `size`-grams (the words themselves for short texts)."""
+    words = _WORD.findall(text.lower())
+    grams = [" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))]
+    return {zlib.crc32(gram.encode("utf-8")) for gram in grams if gram}
+
+
+class MinHasher:
+    """MinHash over 32-bit shingle hashes with seeded universal hash functions."""
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, np.iinfo(np.int64).max, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self.b = rng.randint(0, np.iinfo(np.int64).max, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+    def signature(self, hashes: set) -> np.ndarray:
+        if not hashes:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        values = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))[:, None]
+        # Wraps mod 2**64 before the mod, as in the usual numpy MinHash
+        permuted = (values * self.a + self.b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+
+def lsh_params(threshold: float, num_perm: int):
+    """(bands, rows) whose S-curve midpoint (1/b)^(1/r) is closest to `threshold`."""
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+def near_duplicate_groups(texts: List[str], threshold: float = 0.85, num_perm: int = 128,
+                          shingle_size: int = 5) -> List[List[int]]:
+    """Groups of chunk positions, each sorted and led by its kept chunk.
+
+    Chunks are taken in corpus order; each joins the earliest kept chunk it
+    shares a bucket with and matches at `threshold` estimated Jaccard, or is
+    kept itself. Members are never compared with each other, so no chunk is
+    dropped for a kept chunk it is less similar to than `threshold`.
+    """
+    hasher = MinHasher(num_perm)
+    bands, rows = lsh_params(threshold, num_perm)
+
+    # Buckets hold kept chunks only: they are the only chunks a later one may join
+    buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+    signatures, groups = [], {}
+    for i, text in enumerate(texts):
+        signature = hasher.signature(shingles(text, shingle_size))
+        signatures.append(signature)
+        keys = [signature[band * rows:(band + 1) * rows].tobytes() for band in range(bands)]
+        candidates = sorted({kept for band, key in enumerate(keys) for kept in buckets[band].get(key, ())})
+        match = next((kept for kept in candidates
+                      if np.mean(signature == signatures[kept]) >= threshold), None)
+        if match is not None:
+            groups[match].append(i)
+            continue
+        groups[i] = [i]
+        for band, key in enumerate(keys):
+            buckets[band].setdefault(key, []).append(i)
+    return sorted(groups.values())
+
+
+def size_report(texts: List[str], kept: List[int]) -> dict:
+    """Chunk count and UTF-8 text size before and after dedup."""
+    before_bytes = sum(len(text.encode("utf-8")) for text in texts)
+    after_bytes = sum(len(texts[i].encode("utf-8")) for i in kept)
+    return {
+        "chunks_before": len(texts),
+        "chunks_after": len(kept),
+        "text_bytes_before": before_bytes,
+        "text_bytes_after": after_bytes,
+        # Index entries (BM25 documents, vectors) scale with the chunk count
+        "index_reduction": 1 - len(kept) / len(texts) if texts else 0.0,
+        "text_reduction": 1 - after_bytes / before_bytes if before_bytes else 0.0,
+    }
+
+
+def dedup_records(records: list, threshold: float = 0.85, num_perm: int = 128, shingle_size: int = 5):
+    """Collapses near-duplicate `ChunkRecord`s to canonical ones.
+
+    Returns (records, report). Each kept record's `sources` lists the
+    reference (name, source, chunk number, char span) of every chunk in its
+    group, itself first.
+    """
+    groups = near_duplicate_groups([record.text for record in records], threshold, num_perm, shingle_size)
+    kept = []
+    for group in groups:
+        sources = [
+            {"name": records[i].name, "source": records[i].source,
+             "chunk_number": records[i].chunk_number,
+             "char_span": list(records[i].char_span) if records[i].char_span else None}
+            for i in group
+        ]
+        kept.append((group[0], records[group[0]]._replace(sources=sources)))
+    kept.sort(key=lambda item: item[0])
+    report = size_report([record.text for record in records], [i for i, _ in kept])
+    report["groups_merged"] = sum(1 for group in groups if len(group) > 1)
+    logger.info(
+        f"Dedup at Jaccard >= {threshold}: {report['chunks_before']} -> {report['chunks_after']} chunks "
+        f"({report['index_reduction']:.1%} fewer index entries, {report['text_reduction']:.1%} less text)"
+    )
+    return [record for _, record in kept], report
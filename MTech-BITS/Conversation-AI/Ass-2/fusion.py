@@ -0,0 +1,53 @@
+"""Fusion of ranked candidate lists from several retrievers.
+
+Each retriever hands in a list of (doc_id, score) pairs, best first. Lists
+are merged by doc_id, so a chunk found by both BM25 and dense search appears
+once and gets credit from both.
+"""
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+Candidates = Sequence[Tuple[int, float]]
+
+
+def reciprocal_rank_fusion(candidate_lists: List[Candidates], weights: Sequence[float] = None,
+                           k: int = 60) -> List[Tuple[int, float]]:
+    """Weighted RRF: sum of weight / (k + rank) over the lists a doc appears in."""
+    weights = weights or [1.0] * len(candidate_lists)
+    fused: Dict[int, float] = {}
+    for candidates, weight in zip(candidate_lists, weights):
+        for rank, (doc_id, _) in enumerate(candidates, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def normalized_score_fusion(candidate_lists: List[Candidates],
+                            weights: Sequence[float] = None) -> List[Tuple[int, float]]:
+    """Weighted sum of per-list min-max normalised scores (missing counts as 0)."""
+    weights = weights or [1.0] * len(candidate_lists)
+    fused: Dict[int, float] = {}
+    for candidates, weight in zip(candidate_lists, weights):
+        if not candidates:
+            continue
+        scores = np.array([score for _, score in candidates], dtype=np.float64)
+        low, high = scores.min(), scores.max()
+        norm = (scores - low) / (high - low) if high > low else np.ones_like(scores)
+        for (doc_id, _), value in zip(candidates, norm):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight * float(value)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+FUSION_METHODS = {
+    "rrf": reciprocal_rank_fusion,
+    "score": normalized_score_fusion,
+}
+
+
+def fuse(candidate_lists: List[Candidates], method: str = "rrf",
+         weights: Sequence[float] = None, limit: int = None) -> List[Tuple[int, float]]:
+    """Merges candidate lists with the named method and keeps the best `limit`."""
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method: {method}")
+    fused = FUSION_METHODS[method](candidate_lists, weights=weights)
+    return fused[:limit] if limit is not None else fused
@@ -0,0 +1,181 @@
+"""Bounded scheduling of LLM generations.
+
+Without it every session streams from the Ollama backend at once, and with
+one GPU behind it everyone's tokens/sec drops together. The scheduler runs
+generations on a fixed number of worker threads and queues the rest:
+
+- Order: lower `priority` first; within a priority, users are served round
+  robin (start-time fair queuing), and each user's requests stay FIFO, so
+  one busy session cannot starve the others.
+- Backpressure: past `max_queue` waiting requests in total, or
+  `max_queue_per_user` for one user, `submit` raises `SchedulerBusy` at
+  once and the caller shows BUSY_MESSAGE instead of waiting for a timeout.
+- Metrics: queue depth, active generations, and the wait from submission
+  to a worker picking the request up.
+
+A worker pushes chunks into the request's stream as the backend produces
+them, so the caller still drains an ordinary iterator.
+"""
+import heapq
+import queue
+import time
+import threading
+from collections import deque
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+from loguru import logger
+
+BUSY_MESSAGE = "The assistant is busy answering other questions right now. Please try again in a moment."
+
+_DONE = object()
+
+
+class SchedulerBusy(Exception):
+    """Raised by `submit` when the queue is full."""
+
+
+class ScheduledStream:
+    """Chunks of one scheduled generation, in order, as the worker produces them.
+
+    Re-raises the backend's exception, if any, once the chunks before it are
+    consumed. `close()` asks the worker to stop early: a queued request is
+    skipped, and a running one has its backend stream closed at the next
+    chunk, freeing the worker. `started_at` is the `time.perf_counter()` at
+    which a worker started the generation, None until then.
+    """
+
+    def __init__(self):
+        self._chunks = queue.Queue()
+        self.cancelled = threading.Event()
+        self.started_at = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self._chunks.get()
+        if item is _DONE:
+            self._chunks.put(_DONE)
+            raise StopIteration
+        if isinstance(item, BaseException):
+            self._chunks.put(_DONE)
+            raise item
+        return item
+
+    def close(self):
+        self.cancelled.set()
+
+
+class _Job:
+    __slots__ = ("generate", "user", "stream", "submitted_at")
+
+    def __init__(self, generate, user, stream):
+        self.generate = generate
+        self.user = user
+        self.stream = stream
+        self.submitted_at = time.perf_counter()
+
+
+class GenerationScheduler:
+    """Fixed worker pool with a fair, bounded request queue."""
+
+    def __init__(self, workers: int = 1, max_queue: int = 16, max_queue_per_user: int = 2,
+                 window: int = 500):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self._heap = []  # (priority, fair tag, seq, job)
+        self._queued_per_user = {}
+        self._last_tag = {}
+        self._virtual_time = 0.0
+        self._seq = 0
+        self._active = 0
+        self._counts = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0, "cancelled": 0}
+        self._waits_ms = deque(maxlen=window)
+        self._condition = threading.Condition()
+        for i in range(workers):
+            threading.Thread(target=self._run, name=f"generation-{i}", daemon=True).start()
+
+    def submit(self, generate: Callable[[], Iterable], user: Optional[str] = None,
+               priority: int = 0) -> ScheduledStream:
+        """Queues `generate()` (which returns a chunk iterator) and returns its stream.
+
+        Raises SchedulerBusy if the queue, or this user's share of it, is full.
+        """
+        stream = ScheduledStream()
+        job = _Job(generate, user, stream)
+        with self._condition:
+            queued_for_user = self._queued_per_user.get(user, 0)
+            if len(self._heap) >= self.max_queue or queued_for_user >= self.max_queue_per_user:
+                self._counts["rejected"] += 1
+                logger.warning(f"Generation queue full ({len(self._heap)} waiting, {queued_for_user} for this user)")
+                raise SchedulerBusy(BUSY_MESSAGE)
+            # Each request of a user starts one step after that user's previous one
+            tag = max(self._virtual_time, self._last_tag.get(user, 0.0)) + 1
+            self._last_tag[user] = tag
+            self._queued_per_user[user] = queued_for_user + 1
+            self._seq += 1
+            heapq.heappush(self._heap, (priority, tag, self._seq, job))
+            self._counts["submitted"] += 1
+            self._condition.notify()
+        return stream
+
+    def _next_job(self) -> _Job:
+        with self._condition:
+            while not self._heap:
+                self._condition.wait()
+            _, tag, _, job = heapq.heappop(self._heap)
+            self._virtual_time = max(self._virtual_time, tag - 1)
+            remaining = self._queued_per_user[job.user] - 1
+            if remaining:
+                self._queued_per_user[job.user] = remaining
+            else:
+                del self._queued_per_user[job.user]
+                if not self._heap:
+                    self._last_tag.clear()
+            self._active += 1
+            self._waits_ms.append((time.perf_counter() - job.submitted_at) * 1000)
+            return job
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            outcome = "completed"
+            chunks = None
+            try:
+                if job.stream.cancelled.is_set():
+                    outcome = "cancelled"
+                else:
+                    job.stream.started_at = time.perf_counter()
+                    chunks = iter(job.generate())
+                    for chunk in chunks:
+                        if job.stream.cancelled.is_set():
+                            outcome = "cancelled"
+                            break
+                        job.stream._chunks.put(chunk)
+                job.stream._chunks.put(_DONE)
+            except Exception as e:
+                logger.exception("Generation failed")
+                outcome = "failed"
+                job.stream._chunks.put(e)
+            finally:
+                # Stops the backend generating and returns its connection
+                close = getattr(chunks, "close", None)
+                if close is not None:
+                    try:
+                        close()
+                    except Exception:
+                        logger.exception("Closing a generation stream failed")
+            with self._condition:
+                self._active -= 1
+                self._counts[outcome] += 1
+
+    def stats(self) -> dict:
+        """Counters, current queue depth and queue wait percentiles (ms)."""
+        with self._condition:
+            stats = dict(self._counts, queued=len(self._heap), active=self._active, workers=self.workers)
+            waits = list(self._waits_ms)
+        if waits:
+            stats["queue_wait_ms"] = {f"p{q}": float(np.percentile(waits, q)) for q in (50, 95, 99)}
+        return stats
@@ -0,0 +1,165 @@
+"""Tiered input guardrail.
+
+Most messages are plain finance questions, so the RoBERTa toxicity model is
+the last resort rather than the first step:
+
+1. Verdict cache: a recent verdict for the same normalised text is reused.
+2. Lexical stage: `better_profanity` rejects obvious profanity. A short
+   message is accepted outright only if all its words come from the filing
+   vocabulary, it names at least one finance term, and it has no
+   second-person or threat words; the filing vocabulary alone is mostly
+   ordinary English and says nothing about intent.
+3. Transformer stage: everything else goes to the toxicity classifier. Calls
+   from concurrent sessions are collected into small batches.
+"""
+import re
+import time
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Iterable, Optional, Tuple
+
+from loguru import logger
+
+from query_cache import normalize_query
+
+REJECTION_MESSAGE = "Your input violates community guidelines."
+
+_WORD_RE = re.compile(r"[a-z]+")
+
+# Words that make a message a question about the filings
+FINANCE_TERMS = frozenset("""
+    revenue revenues sales income earnings profit profits loss losses margin margins ebitda eps
+    expense expenses cost costs cash flow flows assets asset liabilities liability equity debt
+    dividend dividends share shares repurchase repurchases buyback stock stockholders shareholders
+    balance sheet capital tax taxes fiscal quarter quarterly annual segment segments growth
+    operating net gross fy guidance outlook valuation investment investments depreciation
+    amortization inventory receivables payables research development iphone mac ipad services
+    wearables apple
+""".split())
+
+# Second-person and threat words: such messages go to the model whatever their vocabulary
+HOSTILE_TERMS = frozenset("""
+    you your yours yourself yourselves u ur ya
+    kill killed killing hurt harm suffer die dead death attack destroy burn shoot stab bomb
+    punish revenge threat threaten beat rape hunt regret
+""".split())
+
+
+class BatchedClassifier:
+    """Collects concurrent classifier calls into batches on one worker thread.
+
+    A batch closes when it reaches `max_batch` texts or `max_wait_ms` after
+    its first text arrived, whichever comes first.
+    """
+
+    def __init__(self, get_classifier: Callable[[], Callable], max_batch: int = 16,
+                 max_wait_ms: float = 10):
+        self._get_classifier = get_classifier
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+        threading.Thread(target=self._run, name="guardrail-batcher", daemon=True).start()
+
+    def score(self, text: str) -> float:
+        """Top-label score for `text`, as `pipeline(text)[0]["score"]`."""
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                results = self._get_classifier()([text for text, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result["score"])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            with self._lock:
+                self.batches += 1
+                self.texts += len(batch)
+
+
+class GuardrailCascade:
+    """Cache, then lexical checks, then the toxicity model."""
+
+    def __init__(self, classifier: BatchedClassifier, vocabulary: Iterable[str] = (),
+                 threshold: float = 0.5, max_benign_words: int = 64, cache_size: int = 4096,
+                 finance_terms: Iterable[str] = FINANCE_TERMS, hostile_terms: Iterable[str] = HOSTILE_TERMS):
+        from better_profanity import profanity
+        profanity.load_censor_words()
+        self._profanity = profanity
+        self.classifier = classifier
+        self.vocabulary = frozenset(vocabulary)
+        self.finance_terms = frozenset(finance_terms)
+        self.hostile_terms = frozenset(hostile_terms)
+        self.threshold = threshold
+        self.max_benign_words = max_benign_words
+        self.cache_size = cache_size
+        self._verdicts = OrderedDict()  # normalised text -> (valid, message)
+        self._lock = threading.Lock()
+        self._counts = {"cache": 0, "lexical_reject": 0, "lexical_accept": 0, "model": 0}
+
+    def _lexical_verdict(self, text: str) -> Optional[Tuple[bool, Optional[str]]]:
+        """A verdict for clear cases, None for ambiguous ones."""
+        if self._profanity.contains_profanity(text):
+            return False, REJECTION_MESSAGE
+        words = _WORD_RE.findall(text)
+        if (words and len(words) <= self.max_benign_words
+                and all(w in self.vocabulary for w in words)
+                and not self.hostile_terms.intersection(words)
+                and self.finance_terms.intersection(words)):
+            return True, None
+        return None
+
+    def _count(self, stage: str):
+        with self._lock:
+            self._counts[stage] += 1
+
+    def check(self, text: str) -> Tuple[bool, Optional[str]]:
+        """Returns (valid, message); `message` is the reply to show when invalid."""
+        key = normalize_query(text)
+        with self._lock:
+            verdict = self._verdicts.get(key)
+            if verdict is not None:
+                self._verdicts.move_to_end(key)
+                self._counts["cache"] += 1
+                return verdict
+
+        verdict = self._lexical_verdict(key)
+        if verdict is not None:
+            self._count("lexical_accept" if verdict[0] else "lexical_reject")
+        else:
+            toxicity_score = self.classifier.score(text)
+            logger.info(f"Toxicity score: {toxicity_score}")
+            self._count("model")
+            verdict = (False, REJECTION_MESSAGE) if toxicity_score > self.threshold else (True, None)
+
+        with self._lock:
+            self._verdicts[key] = verdict
+            while len(self._verdicts) > self.cache_size:
+                self._verdicts.popitem(last=False)
+        return verdict
+
+    def stats(self) -> dict:
+        """Decisions per stage, plus the classifier's batching."""
+        with self._lock:
+            stats = dict(self._counts)
+        stats["batches"] = self.classifier.batches
+        stats["avg_batch_size"] = self.classifier.texts / self.classifier.batches if self.classifier.batches else 0.0
+        return stats
@@ -0,0 +1,221 @@
+"""Ingestion CLI: PDF conversion and incremental updates of the retrieval indexes.
+
+    python ingest.py convert # PDFs to markdown, page-sharded in a process pool
+    python ingest.py add     # index new chunk files, sync Qdrant with the corpus
+    python ingest.py embed   # re-embed every chunk and rewrite the vector stores
+    python ingest.py merge   # compact the BM25 and local vector segments
+
+`add` tokenizes and embeds only the new chunk files: they become a new BM25
+segment, their embeddings are appended to the chunk matrix, and their vectors
+become a new local vector store segment and/or are upserted into Qdrant. The
+running app picks the segments up on its next start, and merges them in the
+background once there are more than MAX_INDEX_SEGMENTS.
+
+Qdrant point ids are derived from each chunk's file name and content hash,
+and a manifest (QDRANT_MANIFEST_DIR/<collection>.json) records the points
+already in the collection. `add` upserts only chunks whose point is missing
+or stale and deletes the points of chunks that changed or vanished, so
+re-running it nightly over the whole filing set is cheap.
+
+Encoding is streamed: every `--stream-batch-size` chunks are handed to a bulk
+upserter that keeps at most `--max-in-flight` Qdrant requests of
+`--upsert-batch-size` points open, so writing overlaps with encoding. Both
+the encoder and the end-to-end run report chunks/s.
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+from loguru import logger
+
+from chunk_corpus import read_corpus
+from chunk_embeddings import update_embeddings
+from pdf_convert import convert_pdfs
+from segments import load_or_update_index, merge_segments
+from vector_store import (BulkUpserter, LocalVectorStore, QdrantVectorStore, append_segment,
+                          chunk_payloads, compact_local_store, read_point_manifest, save_local_store,
+                          sync_points, write_point_manifest)
+
+
+def open_qdrant(args):
+    """The --qdrant-collection store and the points it holds, from the point
+    manifest (or from the collection itself if there is none, or --rescan)."""
+    store = QdrantVectorStore(args.qdrant_collection, os.getenv("QDRANT_HOST"), api_key=os.getenv("QDRANT_API_KEY"))
+    indexed = None if args.rescan else read_point_manifest(manifest_path(args))
+    if indexed is None:
+        logger.info(f"Reading point ids from Qdrant collection {args.qdrant_collection}")
+        indexed = store.indexed_points()
+    return store, indexed
+
+
+def manifest_path(args) -> str:
+    return args.point_manifest or os.path.join(
+        os.getenv("QDRANT_MANIFEST_DIR", "./index/qdrant"), f"{args.qdrant_collection}.json")
+
+
+def embed_and_upsert(args, files, chunks, content_hash, positions, qdrant=None, reuse=True):
+    """Updates the embedding matrix and streams the rows at `positions` into
+    `qdrant` while the encoder works on the next slice.
+
+    Rows that are reused from the saved matrix are upserted at the end.
+    """
+    upserters, streamed = [], set()
+    wanted = set(positions)
+
+    def upsert(rows, ids):
+        if qdrant is None or not ids:
+            return
+        if not upserters:
+            qdrant.ensure_collection(int(rows.shape[1]))
+            upserters.append(BulkUpserter(qdrant.upsert, batch_size=args.upsert_batch_size,
+                                          max_in_flight=args.max_in_flight))
+        upserters[0].add(rows, chunk_payloads(files, chunks, ids))
+        streamed.update(ids)
+
+    def on_encoded(encoded_positions, rows):
+        keep = [j for j, position in enumerate(encoded_positions) if position in wanted]
+        upsert(rows[keep], [encoded_positions[j] for j in keep])
+
+    started = time.perf_counter()
+    try:
+        matrix = update_embeddings(args.embeddings_dir, files, chunks, content_hash,
+                                   batch_size=args.batch_size, stream_batch_size=args.stream_batch_size,
+                                   processes=args.processes, on_encoded=on_encoded, reuse=reuse)
+        rest = [position for position in positions if position not in streamed]
+        upsert(matrix[rest], rest)
+        if upserters:
+            upserters[0].close()
+    except BaseException:
+        if upserters:
+            upserters[0].__exit__(*sys.exc_info())
+        raise
+    elapsed = time.perf_counter() - started
+    if upserters:
+        written, seconds = upserters[0].written, upserters[0].seconds
+        logger.info(f"Upserted {written} points into Qdrant collection {qdrant.collection_name} "
+                    f"({written / max(seconds, 1e-9):.1f} points/s)")
+    logger.info(f"Embedded {len(positions)} chunks in {elapsed:.1f}s "
+                f"({len(positions) / max(elapsed, 1e-9):.1f} chunks/s end to end)")
+    return matrix
+
+
+def write_local_vectors(args, files, chunks, matrix, positions):
+    if len(positions) == len(files) or not os.path.isdir(args.vectors_dir):
+        # New store, or the BM25 index was rebuilt from scratch: write it whole
+        store = LocalVectorStore.from_vectors(matrix, chunk_payloads(files, chunks), args.hnsw)
+        save_local_store(args.vectors_dir, store)
+    else:
+        append_segment(args.vectors_dir, matrix[positions], chunk_payloads(files, chunks, positions),
+                       use_hnsw=args.hnsw)
+
+
+def ingest(args, force=False):
+    """Indexes new chunk files and syncs Qdrant with the corpus.
+
+    Only chunks without saved embeddings are encoded; only points that are
+    missing or stale are upserted, and points of vanished chunks are deleted.
+    With `force`, every chunk is re-encoded and re-upserted.
+    """
+    index, files, chunks, added = load_or_update_index(args.index_dir, *read_corpus(args.data_dir))
+    qdrant, upsert, delete = None, [], []
+    if args.qdrant_collection:
+        qdrant, indexed = open_qdrant(args)
+        upsert, delete, manifest = sync_points(indexed, files, chunks, force=force)
+        logger.info(f"Qdrant: {len(indexed)} points indexed, {len(upsert)} to upsert, {len(delete)} to delete")
+    if force:
+        added = list(range(len(files)))
+    if not added and not upsert and not delete:
+        logger.info("The indexes are up to date")
+        return
+
+    matrix = embed_and_upsert(args, files, chunks, index.content_hash,
+                              upsert if qdrant is not None else added, qdrant, reuse=not force)
+    if qdrant is not None:
+        if delete:
+            qdrant.delete(delete)
+            logger.info(f"Deleted {len(delete)} points of vanished or changed chunks")
+        write_point_manifest(manifest_path(args), manifest)
+    if args.vectors_dir and added:
+        write_local_vectors(args, files, chunks, matrix, added)
+    logger.info(f"Indexed {len(added)} new chunks; the corpus now has {len(files)}")
+
+
+def add(args):
+    ingest(args)
+
+
+def embed(args):
+    """Re-embeds every chunk and rewrites the vector stores."""
+    ingest(args, force=True)
+
+
+def convert(args):
+    pdf_paths = sorted(glob.glob(f"{args.pdf_dir}/*.pdf"))
+    if not pdf_paths:
+        logger.warning(f"No PDFs in {args.pdf_dir}")
+        return
+    convert_pdfs(pdf_paths, args.out, args.cache_dir, workers=args.workers, pages_per_shard=args.pages_per_shard)
+
+
+def merge(args):
+    merge_segments(args.index_dir)
+    if args.vectors_dir and os.path.isdir(args.vectors_dir):
+        compact_local_store(args.vectors_dir)
+
+
+def add_embedding_args(parser):
+    parser.add_argument("--data-dir", default=os.getenv("CHUNK_CORPUS", "./financial-docs-md/chunks-500"),
+                        help="Chunk directory or packed corpus file")
+    parser.add_argument("--embeddings-dir", default=os.getenv("CHUNK_EMBEDDINGS_DIR", "./index/embeddings"))
+    parser.add_argument("--qdrant-collection", metavar="COLLECTION",
+                        help="Also upsert the chunks into this Qdrant collection")
+    parser.add_argument("--batch-size", type=int, default=64, help="Encoder forward-pass batch size")
+    parser.add_argument("--stream-batch-size", type=int, default=512,
+                        help="Chunks encoded before their vectors are handed to the upserter")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="Encoder processes (0 or 1: encode in this process)")
+    parser.add_argument("--upsert-batch-size", type=int, default=256, help="Points per upsert request")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="Concurrent upsert requests")
+    parser.add_argument("--point-manifest",
+                        help="Points already in the collection (default: $QDRANT_MANIFEST_DIR/<collection>.json)")
+    parser.add_argument("--rescan", action="store_true",
+                        help="Read the indexed points from Qdrant instead of the manifest")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-dir", default=os.getenv("BM25_INDEX_DIR", "./index/bm25"))
+    parser.add_argument("--vectors-dir", default=os.getenv("LOCAL_VECTOR_DIR"),
+                        help="Local vector store to update (LOCAL_VECTOR_DIR)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="Convert PDFs to markdown")
+    convert_parser.add_argument("--pdf-dir", default="./financial-docs-raw")
+    convert_parser.add_argument("--out", default="./financial-docs-md")
+    convert_parser.add_argument("--cache-dir", default=os.getenv("PDF_PAGE_CACHE_DIR", "./index/pdf_pages"),
+                                help="Per-page conversion cache")
+    convert_parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count)")
+    convert_parser.add_argument("--pages-per-shard", type=int, default=8)
+    convert_parser.set_defaults(func=convert)
+
+    add_parser = subparsers.add_parser("add", help="Index chunk files that are not indexed yet")
+    add_embedding_args(add_parser)
+    add_parser.add_argument("--hnsw", action="store_true", help="Build an HNSW graph for the new segment")
+    add_parser.set_defaults(func=add)
+
+    embed_parser = subparsers.add_parser("embed", help="Re-embed every chunk and rewrite the vector stores")
+    add_embedding_args(embed_parser)
+    embed_parser.add_argument("--hnsw", action="store_true", help="Build an HNSW graph for the local store")
+    embed_parser.set_defaults(func=embed)
+
+    merge_parser = subparsers.add_parser("merge", help="Compact index segments into one")
+    merge_parser.set_defaults(func=merge)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
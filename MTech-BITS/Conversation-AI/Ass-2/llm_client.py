@@ -0,0 +1,282 @@
+"""Shared HTTP layer for LLM backends (Ollama).
+
+Every caller of a backend URL goes through one `LLMBackend`, whose httpx
+transport gives it:
+
+- keep-alive connection pooling: `ChatOllama` instances and plain JSON
+  calls share the same connections instead of each opening their own;
+- a concurrency limit per URL: past `max_concurrency` requests in flight,
+  callers wait up to the pool timeout for a slot (held until the response
+  is closed, so a streamed answer keeps its slot while it streams) and then
+  get `httpx.PoolTimeout`;
+- retries with exponential backoff and full jitter on connection errors
+  and 429/502/503/504 answers, before any of the body is handed out;
+- a circuit breaker: after `failure_threshold` failures in a row the URL
+  fails fast with `CircuitOpenError` for `reset_seconds`, then one trial
+  request decides whether it closes again.
+
+    backend = get_backend("http://localhost:11434")
+    llm = ChatOllama(model=..., base_url=backend.url, client_kwargs=backend.client_kwargs())
+    answer = backend.generate("gemma2:latest", prompt)
+
+Defaults come from the LLM_* environment variables; `configure_backend`
+sets a URL's limits before first use. The transport is synchronous, which
+is all the app and scripts use.
+"""
+import os
+import time
+import random
+import threading
+from typing import Dict, Optional
+
+import httpx
+from loguru import logger
+
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised without contacting a backend whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half open -> closed."""
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_request(self, url: str):
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                # Let one request through to probe the backend
+                self.state = "half_open"
+                return
+            raise CircuitOpenError(f"Circuit open for {url}, retrying after {self.reset_seconds:.0f}s")
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self, url: str):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Opening circuit for {url} after {self._failures} failures")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response body that frees the request's concurrency slot on close."""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """Pooled transport with a concurrency limit, retries and a circuit breaker."""
+
+    def __init__(self, url: str, max_concurrency: int = 4, max_retries: int = 3,
+                 backoff_seconds: float = 0.5, max_backoff_seconds: float = 8,
+                 breaker: Optional[CircuitBreaker] = None, keepalive_seconds: float = 60):
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self._transport = httpx.HTTPTransport(limits=httpx.Limits(
+            max_connections=max_concurrency,
+            max_keepalive_connections=max_concurrency,
+            keepalive_expiry=keepalive_seconds,
+        ))
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counts = {"requests": 0, "retries": 0, "failures": 0, "rejected": 0, "pool_timeouts": 0}
+
+    def _acquire(self, request: httpx.Request):
+        # Bounded wait, so leaked slots surface as errors rather than hangs
+        timeout = request.extensions.get("timeout", {}).get("pool")
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self._counts["pool_timeouts"] += 1
+            raise httpx.PoolTimeout(f"No free slot for {self.url} after {timeout}s", request=request)
+        with self._lock:
+            self._in_flight += 1
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        # Full jitter: anywhere up to the exponential step, so retries spread out
+        delay = random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), self.max_backoff_seconds))
+        return delay
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            self._counts["requests"] += 1
+        attempt = 0
+        while True:
+            # Slot first: a half-open breaker's trial must not die waiting for one
+            self._acquire(request)
+            try:
+                self.breaker.before_request(self.url)
+            except CircuitOpenError:
+                self._release()
+                with self._lock:
+                    self._counts["rejected"] += 1
+                raise
+            try:
+                response = self._transport.handle_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+                # Nothing was generated; safe to send again
+                self._release()
+                self.breaker.record_failure(self.url)
+                error, retry_after = e, None
+            except Exception:
+                self._release()
+                self.breaker.record_failure(self.url)
+                with self._lock:
+                    self._counts["failures"] += 1
+                raise
+            else:
+                retryable = response.status_code in RETRY_STATUSES
+                if retryable:
+                    self.breaker.record_failure(self.url)
+                else:
+                    self.breaker.record_success()
+                if not retryable or attempt >= self.max_retries:
+                    if retryable:
+                        with self._lock:
+                            self._counts["failures"] += 1
+                    # Out of retries, the caller gets the backend's answer as without them
+                    return httpx.Response(
+                        status_code=response.status_code,
+                        headers=response.headers,
+                        stream=_ReleasingStream(response.stream, self._release),
+                        extensions=response.extensions,
+                    )
+                response.close()
+                self._release()
+                error = f"{response.status_code} from {self.url}"
+                retry_after = response.headers.get("retry-after")
+
+            if attempt >= self.max_retries:
+                with self._lock:
+                    self._counts["failures"] += 1
+                raise error
+            delay = self._backoff(attempt, retry_after)
+            logger.warning(f"{request.method} {request.url.path} failed ({error}); "
+                           f"retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+            with self._lock:
+                self._counts["retries"] += 1
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self._transport.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts, in_flight=self._in_flight, max_concurrency=self.max_concurrency,
+                        circuit=self.breaker.state)
+
+
+class LLMBackend:
+    """One backend URL: its shared transport, timeouts and a JSON client."""
+
+    def __init__(self, url: str, max_concurrency: int = 4, max_retries: int = 3,
+                 connect_timeout: float = 5, read_timeout: float = 300, pool_timeout: float = 60,
+                 failure_threshold: int = 5, reset_seconds: float = 30):
+        self.url = url.rstrip("/")
+        self.transport = ResilientTransport(
+            self.url, max_concurrency=max_concurrency, max_retries=max_retries,
+            breaker=CircuitBreaker(failure_threshold, reset_seconds),
+        )
+        # read_timeout bounds the wait for each streamed chunk, not the whole
+        # answer; pool_timeout the wait for a free concurrency slot
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=pool_timeout)
+        self.client = httpx.Client(base_url=self.url, transport=self.transport, timeout=self.timeout)
+
+    def client_kwargs(self) -> dict:
+        """httpx arguments that put an `ollama.Client` (or ChatOllama) on this backend."""
+        return {"transport": self.transport, "timeout": self.timeout}
+
+    def post_json(self, path: str, payload: dict) -> dict:
+        response = self.client.post(path, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    def generate(self, model: str, prompt: str, **options) -> str:
+        """Non-streaming /api/generate; returns the response text."""
+        body = self.post_json("/api/generate", {"model": model, "prompt": prompt, "stream": False, **options})
+        return body.get("response", "")
+
+    def stats(self) -> dict:
+        return self.transport.stats()
+
+
+_backends: Dict[str, LLMBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def _env_settings() -> dict:
+    return {
+        "max_concurrency": int(os.getenv("LLM_MAX_CONCURRENCY", "4")),
+        "max_retries": int(os.getenv("LLM_MAX_RETRIES", "3")),
+        "connect_timeout": float(os.getenv("LLM_CONNECT_TIMEOUT", "5")),
+        "read_timeout": float(os.getenv("LLM_READ_TIMEOUT", "300")),
+        "pool_timeout": float(os.getenv("LLM_POOL_TIMEOUT", "60")),
+        "failure_threshold": int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+        "reset_seconds": float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30")),
+    }
+
+
+def configure_backend(url: str, **settings) -> LLMBackend:
+    """Creates (or replaces) the backend for `url` with these settings over the
+    environment defaults."""
+    backend = LLMBackend(url, **{**_env_settings(), **settings})
+    with _backends_lock:
+        _backends[backend.url] = backend
+    return backend
+
+
+def get_backend(url: str = None) -> LLMBackend:
+    """The process-wide backend for `url` (default OLLAMA_URL)."""
+    url = (url or os.getenv("OLLAMA_URL") or "http://localhost:11434").rstrip("/")
+    with _backends_lock:
+        backend = _backends.get(url)
+        if backend is None:
+            backend = _backends[url] = LLMBackend(url, **_env_settings())
+        return backend
+
+
+def backend_stats() -> Dict[str, dict]:
+    with _backends_lock:
+        return {url: backend.stats() for url, backend in _backends.items()}
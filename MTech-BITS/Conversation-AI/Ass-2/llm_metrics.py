@@ -0,0 +1,123 @@
+"""Latency metrics for streamed LLM answers.
+
+`ask_llm` wraps the `llm.stream(...)` generator in an `InstrumentedStream`,
+which timestamps the stream as the UI drains it. Generation starts when the
+UI starts draining, or, for a `ScheduledStream`, when a scheduler worker
+picks the request up (its `started_at`):
+
+- queue_ms: from the request being issued until generation starts
+- ttft_ms: time to first token, from the start of generation
+- inter_token_ms: mean gap between consecutive chunks
+- tokens_per_sec: decode speed after the first token
+
+Each finished stream is appended as a JSON line to a rotating metrics file,
+and the recorder keeps a rolling window for p50/p95/p99.
+"""
+import json
+import time
+import threading
+from collections import deque
+
+import numpy as np
+from loguru import logger
+
+METRIC_NAMES = ("queue_ms", "ttft_ms", "inter_token_ms", "tokens_per_sec", "total_ms")
+
+
+class LLMMetricsRecorder:
+    """Writes per-message metrics to a rotating file and keeps a rolling window."""
+
+    def __init__(self, path: str = None, rotation: str = "10 MB", retention: int = 5,
+                 window: int = 500):
+        self._records = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._sink_id = None
+        if path:
+            self._sink_id = logger.add(
+                path,
+                rotation=rotation,
+                retention=retention,
+                format="{message}",
+                filter=lambda record: record["extra"].get("llm_metrics", False),
+                enqueue=True,
+            )
+        self._logger = logger.bind(llm_metrics=True)
+
+    def record(self, metrics: dict):
+        with self._lock:
+            self._records.append(metrics)
+        self._logger.info(json.dumps(metrics))
+
+    def percentiles(self, quantiles=(50, 95, 99)) -> dict:
+        """{metric: {"p50": ..., "p95": ..., "p99": ...}} over the window."""
+        with self._lock:
+            records = list(self._records)
+        summary = {}
+        for name in METRIC_NAMES:
+            values = [r[name] for r in records if r.get(name) is not None]
+            if values:
+                summary[name] = {f"p{q}": float(np.percentile(values, q)) for q in quantiles}
+        return summary
+
+    def __len__(self):
+        return len(self._records)
+
+
+class InstrumentedStream:
+    """Iterates an LLM chunk stream unchanged while timing it."""
+
+    def __init__(self, stream, recorder: LLMMetricsRecorder, model: str = None):
+        self._stream = stream
+        self._iterator = None
+        self._recorder = recorder
+        self._model = model
+        self._issued_at = time.perf_counter()
+        self._drain_start = None
+        self._chunk_times = []
+        self._output_tokens = None
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._drain_start is None:
+            self._drain_start = time.perf_counter()
+            self._iterator = iter(self._stream)
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            self._finish()
+            raise
+        self._chunk_times.append(time.perf_counter())
+        # ChatOllama reports the real token count on the last chunk
+        usage = getattr(chunk, "usage_metadata", None)
+        if usage and usage.get("output_tokens"):
+            self._output_tokens = usage["output_tokens"]
+        return chunk
+
+    def close(self):
+        """Closes the underlying stream, e.g. when the reader stops early."""
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+
+    def _finish(self):
+        if self._done:
+            return
+        self._done = True
+        times = self._chunk_times
+        tokens = self._output_tokens or len(times)
+        # Scheduled generations wait in the scheduler's queue while being drained
+        started_at = getattr(self._stream, "started_at", None) or self._drain_start
+        metrics = {
+            "ts": time.time(),
+            "model": self._model,
+            "tokens": tokens,
+            "queue_ms": (started_at - self._issued_at) * 1000,
+            "ttft_ms": (times[0] - started_at) * 1000 if times else None,
+            "inter_token_ms": float(np.mean(np.diff(times))) * 1000 if len(times) > 1 else None,
+            "tokens_per_sec": (tokens - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else None,
+            "total_ms": ((times[-1] if times else time.perf_counter()) - self._issued_at) * 1000,
+        }
+        self._recorder.record(metrics)
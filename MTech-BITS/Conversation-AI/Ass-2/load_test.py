@@ -0,0 +1,264 @@
+"""Headless load test of the chat pipeline.
+
+Replays a query log through `ChatPipeline` (guardrail -> retrieve -> rerank
+-> generate, as in the app) at a target rate: requests are issued on a fixed
+schedule of `--qps` and served by `--users` virtual users, so once every
+user is busy new requests wait in line and the wait shows up as
+`queue_wait`. Each answer stream is drained like the UI does.
+
+The report gives throughput plus a latency histogram and percentiles per
+stage: the pipeline's StageTimings, `generate_ttft` and `generate` for the
+answer stream, and `total` from a user picking the request up to its last
+token. It is printed as a table and optionally written as JSON.
+
+    python stub_ollama.py --port 11435 &
+    python load_test.py --ollama-url http://localhost:11435 --qps 2 --users 4 --requests 200
+
+`--generation-workers N` puts the generations behind a GenerationScheduler,
+as the app does; requests it turns away count as `busy`, and its queue
+stats are added to the report. `--answer-cache` serves repeated questions
+from the semantic answer cache (off by default, since the log is replayed).
+
+`--backend stub` (the default) uses stub_models.py and an in-memory vector
+store, so nothing but the LLM endpoint is contacted.
+"""
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+from loguru import logger
+
+from chat_pipeline import ChatPipeline, get_ollama_llm
+from answer_cache import SemanticAnswerCache
+from context_packing import ContextPacker, context_budget
+from generation_scheduler import GenerationScheduler
+from guardrail import BatchedClassifier, GuardrailCascade
+from llm_client import backend_stats
+from llm_metrics import LLMMetricsRecorder
+from pipeline import StageTimings
+from query_cache import QueryCache
+from retrieval_service import build_service
+
+# Upper bounds of the histogram buckets, in ms; the last bucket is open-ended
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+
+
+def load_query_log(path: str) -> List[str]:
+    """Queries from JSON lines with a "query" field, or one query per line."""
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            queries.append(json.loads(line)["query"] if line.startswith("{") else line)
+    return queries
+
+
+class LatencyHistogram:
+    """Per-stage latency samples with bucket counts and percentiles."""
+
+    def __init__(self):
+        self._samples: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, ms: float):
+        with self._lock:
+            self._samples.setdefault(stage, []).append(ms)
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            samples = {stage: np.asarray(values) for stage, values in self._samples.items()}
+        summary = {}
+        for stage, values in samples.items():
+            counts = np.histogram(values, bins=[0] + BUCKETS_MS + [np.inf])[0]
+            summary[stage] = {
+                "count": int(len(values)),
+                "mean": float(values.mean()),
+                "p50": float(np.percentile(values, 50)),
+                "p95": float(np.percentile(values, 95)),
+                "p99": float(np.percentile(values, 99)),
+                "max": float(values.max()),
+                "histogram": [
+                    {"le_ms": bound, "count": int(count)}
+                    for bound, count in zip(BUCKETS_MS + [None], counts)
+                ],
+            }
+        return summary
+
+
+def run_request(chat: ChatPipeline, query: str, scheduled_at: float, histogram: LatencyHistogram,
+                user: str = None) -> str:
+    """Runs one chat turn and drains its answer. Returns ok, rejected, busy or error."""
+    started = time.perf_counter()
+    histogram.add("queue_wait", (started - scheduled_at) * 1000)
+    timings = StageTimings()
+    try:
+        turn = chat.run(query, timings=timings, user=user)
+        if turn.response is not None:
+            generate_start = time.perf_counter()
+            first_chunk = None
+            for _ in turn.response:
+                if first_chunk is None:
+                    first_chunk = time.perf_counter()
+            end = time.perf_counter()
+            if first_chunk is not None:
+                histogram.add("generate_ttft", (first_chunk - generate_start) * 1000)
+            histogram.add("generate", (end - generate_start) * 1000)
+    except Exception:
+        logger.exception(f"Request failed: {query!r}")
+        return "error"
+    for stage, timing in timings.as_dict().items():
+        histogram.add(stage, timing["duration_ms"])
+    histogram.add("total", (time.perf_counter() - started) * 1000)
+    if not turn.valid:
+        return "rejected"
+    return "ok" if turn.response is not None else "busy"
+
+
+def run_load(chat: ChatPipeline, queries: List[str], qps: float, users: int, requests: int) -> dict:
+    """Issues `requests` queries at `qps` to `users` workers and waits for all of them."""
+    histogram = LatencyHistogram()
+    outcomes = {"ok": 0, "rejected": 0, "busy": 0, "error": 0}
+    outcomes_lock = threading.Lock()
+    work = queue.Queue()
+
+    def virtual_user(user: str):
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            outcome = run_request(chat, item[1], item[0], histogram, user=user)
+            with outcomes_lock:
+                outcomes[outcome] += 1
+
+    threads = [threading.Thread(target=virtual_user, args=(f"user-{i}",), name=f"user-{i}", daemon=True)
+               for i in range(users)]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    for i in range(requests):
+        scheduled_at = start + i / qps
+        delay = scheduled_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        work.put((scheduled_at, queries[i % len(queries)]))
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        **outcomes,
+        "offered_qps": qps,
+        "users": users,
+        "duration_s": elapsed,
+        "throughput_rps": (outcomes["ok"] + outcomes["rejected"] + outcomes["busy"]) / elapsed,
+        "stages": histogram.summary(),
+    }
+
+
+def build_chat_pipeline(args) -> ChatPipeline:
+    service = build_service(args.data_dir, args.index_dir, args.backend,
+                            embeddings_dir=os.getenv("CHUNK_EMBEDDINGS_DIR", "./index/embeddings"))
+    guardrail = GuardrailCascade(BatchedClassifier(lambda: service.models.get("toxicity")),
+                                 vocabulary=service.bm25.vocab)
+    executor = (ThreadPoolExecutor(max_workers=args.retrieval_workers, thread_name_prefix="retrieval")
+                if args.retrieval_workers > 0 else None)
+    return ChatPipeline(
+        service,
+        guardrail,
+        get_ollama_llm(args.model, base_url=args.ollama_url, num_ctx=args.num_ctx),
+        query_cache=None if args.no_cache else QueryCache(max_entries=256),
+        executor=executor,
+        metrics=LLMMetricsRecorder(),
+        scheduler=(GenerationScheduler(args.generation_workers, args.queue_limit, args.queue_per_user)
+                   if args.generation_workers > 0 else None),
+        packer=None if args.context_budget == 0 else ContextPacker(
+            args.context_budget or context_budget(args.model, num_ctx=args.num_ctx)),
+        answer_cache=SemanticAnswerCache(threshold=args.answer_cache_threshold) if args.answer_cache else None,
+        fusion=os.getenv("FUSION_METHOD", "rrf"),
+        bm25_depth=args.bm25_depth,
+        dense_depth=args.dense_depth,
+    )
+
+
+def print_report(report: dict):
+    print(f"{report['requests']} requests at {report['offered_qps']} qps with {report['users']} users "
+          f"in {report['duration_s']:.1f}s: {report['throughput_rps']:.2f} req/s "
+          f"({report['ok']} ok, {report['rejected']} rejected, {report['busy']} busy, {report['error']} errors)")
+    if "answer_cache" in report:
+        cache = report["answer_cache"]
+        print(f"answer cache: {cache['hit_ratio']:.0%} hits ({cache['hits']} hits, "
+              f"{cache['near_misses']} near misses, {cache['misses']} misses)")
+    print(f"{'stage':<16}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, stats in sorted(report["stages"].items(), key=lambda item: -item[1]["p50"]):
+        print(f"{stage:<16}{stats['count']:>7}{stats['p50']:>10.1f}{stats['p95']:>10.1f}"
+              f"{stats['p99']:>10.1f}{stats['max']:>10.1f}")
+    total = report["stages"].get("total")
+    if total:
+        print("total latency histogram:")
+        peak = max(bucket["count"] for bucket in total["histogram"]) or 1
+        for bucket in total["histogram"]:
+            if bucket["count"]:
+                label = f"<= {bucket['le_ms']} ms" if bucket["le_ms"] is not None else f"> {BUCKETS_MS[-1]} ms"
+                print(f"  {label:>12} {'#' * max(1, 40 * bucket['count'] // peak)} {bucket['count']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", default="./eval_queries.jsonl",
+                        help="Query log: JSON lines with a \"query\" field, or plain lines")
+    parser.add_argument("--qps", type=float, default=1.0, help="Target request rate")
+    parser.add_argument("--users", type=int, default=4, help="Concurrent virtual users")
+    parser.add_argument("--requests", type=int, help="Requests to issue (default: one pass over the log)")
+    parser.add_argument("--ollama-url", default=os.getenv("OLLAMA_URL", "http://localhost:11435"))
+    parser.add_argument("--model", default="phi4:latest")
+    parser.add_argument("--backend", choices=["stub", "models"], default="stub")
+    parser.add_argument("--data-dir", default=os.getenv("CHUNK_CORPUS", "./financial-docs-md/chunks-500"),
+                        help="Chunk directory or packed corpus file")
+    parser.add_argument("--index-dir", default=os.getenv("BM25_INDEX_DIR", "./index/bm25"))
+    parser.add_argument("--retrieval-workers", type=int, default=8, help="0 runs the stages in sequence")
+    parser.add_argument("--bm25-depth", type=int, default=int(os.getenv("BM25_DEPTH", "10")),
+                        help="BM25 candidates before fusion")
+    parser.add_argument("--dense-depth", type=int, default=int(os.getenv("DENSE_DEPTH", "10")),
+                        help="Dense candidates before fusion")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the query cache")
+    parser.add_argument("--generation-workers", type=int, default=0,
+                        help="Schedule generations on this many workers (0: every user streams at once)")
+    parser.add_argument("--queue-limit", type=int, default=16, help="Waiting generations before answering busy")
+    parser.add_argument("--queue-per-user", type=int, default=2, help="Waiting generations per user")
+    parser.add_argument("--num-ctx", type=int, help="Context window to ask Ollama for (default: its own)")
+    parser.add_argument("--context-budget", type=int,
+                        help="Prompt token budget (default: from the model and --num-ctx; 0 sends the raw chunks)")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="Serve repeated and paraphrased questions from the answer cache")
+    parser.add_argument("--answer-cache-threshold", type=float, default=0.85)
+    parser.add_argument("--out", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    queries = load_query_log(args.queries)
+    chat = build_chat_pipeline(args)
+    report = run_load(chat, queries, args.qps, args.users, args.requests or len(queries))
+    report["llm"] = chat.metrics.percentiles()
+    if chat.scheduler is not None:
+        report["scheduler"] = chat.scheduler.stats()
+    report["backends"] = backend_stats()
+    if chat.answer_cache is not None:
+        report["answer_cache"] = chat.answer_cache.stats()
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Keeps the app's models warm across requests.
+
+Each model is registered with a loader and loaded lazily on first use. Loaded
+models stay resident until the registry goes over its memory budget, at which
+point the least recently used ones are dropped. Load time and hit/miss counts
+are tracked per model.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from loguru import logger
+
+
+def estimate_model_bytes(model) -> Optional[int]:
+    """Parameter memory of a torch-backed model, or None if it has none."""
+    # CrossEncoder wraps `.model`, pipelines expose `.model`,
+    # HuggingFaceEmbeddings wraps the SentenceTransformer in `.client`
+    for candidate in (model, getattr(model, "model", None), getattr(model, "client", None)):
+        parameters = getattr(candidate, "parameters", None)
+        if callable(parameters):
+            try:
+                return sum(p.numel() * p.element_size() for p in parameters())
+            except TypeError:
+                continue
+    return None
+
+
+class ModelRegistry:
+    """Lazily loaded, LRU-evicted model cache with a memory budget."""
+
+    def __init__(self, memory_budget_mb: Optional[float] = None):
+        # None or 0 means no budget
+        self.memory_budget_bytes = int(memory_budget_mb * 2**20) if memory_budget_mb else None
+        self._loaders = {}
+        self._models = OrderedDict()  # name -> (model, size in bytes), LRU first
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def register(self, name: str, loader: Callable[[], object], size_mb: Optional[float] = None):
+        """Registers a loader. `size_mb` overrides the parameter-based estimate."""
+        with self._lock:
+            self._loaders[name] = (loader, size_mb)
+            self._load_locks[name] = threading.Lock()
+            self._stats[name] = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0, "load_seconds": 0.0}
+
+    def get(self, name: str):
+        """Returns the model, loading it on a miss."""
+        with self._lock:
+            if name in self._models:
+                self._models.move_to_end(name)
+                self._stats[name]["hits"] += 1
+                return self._models[name][0]
+            if name not in self._loaders:
+                raise KeyError(f"No model registered as {name!r}")
+            self._stats[name]["misses"] += 1
+
+        # Load outside the registry lock so other models stay available,
+        # but only once per model when several sessions miss together
+        with self._load_locks[name]:
+            with self._lock:
+                if name in self._models:
+                    self._models.move_to_end(name)
+                    return self._models[name][0]
+            loader, size_mb = self._loaders[name]
+            start = time.perf_counter()
+            model = loader()
+            elapsed = time.perf_counter() - start
+            size = int(size_mb * 2**20) if size_mb is not None else (estimate_model_bytes(model) or 0)
+            logger.info(f"Loaded model {name} in {elapsed:.2f}s ({size / 2**20:.0f} MB)")
+            with self._lock:
+                self._models[name] = (model, size)
+                self._stats[name]["loads"] += 1
+                self._stats[name]["load_seconds"] += elapsed
+                self._evict_over_budget(keep=name)
+        return model
+
+    def _evict_over_budget(self, keep: str):
+        if self.memory_budget_bytes is None:
+            return
+        for name in list(self._models):
+            if self.resident_bytes() <= self.memory_budget_bytes:
+                break
+            if name == keep:
+                continue
+            del self._models[name]
+            self._stats[name]["evictions"] += 1
+            logger.info(f"Evicted model {name} to stay under the memory budget")
+
+    def evict(self, name: str):
+        with self._lock:
+            if self._models.pop(name, None) is not None:
+                self._stats[name]["evictions"] += 1
+
+    def resident_bytes(self) -> int:
+        return sum(size for _, size in self._models.values())
+
+    def stats(self) -> dict:
+        """Per-model counters plus whether the model is currently resident."""
+        with self._lock:
+            return {
+                name: dict(stats, resident=name in self._models)
+                for name, stats in self._stats.items()
+            }
+
+
+def build_default_registry(memory_budget_mb: Optional[float] = None) -> ModelRegistry:
+    """Registry with the embedder, reranker and toxicity classifier."""
+    if memory_budget_mb is None:
+        memory_budget_mb = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+    registry = ModelRegistry(memory_budget_mb)
+
+    def load_embedder():
+        from langchain.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+
+    def load_reranker():
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+    def load_toxicity():
+        from transformers import pipeline
+        return pipeline("text-classification", model="unitary/unbiased-toxic-roberta")
+
+    registry.register("embedder", load_embedder)
+    registry.register("reranker", load_reranker)
+    registry.register("toxicity", load_toxicity)
+    return registry
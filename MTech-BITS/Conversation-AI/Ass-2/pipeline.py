@@ -0,0 +1,177 @@
+"""Retrieval pipeline stages and their concurrent execution.
+
+The guardrail, BM25 search and dense search do not depend on each other. With
+an executor they overlap: the guardrail and BM25 run on pool threads while the
+calling thread embeds the query and searches the vector store. If the
+guardrail rejects the input, a cancel event stops the remaining stages before
+fusion and reranking. Without an executor the stages run in sequence.
+
+Only leaf stages are submitted to the pool, so a small shared pool cannot
+deadlock on nested work.
+"""
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from bm25_index import tokenize
+from fusion import fuse
+
+
+class RetrievalCancelled(Exception):
+    """Raised between stages once the guardrail has rejected the input."""
+
+
+class StageTimings:
+    """Start offset and wall time of each pipeline stage, thread-safe."""
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self._stages[name] = (start - self._origin, end - start)
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        """{stage: {"start_ms", "duration_ms"}} in start order."""
+        with self._lock:
+            items = sorted(self._stages.items(), key=lambda item: item[1][0])
+        return {
+            name: {"start_ms": start * 1000, "duration_ms": duration * 1000}
+            for name, (start, duration) in items
+        }
+
+    def total_ms(self) -> float:
+        with self._lock:
+            return max((start + duration for start, duration in self._stages.values()), default=0.0) * 1000
+
+
+@contextmanager
+def timed(timings: Optional[StageTimings], name: str):
+    """`timings.stage(name)`, or nothing when timings are not collected."""
+    if timings is None:
+        yield
+    else:
+        with timings.stage(name):
+            yield
+
+
+def check_cancelled(cancelled: Optional[threading.Event]):
+    if cancelled is not None and cancelled.is_set():
+        raise RetrievalCancelled()
+
+
+def bm25_candidates(service, query: str, depth: int) -> List[Tuple[int, float]]:
+    """Top `depth` (doc_id, score) pairs with a positive BM25 score."""
+    doc_ids, scores = service.bm25.top_k(tokenize(query), depth)
+    return [(int(i), float(score)) for i, score in zip(doc_ids, scores)]
+
+
+def dense_candidates(service, query: str, depth: int, want_vectors: bool = False,
+                     timings: StageTimings = None, cancelled: threading.Event = None):
+    """Embeds the query and searches the vector store.
+
+    Returns (query_embedding, [(doc_id, score)], {doc_id: vector}).
+    """
+    with timed(timings, "embed_query"):
+        query_embedding = service.embed_query(query)
+    check_cancelled(cancelled)
+    with timed(timings, "dense_search"):
+        results = service.vector_store.search(query_embedding, limit=depth, with_vectors=want_vectors)
+
+    candidates, doc_embeddings = [], {}
+    for res in results:
+        doc_id = service.doc_id_for_hit(res)
+        if doc_id is None:
+            logger.warning(f'Vector store hit {res.id} is not in the chunk corpus')
+            continue
+        candidates.append((doc_id, res.score))
+        if want_vectors:
+            doc_embeddings[doc_id] = res.vector
+    return query_embedding, candidates, doc_embeddings
+
+
+def hybrid_candidates(service, query: str, top_k: int = 2, alpha: float = 0.5,
+                      bm25_depth: int = 10, dense_depth: int = 10, fusion: str = "rrf",
+                      want_vectors: bool = False, executor=None,
+                      timings: StageTimings = None, cancelled: threading.Event = None):
+    """BM25 and dense search (overlapped with an executor), fused by chunk id.
+
+    Returns (ranked doc ids, query_embedding, {doc_id: vector}).
+    """
+    def run_bm25():
+        with timed(timings, "bm25"):
+            return bm25_candidates(service, query, bm25_depth)
+
+    bm25_future = executor.submit(run_bm25) if executor is not None else None
+    try:
+        if bm25_future is None:
+            bm25_list = run_bm25()
+            check_cancelled(cancelled)
+        query_embedding, dense_list, doc_embeddings = dense_candidates(
+            service, query, dense_depth, want_vectors, timings, cancelled)
+        if bm25_future is not None:
+            bm25_list = bm25_future.result()
+    except RetrievalCancelled:
+        if bm25_future is not None:
+            bm25_future.cancel()
+        raise
+    check_cancelled(cancelled)
+
+    with timed(timings, "fusion"):
+        fused = fuse([bm25_list, dense_list], method=fusion, weights=[alpha, 1 - alpha], limit=top_k)
+    return [doc_id for doc_id, _ in fused], query_embedding, doc_embeddings
+
+
+def rerank_candidates(service, query: str, doc_ids: List[int]) -> List[int]:
+    """Re-orders chunk ids by cross-encoder relevance to the query."""
+    reranker = service.models.get("reranker")
+    scores = reranker.predict([(query, doc) for doc in service.store.texts(doc_ids)])
+    return [doc_id for _, doc_id in sorted(zip(scores, doc_ids), reverse=True)]
+
+
+def run_guarded(query: str, guardrail: Callable[[str], Tuple[bool, Optional[str]]],
+                retrieve: Callable[[threading.Event], object], executor=None,
+                timings: StageTimings = None):
+    """Runs the guardrail alongside `retrieve(cancelled)`.
+
+    Returns (valid, message, retrieval result or None). When the guardrail
+    rejects the input, the cancel event is set so `retrieve` stops at its
+    next stage boundary.
+    """
+    def run_guardrail():
+        with timed(timings, "guardrail"):
+            return guardrail(query)
+
+    if executor is None:
+        valid, message = run_guardrail()
+        if not valid:
+            return valid, message, None
+        return True, None, retrieve(threading.Event())
+
+    cancelled = threading.Event()
+    guardrail_future = executor.submit(run_guardrail)
+
+    def on_guardrail_done(future):
+        if future.exception() is not None or not future.result()[0]:
+            cancelled.set()
+    guardrail_future.add_done_callback(on_guardrail_done)
+
+    try:
+        retrieval = retrieve(cancelled)
+    except RetrievalCancelled:
+        retrieval = None
+    valid, message = guardrail_future.result()
+    if not valid:
+        return valid, message, None
+    return True, None, retrieval
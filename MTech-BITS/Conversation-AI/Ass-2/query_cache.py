@@ -0,0 +1,118 @@
+"""Cache of retrieval results for repeated questions.
+
+Entries are keyed on the normalised query, the retrieval parameters and the
+index version, so rebuilding an index naturally invalidates old results. The
+memory tier is a size-bounded LRU with a TTL; an optional SQLite tier keeps
+entries across restarts. Values must be JSON-serialisable.
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of the query."""
+    return " ".join(query.lower().split())
+
+
+class QueryCache:
+    """LRU + TTL cache with an optional on-disk tier and hit-rate counters."""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600,
+                 disk_path: Optional[str] = None, max_disk_entries: int = 10000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()  # key -> (stored_at, value), LRU first
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "disk_hits": 0, "misses": 0}
+        self._db = None
+        if disk_path:
+            os.makedirs(os.path.dirname(disk_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache "
+                "(key TEXT PRIMARY KEY, stored_at REAL, value TEXT)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(query: str, **params) -> str:
+        """Stable key for a query and its retrieval parameters."""
+        raw = json.dumps({"query": normalize_query(query), **params}, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+
+    def get(self, key: str):
+        """Returns the cached value, or None on a miss or an expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._entries.move_to_end(key)
+                    self._counts["hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT stored_at, value FROM query_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[0]):
+                    value = json.loads(row[1])
+                    self._remember(key, row[0], value)
+                    self._counts["disk_hits"] += 1
+                    return value
+
+            self._counts["misses"] += 1
+            return None
+
+    def put(self, key: str, value):
+        with self._lock:
+            stored_at = time.time()
+            self._remember(key, stored_at, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_cache (key, stored_at, value) VALUES (?, ?, ?)",
+                    (key, stored_at, json.dumps(value)),
+                )
+                # Keep the disk tier bounded: drop expired and oldest rows
+                if self.ttl_seconds is not None:
+                    self._db.execute("DELETE FROM query_cache WHERE stored_at < ?",
+                                     (stored_at - self.ttl_seconds,))
+                self._db.execute(
+                    "DELETE FROM query_cache WHERE key NOT IN "
+                    "(SELECT key FROM query_cache ORDER BY stored_at DESC LIMIT ?)",
+                    (self.max_disk_entries,),
+                )
+                self._db.commit()
+
+    def _remember(self, key, stored_at, value):
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM query_cache")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = sum(self._counts.values())
+            hits = self._counts["hits"] + self._counts["disk_hits"]
+            return dict(
+                self._counts,
+                size=len(self._entries),
+                hit_rate=hits / lookups if lookups else 0.0,
+            )
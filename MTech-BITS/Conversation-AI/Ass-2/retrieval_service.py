@@ -0,0 +1,175 @@
+"""Process-wide retrieval state shared by every Streamlit session.
+
+The chunk corpus, the BM25 index and the embedding model are loaded once per
+process and never mutated afterwards, so sessions can read them concurrently
+without copying. Only chat history lives in `st.session_state`.
+
+The one exception is segment merging: when the indexes have accumulated too
+many segments, a background thread compacts them and swaps in the merged
+index, which holds the same documents in the same order.
+"""
+import os
+import resource
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import nltk
+from loguru import logger
+
+from segments import SegmentedBM25, load_or_update_index, merge_segments
+from chunk_corpus import read_corpus
+from chunk_embeddings import load_embeddings
+from chunk_store import ChunkStore
+from model_registry import ModelRegistry
+from vector_store import VectorStore
+
+
+def resident_memory_bytes() -> int:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Peak RSS, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+class RetrievalService:
+    """Read-only corpus, BM25 index and vector store, plus the model registry.
+
+    Create it once per process (see `get_retrieval_service` in app.py). All
+    attributes are fixed after `__init__`, except that `bm25` and the local
+    vector store's segments may be replaced by an equivalent merged index;
+    models are loaded lazily by the registry the first time a session needs
+    them.
+    """
+
+    def __init__(self, data_dir: str, index_dir: str, models: ModelRegistry,
+                 vector_store: VectorStore, embeddings_dir: Optional[str] = None,
+                 max_segments: int = 4):
+        nltk.download("punkt_tab", quiet=True)
+        # A packed corpus file or a directory of chunk files
+        names, texts, digests = read_corpus(data_dir)
+        # Chunks are kept in index order: older segments first
+        self.bm25, files, chunks, _ = load_or_update_index(index_dir, names, texts, digests)
+        # Chunk ids are shared by the BM25 index, the embedding matrix and the cache
+        self.store = ChunkStore(files, chunks, content_hash=self.bm25.content_hash)
+        # Changes whenever the corpus or the vector backend changes
+        self.index_version = f"{self.bm25.content_hash[:16]}-{type(vector_store).__name__}"
+        self.models = models
+        self.vector_store = vector_store
+        # Row i is the normalised embedding of chunk id i (None if not built)
+        self.chunk_embeddings = (
+            load_embeddings(embeddings_dir, self.bm25.content_hash) if embeddings_dir else None
+        )
+        logger.info(f"Retrieval service ready with {len(self.store)} chunks")
+        self._merge_in_background(index_dir, max_segments)
+
+    def _merge_in_background(self, index_dir: str, max_segments: int):
+        """Compacts the BM25 and local vector segments once there are too many."""
+        vector_segments = getattr(self.vector_store, "segments", ())
+        if len(self.bm25.segments) <= max_segments and len(vector_segments) <= max_segments:
+            return
+
+        def merge():
+            try:
+                if len(self.bm25.segments) > max_segments:
+                    merged = merge_segments(index_dir)
+                    # Skip the swap if another process appended in the meantime
+                    if merged is not None and merged.corpus_size == self.bm25.corpus_size:
+                        self.bm25 = SegmentedBM25([merged], content_hash=self.bm25.content_hash)
+                if len(vector_segments) > max_segments:
+                    self.vector_store.compact()
+            except Exception:
+                logger.exception("Background segment merge failed")
+
+        threading.Thread(target=merge, name="segment-merge", daemon=True).start()
+
+    @property
+    def embedding_model(self):
+        return self.models.get("embedder")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embedding_model.embed_query(text)
+
+    def doc_id_for_hit(self, hit) -> Optional[int]:
+        """Chunk id of a vector store hit (None if it is not in the corpus)."""
+        return self.store.id_for_payload(hit.payload)
+
+    def bm25_confidences(self, query: str, doc_ids: List[int]) -> np.ndarray:
+        """Min-max normalised BM25 scores of `doc_ids`, from one pass over the corpus."""
+        scores = self.bm25.get_scores(query.split())
+        min_bm25, max_bm25 = scores.min(), scores.max()
+        if max_bm25 <= min_bm25:
+            return np.zeros(len(doc_ids))
+        doc_scores = scores[list(doc_ids)]
+        return (doc_scores - min_bm25) / (max_bm25 - min_bm25)
+
+    def dense_confidences(self, query: str, doc_ids: List[int],
+                          query_embedding: Optional[List[float]] = None,
+                          doc_embeddings: Optional[Dict[int, List[float]]] = None) -> np.ndarray:
+        """Cosine similarity of the query with each doc.
+
+        Doc vectors come from the precomputed chunk matrix when it is loaded;
+        otherwise embeddings from retrieval ({doc_id: vector}) are reused and
+        anything missing is encoded in a single batch.
+        """
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+
+        if self.chunk_embeddings is not None:
+            doc_matrix = self.chunk_embeddings[list(doc_ids)]
+        else:
+            doc_embeddings = dict(doc_embeddings or {})
+            missing = [doc_id for doc_id in doc_ids if doc_id not in doc_embeddings]
+            if missing:
+                vectors = self.embedding_model.embed_documents(self.store.texts(missing))
+                doc_embeddings.update(zip(missing, vectors))
+            doc_matrix = np.asarray([doc_embeddings[doc_id] for doc_id in doc_ids],
+                                    dtype=np.float32).reshape(len(doc_ids), -1)
+        norms = np.linalg.norm(doc_matrix, axis=1) * np.linalg.norm(query_vector)
+        return doc_matrix @ query_vector / np.where(norms > 0, norms, 1)
+
+    def hybrid_confidences(self, query: str, doc_ids: List[int], alpha: float = 0.5,
+                           query_embedding: Optional[List[float]] = None,
+                           doc_embeddings: Optional[Dict[int, List[float]]] = None) -> np.ndarray:
+        """Combines BM25 and cosine similarity scores for all docs at once."""
+        bm25_norm = self.bm25_confidences(query, doc_ids)
+        dense = self.dense_confidences(query, doc_ids, query_embedding, doc_embeddings)
+        return alpha * bm25_norm + (1 - alpha) * dense
+
+    def memory_report(self) -> dict:
+        """Process RSS plus the size of the in-memory corpus, index and models."""
+        return {
+            "process_rss_mb": resident_memory_bytes() / 2**20,
+            "chunks_mb": self.store.nbytes() / 2**20,
+            "bm25_mb": self.bm25.nbytes() / 2**20,
+            "models_mb": self.models.resident_bytes() / 2**20,
+        }
+
+
+def build_service(data_dir: str, index_dir: str, backend: str = "models",
+                  embeddings_dir: Optional[str] = None) -> RetrievalService:
+    """A retrieval service outside the app, for benchmarks and load tests.
+
+    `backend="models"` uses the real models and `VECTOR_STORE`, like the app.
+    `backend="stub"` uses stub_models.py and an in-memory local vector store
+    built over the corpus, so nothing is downloaded or fetched remotely.
+    """
+    if backend == "stub":
+        from stub_models import build_stub_registry
+        from vector_store import LocalVectorStore, chunk_payloads
+        models = build_stub_registry()
+        _, files, chunks, _ = load_or_update_index(index_dir, *read_corpus(data_dir))
+        vectors = np.asarray(models.get("embedder").embed_documents(list(chunks)), dtype=np.float32)
+        vector_store = LocalVectorStore.from_vectors(vectors, chunk_payloads(files, chunks))
+        return RetrievalService(data_dir, index_dir, models, vector_store)
+
+    from model_registry import build_default_registry
+    from vector_store import get_vector_store
+    return RetrievalService(data_dir, index_dir, build_default_registry(), get_vector_store(),
+                            embeddings_dir=embeddings_dir)
@@ -0,0 +1,273 @@
+"""Segmented BM25 index with incremental appends and background merges.
+
+The on-disk index is a list of `BM25Index` segments plus a manifest recording
+which chunk files (and content digests) each segment holds:
+
+    index/bm25/manifest.json
+    index/bm25/seg-000001/...   one BM25Index per segment
+
+New chunk files are indexed into a new, small segment, so adding a filing
+only tokenizes that filing. `SegmentedBM25` searches all segments with global
+statistics (document count, document frequencies, average length), which
+gives exactly the scores of one index built over the whole corpus. Merging
+concatenates the segments' postings into a single segment without
+re-tokenizing anything.
+
+Changed or deleted chunk files cannot be patched into a segment; they trigger
+a full rebuild.
+"""
+import os
+import json
+import math
+import fcntl
+import shutil
+import hashlib
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+import nltk
+import numpy as np
+from loguru import logger
+from tqdm import tqdm
+
+from bm25_index import INDEX_FORMAT_VERSION, BM25Index, tokenize
+
+MANIFEST_FILE = "manifest.json"
+
+
+def chunk_digest(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+class SegmentedBM25:
+    """BM25Okapi over several segments, scored with corpus-wide statistics.
+
+    Doc ids are global: segment `i` holds ids `offsets[i]` onwards, in
+    manifest order. The interface matches `BM25Index` where the app uses it.
+    """
+
+    def __init__(self, segments: List[BM25Index], content_hash: str = None,
+                 k1=1.5, b=0.75, epsilon=0.25):
+        self.segments = segments
+        self.content_hash = content_hash
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.offsets = np.cumsum([0] + [seg.corpus_size for seg in segments])[:-1]
+        self.corpus_size = sum(seg.corpus_size for seg in segments)
+        self.avgdl = sum(int(np.sum(seg.doc_len)) for seg in segments) / self.corpus_size
+
+        # Global document frequencies and IDF (with BM25Okapi's epsilon floor)
+        self.df = Counter()
+        for seg in segments:
+            self.df.update(dict(zip(seg.vocab, np.diff(seg.indptr).tolist())))
+        self.vocab = list(self.df)
+        self.idf = {}
+        for term, freq in self.df.items():
+            self.idf[term] = math.log(self.corpus_size - freq + 0.5) - math.log(freq + 0.5)
+        average_idf = sum(self.idf.values()) / len(self.idf) if self.idf else 0.0
+        for term, value in self.idf.items():
+            if value < 0:
+                self.idf[term] = epsilon * average_idf
+        self._norms = [
+            self.k1 * (1 - self.b + self.b * np.asarray(seg.doc_len, dtype=np.float64) / self.avgdl)
+            for seg in segments
+        ]
+
+    def get_scores(self, query_tokens: List[str]) -> np.ndarray:
+        """BM25 score of every document, same as one index over all segments."""
+        if len(self.segments) == 1:
+            return self.segments[0].get_scores(query_tokens)
+        scores = np.zeros(self.corpus_size)
+        for token in query_tokens:
+            idf = self.idf.get(token)
+            if idf is None:
+                continue
+            for seg, offset, norm in zip(self.segments, self.offsets, self._norms):
+                term_id = seg.term_ids.get(token)
+                if term_id is None:
+                    continue
+                start, end = seg.indptr[term_id], seg.indptr[term_id + 1]
+                docs = seg.doc_ids[start:end]
+                tf = seg.tfs[start:end].astype(np.float64)
+                scores[docs + offset] += idf * (tf * (self.k1 + 1) / (tf + norm[docs]))
+        return scores
+
+    def top_k(self, query_tokens: List[str], k: int, prune: Optional[bool] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Same contract as `BM25Index.top_k`; prunes once merged into one segment."""
+        if len(self.segments) == 1:
+            return self.segments[0].top_k(query_tokens, k, prune=prune)
+        scores = self.get_scores(query_tokens)
+        candidates = np.flatnonzero(scores > 0)
+        order = np.lexsort((candidates, -scores[candidates]))[:k]
+        return candidates[order], scores[candidates[order]]
+
+    def nbytes(self) -> int:
+        return sum(seg.nbytes() for seg in self.segments)
+
+    def merged(self) -> BM25Index:
+        """One BM25Index with the concatenated postings of every segment."""
+        if len(self.segments) == 1:
+            return self.segments[0]
+        doc_parts, tf_parts = [], []
+        for term in self.vocab:
+            for seg, offset in zip(self.segments, self.offsets):
+                term_id = seg.term_ids.get(term)
+                if term_id is None:
+                    continue
+                start, end = seg.indptr[term_id], seg.indptr[term_id + 1]
+                doc_parts.append(np.asarray(seg.doc_ids[start:end]) + offset)
+                tf_parts.append(seg.tfs[start:end])
+        indptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([self.df[term] for term in self.vocab])
+        return BM25Index(
+            self.vocab,
+            np.array([self.idf[term] for term in self.vocab], dtype=np.float64),
+            np.concatenate([np.asarray(seg.doc_len) for seg in self.segments]).astype(np.int32),
+            indptr,
+            np.concatenate(doc_parts).astype(np.int32),
+            np.concatenate(tf_parts).astype(np.int32),
+            k1=self.k1, b=self.b, epsilon=self.epsilon, content_hash=self.content_hash,
+        )
+
+
+@contextmanager
+def index_lock(index_dir: str):
+    """Serialises appends and merges across processes."""
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_manifest(index_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(index_dir, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("format_version") != INDEX_FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(index_dir: str, manifest: dict):
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _new_manifest(next_segment: int = 1) -> dict:
+    return {"format_version": INDEX_FORMAT_VERSION, "next_segment": next_segment, "segments": []}
+
+
+def _add_segment(index_dir: str, manifest: dict, names: List[str], chunks: List[str], digests: List[str]):
+    """Tokenizes `chunks` into a new segment and records it in the manifest."""
+    nltk.download("punkt_tab", quiet=True)
+    segment_name = f"seg-{manifest['next_segment']:06d}"
+    tokenized = [tokenize(chunk) for chunk in tqdm(chunks, desc=f"Indexing {segment_name}")]
+    BM25Index.build(tokenized, content_hash=hash_digests(names, digests)).save(os.path.join(index_dir, segment_name))
+    manifest["next_segment"] += 1
+    manifest["segments"].append({
+        "name": segment_name,
+        "files": [{"name": name, "sha256": digest} for name, digest in zip(names, digests)],
+    })
+
+
+def _remove_unlisted_segments(index_dir: str, manifest: dict):
+    listed = {segment["name"] for segment in manifest["segments"]}
+    for entry in os.listdir(index_dir):
+        if entry.startswith("seg-") and entry not in listed:
+            shutil.rmtree(os.path.join(index_dir, entry), ignore_errors=True)
+
+
+def hash_digests(names: List[str], digests: List[str]) -> str:
+    """Content hash of the corpus from chunk names and digests, in order."""
+    digest = hashlib.sha256()
+    for name, chunk_sha in zip(names, digests):
+        digest.update(f"{os.path.basename(name)}\0{chunk_sha}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _take(chunks, positions):
+    """`chunks` at `positions`; lazy sequences (packed corpora) stay lazy."""
+    take = getattr(chunks, "take", None)
+    return take(positions) if take is not None else [chunks[p] for p in positions]
+
+
+def load_or_update_index(index_dir: str, files: List[str], chunks, digests: List[str] = None):
+    """Loads the segmented index, indexing only chunk files it has not seen.
+
+    `chunks` may be any sequence of texts; only new chunks are read. Pass
+    `digests` (sha256 of each chunk) when they are already known, as in a
+    packed corpus, to skip hashing every text.
+
+    Returns (SegmentedBM25, files, chunks, added) with files and chunks in
+    index order (earlier segments first) and `added` the index positions
+    that were indexed by this call.
+    """
+    if digests is None:
+        digests = [chunk_digest(chunk) for chunk in chunks]
+    positions = {os.path.basename(file): i for i, file in enumerate(files)}
+    digest_of = {name: digests[i] for name, i in positions.items()}
+
+    with index_lock(index_dir):
+        manifest = read_manifest(index_dir)
+        # Segment names are never reused, so a running app's mapped files stay intact
+        next_segment = manifest["next_segment"] if manifest is not None else 1
+        if manifest is not None:
+            indexed = [entry for segment in manifest["segments"] for entry in segment["files"]]
+            stale = [entry["name"] for entry in indexed if digest_of.get(entry["name"]) != entry["sha256"]]
+            if stale:
+                logger.info(f"{len(stale)} indexed chunk files changed or disappeared, rebuilding BM25 index")
+                manifest = None
+        if manifest is None:
+            manifest = _new_manifest(next_segment)
+
+        indexed_names = {entry["name"] for segment in manifest["segments"] for entry in segment["files"]}
+        new_names = [name for name in positions if name not in indexed_names]
+        added_from = len(indexed_names)
+        if new_names:
+            logger.info(f"Indexing {len(new_names)} new chunk files into a new BM25 segment")
+            _add_segment(index_dir, manifest, new_names,
+                         [chunks[positions[name]] for name in new_names], [digest_of[name] for name in new_names])
+            write_manifest(index_dir, manifest)
+            _remove_unlisted_segments(index_dir, manifest)
+
+    segments = [BM25Index.load(os.path.join(index_dir, segment["name"])) for segment in manifest["segments"]]
+    order = [positions[entry["name"]] for segment in manifest["segments"] for entry in segment["files"]]
+    ordered_files = [files[i] for i in order]
+    index = SegmentedBM25(segments, content_hash=hash_digests(ordered_files, [digests[i] for i in order]))
+    logger.info(f"BM25 index: {index.corpus_size} docs in {len(segments)} segment(s)")
+    return index, ordered_files, _take(chunks, order), list(range(added_from, len(order)))
+
+
+def merge_segments(index_dir: str) -> Optional[BM25Index]:
+    """Compacts all segments into one. Returns the merged index, or None if
+    there was nothing to merge."""
+    with index_lock(index_dir):
+        manifest = read_manifest(index_dir)
+        if manifest is None or len(manifest["segments"]) < 2:
+            return None
+        segments = [BM25Index.load(os.path.join(index_dir, segment["name"])) for segment in manifest["segments"]]
+        searcher = SegmentedBM25(segments)
+        merged = searcher.merged()
+        segment_name = f"seg-{manifest['next_segment']:06d}"
+        merged.save(os.path.join(index_dir, segment_name))
+        merged_manifest = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "next_segment": manifest["next_segment"] + 1,
+            "segments": [{
+                "name": segment_name,
+                "files": [entry for segment in manifest["segments"] for entry in segment["files"]],
+            }],
+        }
+        write_manifest(index_dir, merged_manifest)
+        _remove_unlisted_segments(index_dir, merged_manifest)
+    logger.info(f"Merged {len(segments)} BM25 segments into {segment_name}")
+    return BM25Index.load(os.path.join(index_dir, segment_name))
@@ -0,0 +1,76 @@
+"""Deterministic stand-ins for the embedder, reranker and toxicity model.
+
+They need no model download or network access, so benchmarks and load tests
+can run the real retrieval pipeline anywhere. The embedder hashes words into
+a fixed number of dimensions, the reranker scores word overlap and the
+toxicity model accepts everything. Their relevance is far below MiniLM's, so
+use them to compare latency and code paths, not answer quality.
+"""
+import re
+import zlib
+from collections import Counter
+from typing import List
+
+import numpy as np
+
+from model_registry import ModelRegistry
+
+_WORD = re.compile(r"\w+")
+
+
+def words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+class HashingEmbedder:
+    """Signed feature hashing of word counts, L2-normalised.
+
+    Exposes `embed_query`/`embed_documents` like `HuggingFaceEmbeddings`.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word, count in Counter(words(text)).items():
+            h = zlib.crc32(word.encode("utf-8"))
+            vector[h % self.dim] += (1.0 if h & (1 << 31) else -1.0) * (1.0 + np.log(count))
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+
+class OverlapReranker:
+    """Scores (query, doc) pairs by the fraction of query words in the doc,
+    with `predict` like `CrossEncoder`."""
+
+    def predict(self, pairs) -> np.ndarray:
+        scores = []
+        for query, doc in pairs:
+            query_words = set(words(query))
+            scores.append(len(query_words & set(words(doc))) / len(query_words) if query_words else 0.0)
+        return np.asarray(scores, dtype=np.float32)
+
+
+class StubToxicityClassifier:
+    """Scores every text as non-toxic, in the shape of a transformers
+    text-classification pipeline."""
+
+    def __call__(self, texts):
+        texts = [texts] if isinstance(texts, str) else texts
+        return [{"label": "toxicity", "score": 0.0} for _ in texts]
+
+
+def build_stub_registry() -> ModelRegistry:
+    """Registry with the stub models under the default names."""
+    registry = ModelRegistry()
+    registry.register("embedder", HashingEmbedder, size_mb=0)
+    registry.register("reranker", OverlapReranker, size_mb=0)
+    registry.register("toxicity", StubToxicityClassifier, size_mb=0)
+    return registry
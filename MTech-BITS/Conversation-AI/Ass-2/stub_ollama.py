@@ -0,0 +1,188 @@
+"""Local stand-in for an Ollama server, for load tests.
+
+Speaks enough of the Ollama HTTP API for `ChatOllama`: `/api/chat` and
+`/api/generate` stream newline-delimited JSON chunks (or return one object
+with `"stream": false`), and `/api/tags`, `/api/show` and `/api/version`
+answer with a single fake model. Every answer is `--tokens` words long; the
+first arrives after `--ttft-ms` and the rest every `--token-delay-ms`.
+`--parallel` caps concurrent generations like OLLAMA_NUM_PARALLEL, so extra
+requests queue as they would on a real server.
+
+    python stub_ollama.py --port 11435 --token-delay-ms 20
+    OLLAMA_URL=http://localhost:11435 python load_test.py ...
+"""
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+ANSWER_WORDS = (
+    "Based on the filings, total net sales were reported for the fiscal year, with iPhone, Mac, iPad, "
+    "Services and Wearables contributing, and gross margin reflecting the product and services mix."
+).split()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StubOllamaServer"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, body: dict, status: int = 200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": self.server.model, "model": self.server.model,
+                                         "modified_at": _now(), "size": 0, "digest": "stub", "details": {}}]})
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-stub"})
+        elif self.path == "/":
+            data = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if self.path not in ("/api/chat", "/api/generate", "/api/show"):
+            self._send_json({"error": "not found"}, 404)
+            return
+        request = self._read_json()
+        if self.path == "/api/show":
+            self._send_json({"modelfile": "", "parameters": "", "template": "", "details": {}, "model_info": {}})
+            return
+        chat = self.path == "/api/chat"
+        model = request.get("model") or self.server.model
+        if chat:
+            prompt = "".join(str(message.get("content", "")) for message in request.get("messages", []))
+        else:
+            prompt = request.get("prompt", "")
+
+        with self.server.slots:
+            started = time.perf_counter_ns()
+            if request.get("stream", True):
+                self._stream(chat, model, prompt, started)
+            else:
+                tokens = list(self.server.tokens())
+                self._send_json(self._final(chat, model, prompt, started, "".join(tokens), len(tokens)))
+
+    def _chunk(self, chat: bool, model: str, text: str) -> dict:
+        if chat:
+            return {"model": model, "created_at": _now(), "message": {"role": "assistant", "content": text},
+                    "done": False}
+        return {"model": model, "created_at": _now(), "response": text, "done": False}
+
+    def _final(self, chat: bool, model: str, prompt: str, started: int, text: str, count: int) -> dict:
+        final = self._chunk(chat, model, text)
+        elapsed = time.perf_counter_ns() - started
+        final.update({
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": elapsed,
+            "load_duration": 0,
+            "prompt_eval_count": len(prompt.split()),
+            "prompt_eval_duration": int(self.server.ttft * 1e9),
+            "eval_count": count,
+            "eval_duration": max(elapsed - int(self.server.ttft * 1e9), 0),
+        })
+        return final
+
+    def _write_chunk(self, body: dict):
+        data = json.dumps(body).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, chat: bool, model: str, prompt: str, started: int):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        count = 0
+        try:
+            for token in self.server.tokens():
+                self._write_chunk(self._chunk(chat, model, token))
+                count += 1
+            self._write_chunk(self._final(chat, model, prompt, started, "", count))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug("Client went away mid-stream")
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, model: str = "phi4:latest", tokens: int = 64, ttft_ms: float = 200,
+                 token_delay_ms: float = 20, parallel: int = 4):
+        super().__init__(address, StubOllamaHandler)
+        self.model = model
+        self.num_tokens = tokens
+        self.ttft = ttft_ms / 1000
+        self.token_delay = token_delay_ms / 1000
+        self.slots = threading.BoundedSemaphore(parallel)
+
+    def tokens(self):
+        """Yields the answer word by word, sleeping like a decoding model."""
+        time.sleep(self.ttft)
+        for i in range(self.num_tokens):
+            if i:
+                time.sleep(self.token_delay)
+            word = ANSWER_WORDS[i % len(ANSWER_WORDS)]
+            yield word if i == 0 else f" {word}"
+
+
+def serve_in_background(host: str = "127.0.0.1", port: int = 0, **kwargs) -> StubOllamaServer:
+    """Starts a server on a daemon thread; its URL is `http://host:server.server_port`."""
+    server = StubOllamaServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, name="stub-ollama", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--model", default="phi4:latest")
+    parser.add_argument("--tokens", type=int, default=64, help="Words per answer")
+    parser.add_argument("--ttft-ms", type=float, default=200, help="Delay before the first token")
+    parser.add_argument("--token-delay-ms", type=float, default=20, help="Delay between tokens")
+    parser.add_argument("--parallel", type=int, default=4, help="Concurrent generations")
+    args = parser.parse_args()
+
+    server = StubOllamaServer((args.host, args.port), model=args.model, tokens=args.tokens,
+                              ttft_ms=args.ttft_ms, token_delay_ms=args.token_delay_ms, parallel=args.parallel)
+    logger.info(f"Stub Ollama listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
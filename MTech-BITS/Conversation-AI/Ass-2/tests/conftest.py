@@ -0,0 +1,71 @@
+"""Shared corpora for the BM25 tests, checked against rank_bm25.BM25Okapi."""
+import glob
+import os
+
+import numpy as np
+import pytest
+
+CHUNK_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "financial-docs-md", "chunks-500")
+
+SMALL_CORPUS = [
+    "apple reported net sales for the fiscal year",
+    "iphone net sales increased during the year",
+    "services revenue grew and gross margin improved",
+    "the company repurchased shares and paid dividends",
+    "mac and ipad net sales decreased",
+    "research and development expense increased",
+    "net sales net sales net sales",
+    "dividends were paid to shareholders",
+]
+QUERIES = [
+    "net sales",
+    "iphone revenue",
+    "research and development",
+    "dividends shareholders paid",
+    "gross margin services",
+    "unknownterm",
+]
+
+
+def _expected_top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    candidates = np.flatnonzero(scores > 0)
+    return candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+
+
+@pytest.fixture
+def expected_top_k():
+    """Positive scores, best first, ties by ascending doc id."""
+    return _expected_top_k
+
+
+@pytest.fixture
+def queries():
+    return [query.split() for query in QUERIES]
+
+
+@pytest.fixture
+def small_texts():
+    return list(SMALL_CORPUS)
+
+
+@pytest.fixture
+def small_corpus(small_texts):
+    return [text.split() for text in small_texts]
+
+
+def _tokenized_chunks():
+    files = sorted(glob.glob(os.path.join(CHUNK_DIR, "*.md")))
+    if not files:
+        pytest.skip("chunk corpus not available")
+    corpus = []
+    for file in files:
+        with open(file, encoding="utf-8") as f:
+            corpus.append(f.read().lower().split())
+    return corpus
+
+
+@pytest.fixture(params=["small", "chunks"])
+def corpus(request):
+    if request.param == "small":
+        return [text.split() for text in SMALL_CORPUS]
+    return _tokenized_chunks()
@@ -0,0 +1,79 @@
+import numpy as np
+
+import answer_cache
+from answer_cache import CachedChunk, RecordingStream, SemanticAnswerCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_paraphrase_with_the_same_chunks_is_a_hit():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.put(unit(1, 0, 0), [3, 1], "answer", version="v1")
+    assert cache.get(unit(1, 0.1, 0), [1, 3], version="v1") == "answer"
+    assert cache.get(unit(0, 1, 0), [1, 3], version="v1") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_similar_query_over_other_chunks_is_a_near_miss():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.put(unit(1, 0, 0), [1, 2], "answer", version="v1")
+    assert cache.get(unit(1, 0, 0), [1, 4], version="v1") is None
+    assert cache.stats()["near_misses"] == 1
+
+
+def test_new_version_drops_every_entry():
+    cache = SemanticAnswerCache()
+    cache.put(unit(1, 0), [1], "answer", version="v1")
+    assert cache.get(unit(1, 0), [1], version="v2") is None
+    assert cache.stats()["invalidations"] == 1 and cache.stats()["size"] == 0
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(answer_cache.time, "time", clock)
+    cache = SemanticAnswerCache(max_entries=2, ttl_seconds=60)
+    cache.put(unit(1, 0, 0), [1], "a", version="v")
+    cache.put(unit(0, 1, 0), [2], "b", version="v")
+    assert cache.get(unit(1, 0, 0), [1], version="v") == "a"
+    cache.put(unit(0, 0, 1), [3], "c", version="v")
+    assert cache.get(unit(0, 1, 0), [2], version="v") is None
+    clock.now += 61
+    assert cache.get(unit(1, 0, 0), [1], version="v") is None
+    assert cache.stats()["size"] == 1
+
+
+def test_long_answers_are_not_stored():
+    cache = SemanticAnswerCache(max_answer_chars=5)
+    cache.put(unit(1, 0), [1], "too long", version="v")
+    assert cache.stats()["stored"] == 0
+
+
+def test_recording_stream_stores_only_complete_answers():
+    stored = []
+    chunks = [CachedChunk("Net "), CachedChunk("sales")]
+    assert [chunk.content for chunk in RecordingStream(iter(chunks), stored.append)] == ["Net ", "sales"]
+    assert stored == ["Net sales"]
+
+    closed = []
+
+    def backend():
+        try:
+            yield from chunks
+        finally:
+            closed.append(True)
+
+    partial = RecordingStream(backend(), stored.append)
+    next(partial)
+    partial.close()
+    assert closed == [True] and stored == ["Net sales"]
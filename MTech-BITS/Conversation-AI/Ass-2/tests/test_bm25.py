@@ -0,0 +1,32 @@
+"""BM25Index against rank_bm25.BM25Okapi."""
+import numpy as np
+import pytest
+from rank_bm25 import BM25Okapi
+
+from bm25_index import BM25Index
+
+
+def test_index_scores_match_bm25okapi(corpus, queries):
+    index = BM25Index.build(corpus)
+    reference = BM25Okapi(corpus)
+    for tokens in queries:
+        np.testing.assert_allclose(index.get_scores(tokens), reference.get_scores(tokens), rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize("prune", [False, True])
+def test_top_k_matches_sorted_scores(corpus, queries, expected_top_k, prune):
+    index = BM25Index.build(corpus)
+    reference = BM25Okapi(corpus)
+    for tokens in queries:
+        expected = expected_top_k(reference.get_scores(tokens), 5)
+        doc_ids, scores = index.top_k(tokens, 5, prune=prune)
+        np.testing.assert_array_equal(doc_ids, expected)
+        np.testing.assert_allclose(scores, reference.get_scores(tokens)[expected], rtol=1e-9)
+
+
+def test_index_round_trips_through_disk(tmp_path, small_corpus):
+    index = BM25Index.build(small_corpus, content_hash="abc")
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path))
+    assert loaded.content_hash == "abc"
+    np.testing.assert_allclose(loaded.get_scores(["net", "sales"]), index.get_scores(["net", "sales"]))
@@ -0,0 +1,50 @@
+import pytest
+
+from chunk_corpus import (ChunkRecord, PackedCorpus, find_spans, parse_chunk_name, read_corpus,
+                          write_corpus)
+from chunk_store import ChunkStore
+from segments import chunk_digest
+
+RECORDS = [
+    ChunkRecord("10k_chunk_0.md", "Net sales rose.", "10k", 0, (0, 15)),
+    ChunkRecord("10k_chunk_1.md", "Gross margin — 46 %", "10k", 1, None),
+    ChunkRecord("10q_chunk_0.md", "", "10q", 0, None, [{"name": "10q_chunk_0.md"}, {"name": "10q_chunk_9.md"}]),
+]
+
+
+def test_packed_corpus_round_trips(tmp_path):
+    path = str(tmp_path / "chunks.chunks")
+    write_corpus(path, RECORDS)
+    names, texts, digests = read_corpus(path)
+    assert names == [record.name for record in RECORDS]
+    assert list(texts) == [record.text for record in RECORDS]
+    assert digests == [chunk_digest(record.text) for record in RECORDS]
+    corpus = texts.corpus
+    assert corpus.metadata[0]["char_span"] == [0, 15]
+    assert "sources" in corpus.metadata[2] and "sources" not in corpus.metadata[0]
+
+
+def test_packed_texts_stay_lazy_through_the_chunk_store(tmp_path):
+    path = str(tmp_path / "chunks.chunks")
+    write_corpus(path, RECORDS)
+    names, texts, _ = read_corpus(path)
+    view = texts.take([2, 0])
+    assert list(view) == ["", "Net sales rose."]
+    assert list(texts[1:]) == [RECORDS[1].text, RECORDS[2].text]
+    store = ChunkStore(names, texts)
+    assert store.text(1) == RECORDS[1].text
+    assert store.metadata(0)["source"] == "10k"
+
+
+def test_other_files_are_refused(tmp_path):
+    path = tmp_path / "not-a-corpus"
+    path.write_bytes(b"x" * 64)
+    with pytest.raises(ValueError):
+        PackedCorpus(str(path))
+
+
+def test_chunk_names_and_spans():
+    assert parse_chunk_name("dir/aapl-2023_chunk_12.md") == ("aapl-2023", 12)
+    assert parse_chunk_name("notes.md") == (None, None)
+    source = "abcdefabc"
+    assert find_spans(source, ["abc", "def", "abc", "zzz"]) == [(0, 3), (3, 6), (6, 9), None]
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+
+from chunk_embeddings import load_embeddings, reuse_or_encode, row_keys, save_embeddings
+
+FILES = ["a_chunk_1.md", "a_chunk_2.md", "b_chunk_1.md"]
+CHUNKS = ["net sales rose", "gross margin fell", "dividends were paid"]
+
+
+def matrix(rows, dim=4):
+    return np.random.RandomState(rows).randn(rows, dim).astype(np.float32)
+
+
+def test_saved_matrix_loads_normalised_without_leftovers(tmp_path):
+    save_embeddings(str(tmp_path), matrix(3), "hash", files=row_keys(FILES, CHUNKS))
+    loaded = load_embeddings(str(tmp_path), "hash")
+    np.testing.assert_allclose(np.linalg.norm(loaded, axis=1), 1.0, rtol=1e-6)
+    assert sorted(os.listdir(tmp_path)) == ["embeddings.npy", "meta.json"]
+    assert load_embeddings(str(tmp_path), "other hash") is None
+
+
+def test_matrix_without_its_meta_is_not_used(tmp_path):
+    save_embeddings(str(tmp_path), matrix(3), "hash", files=row_keys(FILES, CHUNKS))
+    # A save that replaced the matrix but not yet meta.json
+    np.save(os.path.join(tmp_path, "embeddings.npy"), matrix(5))
+    assert load_embeddings(str(tmp_path), "hash") is None
+    assert reuse_or_encode(str(tmp_path), [], []).shape == (0, 4)
+
+
+def test_unchanged_rows_are_reused(tmp_path):
+    saved = matrix(3)
+    save_embeddings(str(tmp_path), saved, "hash", files=row_keys(FILES, CHUNKS))
+    reordered = reuse_or_encode(str(tmp_path), FILES[::-1], CHUNKS[::-1])
+    np.testing.assert_allclose(reordered, load_embeddings(str(tmp_path), "hash")[::-1])
@@ -0,0 +1,34 @@
+import pytest
+
+from chunk_store import ChunkStore
+
+FILES = ["/data/10k_chunk_0.md", "/data/10k_chunk_1.md", "/data/10q_chunk_0.md"]
+TEXTS = ["net sales rose", "gross margin fell", "net sales rose"]
+
+
+@pytest.fixture
+def store():
+    return ChunkStore(FILES, TEXTS, content_hash="abc")
+
+
+def test_ids_address_texts_and_filenames(store):
+    assert len(store) == 3
+    assert store.text(1) == "gross margin fell"
+    assert store.texts([2, 0]) == ["net sales rose", "net sales rose"]
+    assert store.filename(2) == "10q_chunk_0.md"
+    assert store.id_for_filename("10k_chunk_1.md") == 1
+    assert store.id_for_text("net sales rose") == 0
+    assert store.metadata(0) is None
+
+
+def test_payload_ids_are_checked_against_the_filename(store):
+    assert store.id_for_payload({"chunk_id": 2, "filename": "10q_chunk_0.md"}) == 2
+    # An id from an older layout is corrected by the filename
+    assert store.id_for_payload({"chunk_id": 0, "filename": "10k_chunk_1.md"}) == 1
+    assert store.id_for_payload({"text": "gross margin fell"}) == 1
+    assert store.id_for_payload(None) is None
+
+
+def test_mismatched_lengths_are_rejected():
+    with pytest.raises(ValueError):
+        ChunkStore(FILES, TEXTS[:2])
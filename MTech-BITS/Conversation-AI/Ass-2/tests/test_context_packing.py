@@ -0,0 +1,51 @@
+from context_packing import ContextPacker, context_budget, merge_chunks
+
+
+def words(text):
+    return len(text.split())
+
+
+FILLER = "The remaining discussion covers " + " ".join(["segment"] * 30) + " results."
+FACT = "Net sales rose ten percent in fiscal 2023."
+
+
+def test_consecutive_chunks_merge_without_the_repeated_seam():
+    pieces = merge_chunks([
+        ("10k_chunk_2.md", "Gross margin was 46 percent. Services grew."),
+        ("other_chunk_7.md", "Unrelated text."),
+        ("10k_chunk_1.md", "Net sales rose. Gross margin was 46 percent."),
+    ])
+    assert [(piece.source, piece.chunk_numbers) for piece in pieces] == [("10k", (1, 2)), ("other", (7,))]
+    assert pieces[0].text == "Net sales rose. Gross margin was 46 percent. Services grew."
+
+
+def test_repeated_sentences_appear_once():
+    packer = ContextPacker(1000, count_tokens=words)
+    packed = packer.pack("q", [("a_chunk_1.md", FACT + "\nOnly in a."), ("b_chunk_5.md", FACT + "\nOnly in b.")])
+    assert packed.prompt.count(FACT) == 1
+    assert "Only in a." in packed.prompt and "Only in b." in packed.prompt
+
+
+def test_budget_is_respected():
+    packer = ContextPacker(40, count_tokens=words)
+    packed = packer.pack("q", [(f"f{i}_chunk_1.md", FILLER) for i in range(5)])
+    assert packed.tokens <= 40
+    assert packed.raw_tokens > packed.tokens
+
+
+def test_sentence_cut_by_the_budget_can_come_from_a_later_passage():
+    # Room for the first passage's short line, not its long one, then the second passage
+    packer = ContextPacker(3 + 6 + 4 + 6 + 9, count_tokens=words)
+    packed = packer.pack("q", [
+        ("a_chunk_1.md", f"Revenue grew strongly.\n{FACT} {FILLER}"),
+        ("b_chunk_1.md", FACT),
+    ])
+    assert FILLER not in packed.prompt
+    assert [piece.source for piece in packed.pieces] == ["a", "b"]
+    assert packed.pieces[1].text == FACT
+
+
+def test_context_budget_caps_at_the_model_window():
+    assert context_budget("phi3:mini", num_ctx=8192) == 4096 - 512
+    assert context_budget("gemma2:latest") == 2048 - 512
+    assert context_budget("unknown", num_ctx=100) == 0
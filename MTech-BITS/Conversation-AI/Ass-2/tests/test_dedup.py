@@ -0,0 +1,54 @@
+from chunk_corpus import ChunkRecord
+from dedup import MinHasher, dedup_records, lsh_params, near_duplicate_groups, shingles
+
+BOILERPLATE = (
+    "Indicate by check mark whether the registrant has submitted electronically every Interactive Data File "
+    "required to be submitted pursuant to Rule 405 of Regulation S-T during the preceding 12 months"
+)
+OTHER = (
+    "Total net sales increased due to higher net sales of Services and iPhone, partially offset by lower "
+    "net sales of Mac and iPad during the fiscal year compared to the prior year"
+)
+
+
+def test_minhash_estimates_jaccard():
+    a, b = shingles(BOILERPLATE), shingles(BOILERPLATE + " and has been subject to such filing requirements")
+    exact = len(a & b) / len(a | b)
+    hasher = MinHasher(num_perm=256)
+    estimate = float((hasher.signature(a) == hasher.signature(b)).mean())
+    assert abs(estimate - exact) < 0.1
+
+
+def test_lsh_params_use_every_permutation():
+    bands, rows = lsh_params(0.8, 128)
+    assert bands * rows <= 128 and bands > 1 and rows > 1
+
+
+def test_groups_merge_near_duplicates_only():
+    texts = [BOILERPLATE, OTHER, BOILERPLATE + ".", BOILERPLATE.upper(), OTHER.replace("fiscal", "calendar")]
+    groups = near_duplicate_groups(texts, threshold=0.8)
+    assert [0, 2, 3] in groups
+    assert [1] in groups and [4] in groups
+    assert sum(len(group) for group in groups) == len(texts)
+
+
+def test_dedup_records_keeps_first_and_lists_sources():
+    records = [
+        ChunkRecord("q1_chunk_3.md", BOILERPLATE, "q1", 3, (10, 200)),
+        ChunkRecord("q1_chunk_4.md", OTHER, "q1", 4, None),
+        ChunkRecord("q2_chunk_3.md", BOILERPLATE, "q2", 3, None),
+    ]
+    kept, report = dedup_records(records, threshold=0.8)
+    assert [record.name for record in kept] == ["q1_chunk_3.md", "q1_chunk_4.md"]
+    assert [source["name"] for source in kept[0].sources] == ["q1_chunk_3.md", "q2_chunk_3.md"]
+    assert kept[0].sources[0]["char_span"] == [10, 200]
+    assert report["chunks_before"] == 3 and report["chunks_after"] == 2
+    assert report["groups_merged"] == 1
+
+
+def test_members_match_the_kept_chunk_not_just_a_neighbour():
+    words = [f"w{i}" for i in range(120)]
+    chain = [" ".join(words[start:start + 100]) for start in (0, 10, 20)]
+    # Neighbours share 90 of 110 words; the ends of the chain only 80 of 120
+    groups = near_duplicate_groups(chain, threshold=0.75, num_perm=256, shingle_size=1)
+    assert groups == [[0, 1], [2]]
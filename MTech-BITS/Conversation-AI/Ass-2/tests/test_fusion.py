@@ -0,0 +1,31 @@
+import pytest
+
+from fusion import fuse, normalized_score_fusion, reciprocal_rank_fusion
+
+BM25 = [(1, 12.0), (2, 9.0), (3, 1.0)]
+DENSE = [(3, 0.9), (4, 0.8), (1, 0.7)]
+
+
+def test_rrf_rewards_docs_found_by_both_retrievers():
+    fused = reciprocal_rank_fusion([BM25, DENSE])
+    assert [doc_id for doc_id, _ in fused] == [1, 3, 2, 4]
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 63)
+
+
+def test_rrf_weights_shift_the_order():
+    fused = reciprocal_rank_fusion([BM25, DENSE], weights=[0.1, 1.0])
+    assert [doc_id for doc_id, _ in fused] == [3, 1, 4, 2]
+
+
+def test_score_fusion_normalises_each_list():
+    fused = dict(normalized_score_fusion([BM25, DENSE]))
+    assert fused[1] == pytest.approx(1.0 + 0.0)
+    assert fused[3] == pytest.approx(0.0 + 1.0)
+    assert fused[4] == pytest.approx(0.5)
+
+
+def test_fuse_limits_and_rejects_unknown_methods():
+    assert len(fuse([BM25, DENSE], "rrf", limit=2)) == 2
+    assert fuse([[], []], "score") == []
+    with pytest.raises(ValueError):
+        fuse([BM25], "borda")
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from generation_scheduler import GenerationScheduler, SchedulerBusy
+
+
+def blocking_job(name, gate, order):
+    def generate():
+        gate.wait(5)
+        order.append(name)
+        yield name
+    return generate
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_users_are_served_round_robin():
+    gate, order = threading.Event(), []
+    scheduler = GenerationScheduler(workers=1, max_queue=10, max_queue_per_user=3)
+    first = scheduler.submit(blocking_job("a0", gate, order), user="a")
+    wait_for(lambda: scheduler.stats()["active"] == 1)
+    streams = [scheduler.submit(blocking_job(name, gate, order), user=name[0])
+               for name in ("a1", "a2", "a3", "b1", "b2", "c1")]
+    gate.set()
+    for stream in [first] + streams:
+        list(stream)
+    assert order == ["a0", "a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_lower_priority_value_goes_first():
+    gate, order = threading.Event(), []
+    scheduler = GenerationScheduler(workers=1)
+    first = scheduler.submit(blocking_job("busy", gate, order), user="x")
+    wait_for(lambda: scheduler.stats()["active"] == 1)
+    low = scheduler.submit(blocking_job("low", gate, order), user="a", priority=1)
+    high = scheduler.submit(blocking_job("high", gate, order), user="b", priority=0)
+    gate.set()
+    for stream in (first, low, high):
+        list(stream)
+    assert order == ["busy", "high", "low"]
+
+
+def test_full_queues_refuse_at_once():
+    gate = threading.Event()
+    scheduler = GenerationScheduler(workers=1, max_queue=3, max_queue_per_user=2)
+    running = scheduler.submit(blocking_job("run", gate, []), user="a")
+    wait_for(lambda: scheduler.stats()["active"] == 1)
+    scheduler.submit(blocking_job("a1", gate, []), user="a")
+    scheduler.submit(blocking_job("a2", gate, []), user="a")
+    with pytest.raises(SchedulerBusy):
+        scheduler.submit(blocking_job("a3", gate, []), user="a")
+    scheduler.submit(blocking_job("b1", gate, []), user="b")
+    with pytest.raises(SchedulerBusy):
+        scheduler.submit(blocking_job("c1", gate, []), user="c")
+    assert scheduler.stats()["rejected"] == 2
+    gate.set()
+    list(running)
+
+
+def test_errors_reach_the_reader():
+    def failing():
+        yield "partial"
+        raise RuntimeError("backend down")
+
+    scheduler = GenerationScheduler(workers=1)
+    stream = scheduler.submit(failing, user="a")
+    assert next(stream) == "partial"
+    with pytest.raises(RuntimeError):
+        next(stream)
+    wait_for(lambda: scheduler.stats()["failed"] == 1)
+
+
+def test_close_frees_the_worker_and_closes_the_backend_stream():
+    closed = threading.Event()
+
+    def endless():
+        try:
+            while True:
+                time.sleep(0.001)
+                yield "token"
+        finally:
+            closed.set()
+
+    scheduler = GenerationScheduler(workers=1)
+    stream = scheduler.submit(endless, user="a")
+    queued = scheduler.submit(lambda: iter(["never"]), user="b")
+    queued.close()
+    next(stream)
+    stream.close()
+    assert closed.wait(5)
+    wait_for(lambda: scheduler.stats()["active"] == 0 and scheduler.stats()["queued"] == 0)
+    assert scheduler.stats()["cancelled"] == 2
+    assert list(scheduler.submit(lambda: iter(["next"]), user="c")) == ["next"]
@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip("better_profanity")
+
+from guardrail import REJECTION_MESSAGE, BatchedClassifier, GuardrailCascade
+
+VOCABULARY = ("what was apple net sales revenue in the fiscal year we know where your family lives "
+              "and they will suffer how did services grow").split()
+
+
+class FakeToxicity:
+    """Scores texts by a fixed table; records every batch it is given."""
+
+    def __init__(self, scores):
+        self.scores = scores
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return [{"score": self.scores.get(text, 0.0)} for text in texts]
+
+
+@pytest.fixture
+def model():
+    return FakeToxicity({"We know where your family lives and they will suffer": 0.97})
+
+
+@pytest.fixture
+def guardrail(model):
+    return GuardrailCascade(BatchedClassifier(lambda: model, max_wait_ms=1), vocabulary=VOCABULARY)
+
+
+def test_finance_question_skips_the_model(guardrail, model):
+    assert guardrail.check("What was Apple net sales revenue in the fiscal year") == (True, None)
+    assert model.batches == []
+    assert guardrail.stats()["lexical_accept"] == 1
+
+
+def test_hostile_message_without_profanity_reaches_the_model(guardrail, model):
+    text = "We know where your family lives and they will suffer"
+    assert guardrail.check(text) == (False, REJECTION_MESSAGE)
+    assert model.batches == [[text]]
+    assert guardrail.stats()["lexical_accept"] == 0
+
+
+def test_in_vocabulary_text_without_finance_terms_reaches_the_model(guardrail, model):
+    assert guardrail.check("how did they grow") == (True, None)
+    assert guardrail.stats()["model"] == 1
+
+
+def test_profanity_is_rejected_without_the_model(guardrail, model):
+    assert guardrail.check("what the fuck was revenue")[0] is False
+    assert model.batches == []
+
+
+def test_verdicts_are_cached_by_normalised_text(guardrail, model):
+    guardrail.check("how did they grow")
+    guardrail.check("  How did THEY grow ")
+    assert len(model.batches) == 1
+    assert guardrail.stats()["cache"] == 1
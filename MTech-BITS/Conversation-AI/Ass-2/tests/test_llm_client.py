@@ -0,0 +1,115 @@
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+import llm_client
+from llm_client import CircuitBreaker, CircuitOpenError, ResilientTransport
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_client.time, "monotonic", clock)
+    return clock
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+    for _ in range(2):
+        breaker.record_failure("url")
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure("url")
+    breaker.before_request("url")
+    breaker.record_failure("url")
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request("url")
+
+
+def test_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure("url")
+    clock.now += 31
+    breaker.before_request("url")
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request("url")
+    breaker.record_failure("url")
+    assert breaker.state == "open"
+    clock.now += 31
+    breaker.before_request("url")
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_request("url")
+
+
+class NetworkStream(httpx.SyncByteStream):
+    """A body that, like a socket's, cannot be read once closed."""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.closed = False
+
+    def __iter__(self):
+        if self.closed:
+            raise httpx.StreamClosed()
+        yield self.body
+
+    def close(self):
+        self.closed = True
+
+
+class FlakyTransport(httpx.BaseTransport):
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def handle_request(self, request):
+        self.calls += 1
+        return httpx.Response(self.statuses.pop(0), headers={"content-type": "application/json"},
+                              stream=NetworkStream(b'{"response": "ok"}'))
+
+
+def make_transport(statuses, **kwargs):
+    transport = ResilientTransport("http://backend", backoff_seconds=0, **kwargs)
+    transport._transport = FlakyTransport(statuses)
+    return transport
+
+
+def test_retries_unavailable_answers_then_succeeds():
+    transport = make_transport([503, 502, 200], max_retries=3)
+    with httpx.Client(transport=transport, base_url="http://backend") as client:
+        assert client.post("/api/generate").json() == {"response": "ok"}
+    stats = transport.stats()
+    assert stats["retries"] == 2 and stats["in_flight"] == 0 and stats["circuit"] == "closed"
+
+
+def test_gives_up_with_the_last_answer_and_opens_the_circuit():
+    transport = make_transport([503] * 3, max_retries=2, breaker=CircuitBreaker(failure_threshold=3))
+    with httpx.Client(transport=transport, base_url="http://backend") as client:
+        response = client.post("/api/generate")
+        assert response.status_code == 503 and response.json() == {"response": "ok"}
+        with pytest.raises(CircuitOpenError):
+            client.post("/api/generate")
+    assert transport._transport.calls == 3
+    assert transport.stats()["rejected"] == 1 and transport.stats()["in_flight"] == 0
+
+
+def test_slot_wait_is_bounded():
+    transport = make_transport([200], max_concurrency=1)
+    with httpx.Client(transport=transport, base_url="http://backend",
+                      timeout=httpx.Timeout(5, pool=0.05)) as client:
+        with client.stream("POST", "/api/generate"):
+            with pytest.raises(httpx.PoolTimeout):
+                client.post("/api/generate")
+    assert transport.stats()["pool_timeouts"] == 1
+    assert transport.stats()["in_flight"] == 0
@@ -0,0 +1,38 @@
+import time
+
+from generation_scheduler import GenerationScheduler
+from llm_metrics import InstrumentedStream, LLMMetricsRecorder
+
+
+def only_record(recorder):
+    assert len(recorder) == 1
+    return {name: values["p50"] for name, values in recorder.percentiles().items()}
+
+
+def slow_tokens(first_token_s, count=3):
+    def generate():
+        time.sleep(first_token_s)
+        for i in range(count):
+            yield f"token{i}"
+    return generate
+
+
+def test_direct_stream_is_timed_from_the_start_of_draining():
+    recorder = LLMMetricsRecorder()
+    stream = InstrumentedStream(slow_tokens(0.05)(), recorder, model="m")
+    assert list(stream) == ["token0", "token1", "token2"]
+    metrics = only_record(recorder)
+    assert metrics["queue_ms"] < 20 and metrics["ttft_ms"] >= 45
+
+
+def test_scheduler_queue_wait_counts_as_queue_not_ttft():
+    recorder = LLMMetricsRecorder()
+    scheduler = GenerationScheduler(workers=1)
+    busy = scheduler.submit(slow_tokens(0.2, count=1))
+    stream = InstrumentedStream(scheduler.submit(slow_tokens(0.05)), recorder, model="m")
+    list(stream)
+    list(busy)
+    metrics = only_record(recorder)
+    assert metrics["queue_ms"] >= 150
+    assert 45 <= metrics["ttft_ms"] < 150
+    assert metrics["total_ms"] >= metrics["queue_ms"] + metrics["ttft_ms"] - 1
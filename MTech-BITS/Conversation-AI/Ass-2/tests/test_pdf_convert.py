@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from pdf_convert import PageCache, convert_pages, convert_pdfs, count_pages, file_digest, page_shards
+
+PDF = os.path.join(os.path.dirname(__file__), os.pardir, "financial-docs-raw", "_10-K-Q4-2023-As-Filed.pdf")
+
+needs_pdf = pytest.mark.skipif(not os.path.exists(PDF), reason="sample filing not available")
+
+
+def test_shards_are_runs_of_consecutive_pages():
+    assert page_shards([0, 1, 2, 3, 4], 2) == [[0, 1], [2, 3], [4]]
+    assert page_shards([0, 1, 5, 6, 9], 8) == [[0, 1], [5, 6], [9]]
+    assert page_shards([], 8) == []
+
+
+def test_page_cache_round_trips(tmp_path):
+    cache = PageCache(str(tmp_path))
+    assert cache.get("ab" * 32, 3) is None
+    cache.put("ab" * 32, 3, "page three\f")
+    assert cache.get("ab" * 32, 3) == "page three\f"
+
+
+@needs_pdf
+def test_sharded_pages_match_pdfminer_over_the_range():
+    extract_text = pytest.importorskip("pdfminer.high_level").extract_text
+    assert "".join(convert_pages(PDF, [0, 1, 2])) == extract_text(PDF, page_numbers=[0, 1, 2])
+
+
+@needs_pdf
+def test_only_uncached_pages_are_converted(tmp_path):
+    pytest.importorskip("pdfminer")
+    cache = PageCache(str(tmp_path / "cache"))
+    digest, pages = file_digest(PDF), count_pages(PDF)
+    for page in range(2, pages):
+        cache.put(digest, page, f"cached page {page}\f")
+
+    report = convert_pdfs([PDF], str(tmp_path / "md"), str(tmp_path / "cache"), workers=2, pages_per_shard=1)
+    assert report[PDF] == {"pages": pages, "cached_pages": pages - 2}
+    with open(tmp_path / "md" / "_10-K-Q4-2023-As-Filed.md", encoding="utf-8") as f:
+        text = f.read()
+    assert text.startswith("".join(convert_pages(PDF, [0, 1])))
+    assert text.endswith(f"cached page {pages - 1}\f")
+    assert cache.get(digest, 0) is not None
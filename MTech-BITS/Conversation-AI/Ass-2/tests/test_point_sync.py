@@ -0,0 +1,31 @@
+from vector_store import point_id, read_point_manifest, sync_points, write_point_manifest
+
+FILES = ["/data/10k_chunk_0.md", "/data/10k_chunk_1.md"]
+TEXTS = ["net sales rose", "gross margin fell"]
+
+
+def test_point_ids_follow_name_and_content():
+    assert point_id("10k_chunk_0.md", "net sales rose") == point_id("10k_chunk_0.md", "net sales rose")
+    assert point_id("10k_chunk_0.md", "net sales rose") != point_id("10k_chunk_0.md", "net sales fell")
+    assert point_id("10k_chunk_0.md", "net sales rose") != point_id("10q_chunk_0.md", "net sales rose")
+
+
+def test_only_new_or_changed_chunks_are_upserted():
+    _, _, indexed = sync_points({}, FILES, TEXTS)
+    indexed["legacy-random-id"] = "10k_chunk_0.md"
+    files = FILES + ["/data/10q_chunk_0.md"]
+    texts = [TEXTS[0], "gross margin rose", "dividends were paid"]
+    upsert, delete, manifest = sync_points(indexed, files, texts)
+    assert upsert == [1, 2]
+    assert sorted(delete) == sorted([point_id("10k_chunk_1.md", TEXTS[1]), "legacy-random-id"])
+    assert sorted(manifest.values()) == ["10k_chunk_0.md", "10k_chunk_1.md", "10q_chunk_0.md"]
+
+
+def test_force_upserts_everything_and_manifest_round_trips(tmp_path):
+    _, _, indexed = sync_points({}, FILES, TEXTS)
+    upsert, delete, manifest = sync_points(indexed, FILES, TEXTS, force=True)
+    assert upsert == [0, 1] and delete == []
+    path = str(tmp_path / "points.json")
+    assert read_point_manifest(path) is None
+    write_point_manifest(path, manifest)
+    assert read_point_manifest(path) == manifest
@@ -0,0 +1,53 @@
+import query_cache
+from query_cache import QueryCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_key_ignores_case_and_whitespace_but_not_params():
+    key = QueryCache.make_key("Net  Sales", top_k=2)
+    assert key == QueryCache.make_key("net sales", top_k=2)
+    assert key != QueryCache.make_key("net sales", top_k=3)
+
+
+def test_lru_eviction_keeps_recently_used_entries():
+    cache = QueryCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(query_cache.time, "time", clock)
+    cache = QueryCache(ttl_seconds=10)
+    cache.put("a", 1)
+    clock.now += 9
+    assert cache.get("a") == 1
+    clock.now += 2
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_disk_tier_survives_restarts_and_stays_bounded(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = QueryCache(max_entries=1, disk_path=path, max_disk_entries=2)
+    for key in ("a", "b", "c"):
+        cache.put(key, {"doc_ids": [key]})
+
+    reopened = QueryCache(disk_path=path)
+    assert reopened.get("a") is None
+    assert reopened.get("c") == {"doc_ids": ["c"]}
+    stats = reopened.stats()
+    assert stats["disk_hits"] == 1 and stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
@@ -0,0 +1,59 @@
+"""SegmentedBM25 against rank_bm25.BM25Okapi, and incremental segment updates."""
+import os
+
+import numpy as np
+import pytest
+from rank_bm25 import BM25Okapi
+
+import segments
+from bm25_index import BM25Index
+from segments import SegmentedBM25, load_or_update_index, merge_segments, read_manifest
+
+
+def test_segments_use_global_statistics(corpus, queries, expected_top_k):
+    bounds = [0, len(corpus) // 3, len(corpus) // 3 + 1, len(corpus)]
+    parts = [BM25Index.build(corpus[start:end]) for start, end in zip(bounds, bounds[1:])]
+    segmented = SegmentedBM25(parts)
+    reference = BM25Okapi(corpus)
+    merged = segmented.merged()
+    for tokens in queries:
+        expected_scores = reference.get_scores(tokens)
+        np.testing.assert_allclose(segmented.get_scores(tokens), expected_scores, rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(merged.get_scores(tokens), expected_scores, rtol=1e-9, atol=1e-12)
+        expected = expected_top_k(expected_scores, 5)
+        np.testing.assert_array_equal(segmented.top_k(tokens, 5)[0], expected)
+        np.testing.assert_array_equal(merged.top_k(tokens, 5, prune=True)[0], expected)
+
+
+@pytest.fixture
+def split_tokenizer(monkeypatch):
+    monkeypatch.setattr(segments.nltk, "download", lambda *args, **kwargs: True)
+    monkeypatch.setattr(segments, "tokenize", str.split)
+
+
+def test_new_files_land_in_a_new_segment(tmp_path, split_tokenizer, small_texts):
+    index_dir = str(tmp_path / "bm25")
+    files = [f"doc_chunk_{i}.md" for i in range(len(small_texts))]
+    load_or_update_index(index_dir, files[:5], small_texts[:5])
+    index, ordered_files, chunks, added = load_or_update_index(index_dir, files, small_texts)
+    assert len(index.segments) == 2
+    assert ordered_files == files and list(chunks) == small_texts
+    assert added == [5, 6, 7]
+    reference = BM25Okapi([text.split() for text in small_texts])
+    np.testing.assert_allclose(index.get_scores(["net", "sales"]), reference.get_scores(["net", "sales"]))
+
+    merged = merge_segments(index_dir)
+    assert len(read_manifest(index_dir)["segments"]) == 1
+    np.testing.assert_allclose(merged.get_scores(["net", "sales"]), reference.get_scores(["net", "sales"]))
+    assert sorted(os.listdir(index_dir)) == [".lock", "manifest.json", "seg-000003"]
+
+
+def test_changed_file_rebuilds_the_index(tmp_path, split_tokenizer, small_texts):
+    index_dir = str(tmp_path / "bm25")
+    files = [f"doc_chunk_{i}.md" for i in range(len(small_texts))]
+    load_or_update_index(index_dir, files[:5], small_texts[:5])
+    load_or_update_index(index_dir, files, small_texts)
+    changed = small_texts[:1] + ["iphone iphone iphone"] + small_texts[2:]
+    index, _, _, added = load_or_update_index(index_dir, files, changed)
+    assert len(index.segments) == 1 and added == list(range(len(files)))
+    assert index.top_k(["iphone"], 1)[0].tolist() == [1]
@@ -0,0 +1,98 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from vector_store import (LocalVectorStore, VectorStore, append_segment, compact_local_store,
+                          load_local_store)
+
+
+@pytest.fixture
+def vectors():
+    return np.random.RandomState(0).randn(50, 8).astype(np.float32)
+
+
+def payloads(n, start=0):
+    return [{"chunk_id": i} for i in range(start, start + n)]
+
+
+def exact_ranking(vectors, query, limit):
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.argsort(-(unit @ (query / np.linalg.norm(query))), kind="stable")[:limit].tolist()
+
+
+class FakeHnsw:
+    """hnswlib.Index stand-in: exact search, and ef handling as in hnswlib."""
+
+    def __init__(self, space="ip", dim=None):
+        self.ef = 10  # hnswlib's default, also after load_index
+        self.matrix = None
+
+    def load_index(self, path, max_elements=0):
+        self.matrix = np.load(path)
+
+    def save_index(self, path):
+        with open(path, "wb") as f:
+            np.save(f, self.matrix)
+
+    def set_ef(self, ef):
+        self.ef = ef
+
+    def knn_query(self, query, k):
+        if k > self.ef:
+            raise RuntimeError("Cannot return the results in a contigious 2D array. Probably ef or M is too small")
+        scores = self.matrix @ query
+        labels = np.argsort(-scores, kind="stable")[:k]
+        return labels[None], (1 - scores[labels])[None]
+
+
+def test_incomplete_backend_fails_on_creation():
+    class SearchOnly(VectorStore):
+        def search(self, query_vector, limit, with_vectors=False):
+            return []
+
+    with pytest.raises(TypeError):
+        SearchOnly()
+
+
+def test_exact_search_ranks_by_cosine(vectors):
+    store = LocalVectorStore.from_vectors(vectors, payloads(len(vectors)))
+    query = vectors[3] + 0.1
+    hits = store.search(query, 5, with_vectors=True)
+    assert [hit.id for hit in hits] == exact_ranking(vectors, query, 5)
+    assert hits[0].payload == {"chunk_id": hits[0].id}
+    assert np.isclose(np.linalg.norm(hits[0].vector), 1.0)
+    assert len(store.search(query, 500)) == len(vectors)
+
+
+def test_segments_search_as_one_store_and_compact(tmp_path, vectors):
+    store_dir = str(tmp_path / "vectors")
+    append_segment(store_dir, vectors[:30], payloads(30))
+    append_segment(store_dir, vectors[30:], payloads(20, start=30))
+    store = load_local_store(store_dir)
+    assert len(store.segments) == 2 and len(store) == len(vectors)
+    query = vectors[40]
+    expected = exact_ranking(vectors, query, 10)
+    assert [hit.id for hit in store.search(query, 10)] == expected
+
+    store.compact()
+    assert len(store.segments) == 1
+    assert [hit.id for hit in store.search(query, 10)] == expected
+    assert compact_local_store(store_dir) is None
+
+
+def test_reloaded_graph_keeps_its_search_ef(tmp_path, vectors, monkeypatch):
+    monkeypatch.setitem(sys.modules, "hnswlib", types.SimpleNamespace(Index=FakeHnsw))
+    store = LocalVectorStore.from_vectors(vectors, payloads(len(vectors)))
+    store.hnsw, store.ef_search = FakeHnsw(), 32
+    store.hnsw.matrix = store.vectors
+    store.save(str(tmp_path))
+
+    loaded = LocalVectorStore.load(str(tmp_path))
+    assert loaded.hnsw.ef == 32
+    query = vectors[7]
+    assert [hit.id for hit in loaded.search(query, 20)] == exact_ranking(vectors, query, 20)
+    # Past the saved ef, the graph is searched wider rather than failing
+    assert len(loaded.search(query, 45)) == 45
+    assert loaded.hnsw.ef == 45
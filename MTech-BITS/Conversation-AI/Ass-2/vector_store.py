@@ -0,0 +1,527 @@
+"""Vector store backends for dense retrieval.
+
+`VECTOR_STORE` selects the backend:
+
+- `qdrant` (default): the remote Qdrant collection built by main.ipynb.
+- `local`: an in-process store, a memory-mapped float32 matrix searched
+  exactly, with an optional HNSW graph (needs `hnswlib`) for larger corpora.
+  It can also be built straight from arrays, which makes it the stand-in for
+  Qdrant in offline tests. On disk it is a list of segments: new chunks are
+  appended as a small segment, searches cover all of them, and
+  `compact_local_store` merges them back into one.
+
+Both return `VectorHit`s, which carry the same fields as Qdrant's results.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import argparse
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import numpy as np
+from loguru import logger
+
+VectorHit = namedtuple("VectorHit", ["id", "score", "payload", "vector"])
+
+_MATRIX_FILE = "vectors.npy"
+_PAYLOAD_FILE = "payloads.json"
+_HNSW_FILE = "hnsw.bin"
+# hnswlib does not save the search-time ef with the graph
+_HNSW_META_FILE = "hnsw.json"
+_EF_SEARCH = 64
+_SEGMENTS_FILE = "segments.json"
+
+
+class VectorStore(ABC):
+    """Interface shared by the vector store backends."""
+
+    @abstractmethod
+    def search(self, query_vector, limit: int, with_vectors: bool = False) -> List[VectorHit]:
+        ...
+
+    @abstractmethod
+    def __len__(self):
+        ...
+
+
+class QdrantVectorStore(VectorStore):
+    """Cosine search against a Qdrant collection, over one long-lived client."""
+
+    def __init__(self, collection_name: str, url: str = None, api_key: str = None):
+        from qdrant_client import QdrantClient
+        self.collection_name = collection_name
+        self.client = QdrantClient(url, api_key=api_key)
+
+    def search(self, query_vector, limit: int, with_vectors: bool = False) -> List[VectorHit]:
+        results = self.client.search(
+            collection_name=self.collection_name,
+            query_vector=list(query_vector),
+            limit=limit,
+            with_vectors=with_vectors,
+        )
+        return [VectorHit(res.id, res.score, res.payload, res.vector) for res in results]
+
+    def __len__(self):
+        return self.client.count(collection_name=self.collection_name).count
+
+    def ensure_collection(self, dim: int):
+        """Creates the collection if it does not exist; never wipes it."""
+        if not self.client.collection_exists(self.collection_name):
+            self.client.create_collection(
+                collection_name=self.collection_name,
+                vectors_config={"size": dim, "distance": "Cosine"},
+            )
+
+    def upsert(self, vectors, payloads: List[dict]):
+        """Writes one batch of points; ids are derived from the chunk filename."""
+        from qdrant_client.http.models import PointStruct
+        self.client.upsert(
+            collection_name=self.collection_name,
+            points=[
+                PointStruct(id=point_id(payload["filename"], payload["text"]), vector=vector.tolist(), payload=payload)
+                for vector, payload in zip(vectors, payloads)
+            ],
+            wait=True,
+        )
+
+    def delete(self, point_ids: List[str], batch_size: int = 256):
+        from qdrant_client.http.models import PointIdsList
+        for start in range(0, len(point_ids), batch_size):
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=PointIdsList(points=list(point_ids[start:start + batch_size])),
+                wait=True,
+            )
+
+    def indexed_points(self, batch_size: int = 1024) -> dict:
+        """{point id: filename} of every point, read without vectors or text."""
+        if not self.client.collection_exists(self.collection_name):
+            return {}
+        points, offset = {}, None
+        while True:
+            batch, offset = self.client.scroll(
+                collection_name=self.collection_name, limit=batch_size, offset=offset,
+                with_vectors=False, with_payload=["filename"],
+            )
+            for point in batch:
+                points[str(point.id)] = (point.payload or {}).get("filename")
+            if offset is None:
+                return points
+
+
+def point_id(filename: str, text: str) -> str:
+    """Point id derived from the chunk's file name and content hash.
+
+    Re-ingesting an unchanged chunk overwrites its own point; a changed chunk
+    gets a new id, and `sync_points` deletes the old one.
+    """
+    from segments import chunk_digest
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{filename}#{chunk_digest(text)}"))
+
+
+def read_point_manifest(path: str) -> Optional[dict]:
+    """{point id: filename} last written to a collection, or None."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["points"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_point_manifest(path: str, points: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"points": points}, f)
+    os.replace(path + ".tmp", path)
+
+
+def sync_points(indexed: dict, files: List[str], texts, force: bool = False):
+    """Plans bringing a collection holding `indexed` in line with the corpus.
+
+    Returns (positions to upsert, point ids to delete, the new manifest).
+    A chunk is upserted only when its point is missing, i.e. it is new or its
+    content changed; points of chunks that no longer exist, including ones
+    with random ids from older ingestion, are deleted. Unchanged points keep
+    their payload even if a rebuild moved their chunk id, since
+    `ChunkStore.id_for_payload` falls back to the filename.
+    """
+    wanted, upsert = {}, []
+    for position, (file, text) in enumerate(zip(files, texts)):
+        filename = os.path.basename(file)
+        pid = point_id(filename, text)
+        wanted[pid] = filename
+        if force or pid not in indexed:
+            upsert.append(position)
+    delete = [pid for pid in indexed if pid not in wanted]
+    return upsert, delete, wanted
+
+
+class BulkUpserter:
+    """Buffers points and writes them in batches from a small thread pool.
+
+    At most `max_in_flight` batches are being written at once; `add` blocks
+    when that many are pending, so a fast producer cannot queue the whole
+    corpus in memory. Use as a context manager, or call `close()` to flush
+    and wait.
+    """
+
+    def __init__(self, write_batch: Callable[[np.ndarray, List[dict]], None],
+                 batch_size: int = 256, max_in_flight: int = 4):
+        self._write_batch = write_batch
+        self._batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="upsert")
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._futures = []
+        self._vectors, self._payloads = [], []
+        self.written = 0
+        self.seconds = 0.0
+        self._started = None
+
+    def add(self, vectors, payloads: List[dict]):
+        if self._started is None:
+            self._started = time.perf_counter()
+        self._vectors.extend(np.asarray(vectors, dtype=np.float32))
+        self._payloads.extend(payloads)
+        while len(self._payloads) >= self._batch_size:
+            self._submit(self._batch_size)
+
+    def _submit(self, size: int):
+        vectors, self._vectors = np.asarray(self._vectors[:size]), self._vectors[size:]
+        payloads, self._payloads = self._payloads[:size], self._payloads[size:]
+        self._slots.acquire()
+        self._raise_failures()
+        future = self._executor.submit(self._write_batch, vectors, payloads)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append((future, len(payloads)))
+
+    def _raise_failures(self):
+        for future, _ in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+    def close(self):
+        """Flushes the buffer and waits for every batch; raises the first failure."""
+        try:
+            if self._payloads:
+                self._submit(len(self._payloads))
+            for future, count in self._futures:
+                future.result()
+                self.written += count
+        finally:
+            self._executor.shutdown(wait=True)
+            if self._started is not None:
+                self.seconds = time.perf_counter() - self._started
+        return self.written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class LocalVectorStore(VectorStore):
+    """Exact (or HNSW) cosine search over an in-process float32 matrix.
+
+    Rows are L2-normalised on build, so cosine similarity is a dot product.
+    """
+
+    def __init__(self, vectors: np.ndarray, payloads: List[dict], hnsw=None, ef_search: int = _EF_SEARCH):
+        if len(vectors) != len(payloads):
+            raise ValueError("vectors and payloads must have the same length")
+        self.vectors = vectors
+        self.payloads = payloads
+        self.hnsw = hnsw
+        self.ef_search = ef_search
+        self._ef_lock = threading.Lock()
+        if hnsw is not None:
+            hnsw.set_ef(ef_search)
+
+    @classmethod
+    def from_vectors(cls, vectors, payloads: List[dict], use_hnsw: bool = False):
+        """Builds a store in memory; no files are written."""
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(payloads), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms > 0, norms, 1)
+        hnsw = build_hnsw(matrix) if use_hnsw else None
+        return cls(matrix, list(payloads), hnsw)
+
+    def save(self, store_dir: str):
+        os.makedirs(store_dir, exist_ok=True)
+        np.save(os.path.join(store_dir, _MATRIX_FILE), self.vectors)
+        with open(os.path.join(store_dir, _PAYLOAD_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.payloads, f, ensure_ascii=False)
+        if self.hnsw is not None:
+            self.hnsw.save_index(os.path.join(store_dir, _HNSW_FILE))
+            with open(os.path.join(store_dir, _HNSW_META_FILE), "w", encoding="utf-8") as f:
+                json.dump({"ef_search": self.ef_search}, f)
+
+    @classmethod
+    def load(cls, store_dir: str):
+        """Memory-maps the matrix, and loads the HNSW graph if one was saved."""
+        vectors = np.load(os.path.join(store_dir, _MATRIX_FILE), mmap_mode="r")
+        with open(os.path.join(store_dir, _PAYLOAD_FILE), encoding="utf-8") as f:
+            payloads = json.load(f)
+        hnsw, ef_search = None, _EF_SEARCH
+        hnsw_path = os.path.join(store_dir, _HNSW_FILE)
+        if os.path.exists(hnsw_path):
+            try:
+                import hnswlib
+                hnsw = hnswlib.Index(space="ip", dim=vectors.shape[1])
+                hnsw.load_index(hnsw_path, max_elements=len(vectors))
+            except ImportError:
+                logger.warning("hnswlib is not installed, falling back to exact search")
+            try:
+                with open(os.path.join(store_dir, _HNSW_META_FILE), encoding="utf-8") as f:
+                    ef_search = json.load(f)["ef_search"]
+            except (OSError, ValueError, KeyError):
+                pass  # saved before ef was recorded
+        return cls(vectors, payloads, hnsw, ef_search)
+
+    def search(self, query_vector, limit: int, with_vectors: bool = False) -> List[VectorHit]:
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        limit = min(limit, len(self.payloads))
+        if limit <= 0:
+            return []
+
+        if self.hnsw is not None:
+            if limit > self.ef_search:
+                # knn_query needs ef >= k; ef only grows, so concurrent searches stay valid
+                with self._ef_lock:
+                    if limit > self.ef_search:
+                        self.ef_search = limit
+                        self.hnsw.set_ef(limit)
+            labels, distances = self.hnsw.knn_query(query, k=limit)
+            ids = labels[0]
+            scores = 1 - distances[0]  # hnswlib's "ip" distance is 1 - dot
+        else:
+            all_scores = self.vectors @ query
+            ids = np.argpartition(-all_scores, limit - 1)[:limit]
+            ids = ids[np.argsort(-all_scores[ids], kind="stable")]
+            scores = all_scores[ids]
+
+        return [
+            VectorHit(int(i), float(score), self.payloads[i],
+                      self.vectors[i].tolist() if with_vectors else None)
+            for i, score in zip(ids, scores)
+        ]
+
+    def __len__(self):
+        return len(self.payloads)
+
+
+class SegmentedVectorStore(VectorStore):
+    """Several `LocalVectorStore` segments searched as one.
+
+    Hit ids are global positions: segment order, then row order.
+    """
+
+    def __init__(self, store_dir: str, stores: List[LocalVectorStore]):
+        self.store_dir = store_dir
+        self.segments = stores
+
+    def search(self, query_vector, limit: int, with_vectors: bool = False) -> List[VectorHit]:
+        segments = self.segments  # compact() swaps the list, never mutates it
+        hits, offset = [], 0
+        for store in segments:
+            hits.extend(hit._replace(id=hit.id + offset) for hit in store.search(query_vector, limit, with_vectors))
+            offset += len(store)
+        hits.sort(key=lambda hit: (-hit.score, hit.id))
+        return hits[:limit]
+
+    def compact(self):
+        """Merges the segments on disk and switches searches to the result."""
+        merged = compact_local_store(self.store_dir)
+        if merged is not None and len(merged) == len(self):
+            self.segments = [merged]
+
+    def __len__(self):
+        return sum(len(store) for store in self.segments)
+
+
+def _read_segments(store_dir: str) -> dict:
+    try:
+        with open(os.path.join(store_dir, _SEGMENTS_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # A store saved before segments existed is its own single segment
+        legacy = os.path.exists(os.path.join(store_dir, _MATRIX_FILE))
+        return {"next_segment": 1, "segments": ["."] if legacy else []}
+
+
+def _write_segments(store_dir: str, listing: dict):
+    path = os.path.join(store_dir, _SEGMENTS_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(listing, f, indent=2)
+    os.replace(path + ".tmp", path)
+    listed = set(listing["segments"])
+    for entry in os.listdir(store_dir):
+        if entry.startswith("seg-") and entry not in listed:
+            shutil.rmtree(os.path.join(store_dir, entry), ignore_errors=True)
+    if "." not in listed:
+        for name in (_MATRIX_FILE, _PAYLOAD_FILE, _HNSW_FILE, _HNSW_META_FILE):
+            if os.path.exists(os.path.join(store_dir, name)):
+                os.remove(os.path.join(store_dir, name))
+
+
+def _save_segment(store_dir: str, listing: dict, store: LocalVectorStore) -> str:
+    name = f"seg-{listing['next_segment']:06d}"
+    store.save(os.path.join(store_dir, name))
+    listing["next_segment"] += 1
+    return name
+
+
+def load_local_store(store_dir: str) -> VectorStore:
+    """Loads every segment of a local store."""
+    names = _read_segments(store_dir)["segments"]
+    if not names:
+        raise FileNotFoundError(f"No local vector store in {store_dir}")
+    return SegmentedVectorStore(store_dir, [LocalVectorStore.load(os.path.join(store_dir, name)) for name in names])
+
+
+def save_local_store(store_dir: str, store: LocalVectorStore):
+    """Replaces the whole store with `store` as its only segment."""
+    from segments import index_lock
+    with index_lock(store_dir):
+        listing = _read_segments(store_dir)
+        listing["segments"] = [_save_segment(store_dir, listing, store)]
+        _write_segments(store_dir, listing)
+
+
+def append_segment(store_dir: str, vectors, payloads: List[dict], use_hnsw: bool = False):
+    """Adds `vectors` as a new segment after the existing ones."""
+    from segments import index_lock
+    with index_lock(store_dir):
+        listing = _read_segments(store_dir)
+        store = LocalVectorStore.from_vectors(vectors, payloads, use_hnsw=use_hnsw)
+        listing["segments"].append(_save_segment(store_dir, listing, store))
+        _write_segments(store_dir, listing)
+    logger.info(f"Appended {len(store)} vectors to {store_dir} ({len(listing['segments'])} segments)")
+
+
+def compact_local_store(store_dir: str) -> Optional[LocalVectorStore]:
+    """Merges all segments into one. Returns it, or None if there was one already."""
+    from segments import index_lock
+    with index_lock(store_dir):
+        listing = _read_segments(store_dir)
+        if len(listing["segments"]) < 2:
+            return None
+        stores = [LocalVectorStore.load(os.path.join(store_dir, name)) for name in listing["segments"]]
+        merged = LocalVectorStore(
+            np.concatenate([np.asarray(store.vectors) for store in stores]),
+            [payload for store in stores for payload in store.payloads],
+        )
+        if any(store.hnsw is not None for store in stores):
+            merged.hnsw = build_hnsw(merged.vectors)
+        name = _save_segment(store_dir, listing, merged)
+        merged_count = len(listing["segments"])
+        listing["segments"] = [name]
+        _write_segments(store_dir, listing)
+    logger.info(f"Merged {merged_count} vector segments into {name}")
+    return LocalVectorStore.load(os.path.join(store_dir, name))
+
+
+def build_hnsw(matrix: np.ndarray, m: int = 16, ef_construction: int = 200, ef_search: int = _EF_SEARCH):
+    """HNSW graph over L2-normalised rows (inner product == cosine)."""
+    import hnswlib
+    index = hnswlib.Index(space="ip", dim=matrix.shape[1])
+    index.init_index(max_elements=len(matrix), M=m, ef_construction=ef_construction)
+    index.add_items(matrix, np.arange(len(matrix)))
+    index.set_ef(ef_search)
+    return index
+
+
+def get_vector_store(backend: Optional[str] = None) -> VectorStore:
+    """Creates the backend selected by `VECTOR_STORE` (qdrant or local)."""
+    backend = (backend or os.getenv("VECTOR_STORE", "qdrant")).lower()
+    if backend == "qdrant":
+        return QdrantVectorStore(
+            os.getenv("QDRANT_COLLECTION", "apl-fin-500"),
+            os.getenv("QDRANT_HOST"),
+            api_key=os.getenv("QDRANT_API_KEY"),
+        )
+    if backend == "local":
+        store_dir = os.getenv("LOCAL_VECTOR_DIR", "./index/vectors")
+        logger.info(f"Loading local vector store from {store_dir}")
+        return load_local_store(store_dir)
+    raise ValueError(f"Unknown VECTOR_STORE backend: {backend}")
+
+
+def export_from_qdrant(collection_name: str, batch_size: int = 256):
+    """Reads every vector and payload out of a Qdrant collection."""
+    from qdrant_client import QdrantClient
+    client = QdrantClient(os.getenv("QDRANT_HOST"), api_key=os.getenv("QDRANT_API_KEY"))
+    vectors, payloads, offset = [], [], None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name, limit=batch_size, offset=offset,
+            with_vectors=True, with_payload=True,
+        )
+        for point in points:
+            vectors.append(point.vector)
+            payloads.append(point.payload)
+        if offset is None:
+            break
+    return vectors, payloads
+
+
+def chunk_payloads(files: List[str], texts, chunk_ids=None) -> List[dict]:
+    """Point payloads for chunks in index order; `chunk_id` is the position."""
+    chunk_ids = range(len(files)) if chunk_ids is None else chunk_ids
+    return [
+        {"text": texts[chunk_id], "filename": os.path.basename(files[chunk_id]), "chunk_id": chunk_id}
+        for chunk_id in chunk_ids
+    ]
+
+
+def embed_chunk_dir(data_dir: str, embeddings_dir: str = None, index_dir: str = None):
+    """Embeds every chunk of `data_dir` (a chunk directory or packed corpus),
+    in chunk id order.
+
+    Reuses rows of the precomputed matrix in `embeddings_dir` for unchanged
+    chunks and encodes the rest.
+    """
+    from chunk_corpus import read_corpus
+    from chunk_embeddings import reuse_or_encode
+    from segments import load_or_update_index
+    names, texts, digests = read_corpus(data_dir)
+    _, files, texts, _ = load_or_update_index(
+        index_dir or os.getenv("BM25_INDEX_DIR", "./index/bm25"), names, texts, digests)
+    vectors = reuse_or_encode(embeddings_dir, files, texts)
+    return vectors, chunk_payloads(files, texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the local vector store.")
+    parser.add_argument("--out", default=os.getenv("LOCAL_VECTOR_DIR", "./index/vectors"))
+    parser.add_argument("--data-dir", default="./financial-docs-md/chunks-500",
+                        help="Chunk directory or packed corpus to embed (ignored with --from-qdrant)")
+    parser.add_argument("--from-qdrant", metavar="COLLECTION",
+                        help="Export an existing Qdrant collection instead of re-embedding")
+    parser.add_argument("--hnsw", action="store_true", help="Also build an HNSW graph (needs hnswlib)")
+    args = parser.parse_args()
+
+    if args.from_qdrant:
+        vectors, payloads = export_from_qdrant(args.from_qdrant)
+    else:
+        vectors, payloads = embed_chunk_dir(
+            args.data_dir, os.getenv("CHUNK_EMBEDDINGS_DIR", "./index/embeddings"))
+    store = LocalVectorStore.from_vectors(vectors, payloads, use_hnsw=args.hnsw)
+    save_local_store(args.out, store)
+    logger.info(f"Saved {len(store)} vectors to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
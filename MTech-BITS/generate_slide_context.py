@@ -1,9 +1,12 @@
+import os
+import importlib.util
 import PyPDF2
 import click
-import requests
-import json
+import httpx
 
-url = "http://192.168.1.16:11434/api/generate"
+url = "http://192.168.1.16:11434"
+# Shared LLM client of the Ass-2 app (pooling, concurrency limit, retries, circuit breaker)
+LLM_CLIENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Conversation-AI', 'Ass-2', 'llm_client.py')
 
 ALL_SUBJECT_TOKENS = {
     'DRL': """Here is the formatted version in Markdown:
@@ -21,10 +24,13 @@ ALL_SUBJECT_TOKENS = {
 """
 }
 
+def load_llm_client():
+    """Loads llm_client.py by path, so the rest of Ass-2 cannot shadow this script's imports."""
+    spec = importlib.util.spec_from_file_location('llm_client', LLM_CLIENT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
 
-headers = {
-  'Content-Type': 'application/json'
-}
 
 @click.command()
 @click.argument('pdf_file', type=click.Path(exists=True))
@@ -36,6 +42,7 @@ def pdf_to_text(pdf_file):
     # Get the number of pages in the PDF
     # num_pages = pdf_reader.numPages
     page_num = 0
+    backend = load_llm_client().get_backend(url)
     for page_obj in pdf_reader.pages:
         # page_obj = pdf_reader.getPage(page_num)
         text = page_obj.extract_text()
@@ -45,16 +52,10 @@ def pdf_to_text(pdf_file):
             # print(text)
             # pre_prompt = f'Name the topic being discussed in the following text in 10 words or less. Also from assign one single category to the topic among these.: \n{ALL_SUBJECT_TOKENS["DRL"]}\n . Output in one single line.\n'
             pre_prompt = f'Name the topic being discussed in the following text in 10 words or less. Just output the topic text, don\'t format it or say any additional text.\n'
-            payload = json.dumps({
-                # "model": "llama3.1:latest",
-                "model": "gemma2:latest",
-                "prompt": f"{pre_prompt} {text}",
-                "stream": False
-            })
-            response = requests.request("POST", url, headers=headers, data=payload)
             try:
-                cleaned_response = json.loads(response.text).get('response').rstrip('\n')
-            except AttributeError:
+                # model="llama3.1:latest"
+                cleaned_response = backend.generate("gemma2:latest", f"{pre_prompt} {text}").rstrip('\n')
+            except (httpx.HTTPError, ValueError):
                 cleaned_response = 'Unable to generate output'
             write_this = f"Slide {page_num+1}: {cleaned_response}"
             print(write_this)